@@ -0,0 +1,5 @@
+import os
+import sys
+
+# benchmark_pipeline.py is imported the way it is run, from this directory.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,102 @@
+import json
+import os
+import sys
+import wave
+
+import pytest
+
+from benchmark_pipeline import format_comparison, item_latencies, make_dataset, run_benchmark, run_process
+
+
+def read_dataset(paths):
+    data = {}
+    for name, path in paths.items():
+        with open(path) as f:
+            data[name] = json.load(f)
+    return data
+
+
+# --- Synthetic data ---
+
+def test_make_dataset_is_reproducible(tmp_path):
+    kwargs = dict(num_items=6, num_longform=5, num_scored=40, num_voices=4, audio_seconds=1.0)
+    first = make_dataset(str(tmp_path / 'first'), **kwargs)
+    second = make_dataset(str(tmp_path / 'second'), **kwargs)
+
+    first_data, second_data = read_dataset(first), read_dataset(second)
+    assert [len(first_data[name]) for name in ['sage', 'stereoset', 'mcqa_results', 'longform']] == [6, 6, 40, 5]
+    assert json.dumps(first_data).replace('first', 'second') == json.dumps(second_data)
+    first_audio = first_data['sage'][0]['Audio Path']
+    with open(first_audio, 'rb') as f, open(first_audio.replace('first', 'second'), 'rb') as g:
+        assert f.read() == g.read()
+
+
+def test_make_dataset_writes_the_audio_of_every_input(tmp_path):
+    data = read_dataset(make_dataset(str(tmp_path), num_items=4, num_longform=3, num_scored=4, num_voices=2,
+                                     audio_seconds=1.0))
+    audio_paths = [item['Audio Path'] for item in data['sage']] + [item['Audio path'] for item in data['longform']]
+    for path in audio_paths:
+        with wave.open(path, 'rb') as f:
+            assert f.getframerate() == 16000 and 0.5 <= f.getnframes() / 16000 <= 1.5
+    assert {os.path.basename(os.path.dirname(path)) for path in audio_paths} == {'polly_Joanna', 'polly_Matthew'}
+    assert data['stereoset'][0]['Anti-Stereo option'] == data['sage'][0]['Anti-Stereotypical option']
+
+
+# --- Measurements ---
+
+def test_run_process_reports_the_exit_code_and_resources(tmp_path):
+    log_path = str(tmp_path / 'stage.log')
+    result = run_process([sys.executable, '-c', "print('x' * 10); raise SystemExit(3)"], str(tmp_path), log_path)
+    assert result['exit_code'] == 3
+    assert result['seconds'] > 0 and result['peak_rss_bytes'] > 0
+    with open(log_path) as f:
+        assert f.read() == 'x' * 10 + '\n'
+    if result['io_write_bytes'] is not None:
+        assert result['io_write_bytes'] >= 11
+
+
+def test_item_latencies_count_every_item_of_a_batch(tmp_path):
+    metrics_path = tmp_path / 'metrics.jsonl'
+    metrics_path.write_text('\n'.join(json.dumps(record) for record in [
+        {'event': 'model_load', 'seconds': 3.0},
+        {'event': 'batch', 'num_items': 2, 'stages': {'featurise': 0.25, 'generate': 1.0}},
+        {'event': 'batch', 'num_items': 1, 'stages': {'generate': 0.5}},
+    ]) + '\n')
+    assert item_latencies(str(metrics_path)) == [1.25, 1.25, 0.5]
+    assert item_latencies(str(tmp_path / 'missing.jsonl')) == []
+
+
+def test_format_comparison():
+    def stage(items_per_sec, latency_p95, peak_rss_bytes):
+        return {'items_per_sec': items_per_sec, 'latency_p95': latency_p95, 'peak_rss_bytes': peak_rss_bytes}
+
+    baseline = {'commit': '1e5f8b3', 'timestamp': '20260101-120000',
+                'stages': {'judge': stage(100.0, None, 200), 'score_mcqa': stage(50.0, 0.5, 100)}}
+    current = {'stages': {'judge': stage(None, None, 100), 'score_mcqa': stage(75.0, 0.25, 100),
+                          'longform_scores': stage(10.0, None, 100)}}
+    lines = format_comparison(baseline, current).splitlines()
+    assert lines[0] == 'Compared with 1e5f8b3 (20260101-120000):'
+    assert lines[2].split() == ['judge', '-', '-', '-50.0%']
+    assert lines[3].split() == ['score_mcqa', '+50.0%', '-50.0%', '+0.0%']
+    assert len(lines) == 4
+
+
+# --- Stages ---
+
+def test_score_mcqa_stage(tmp_path):
+    results = run_benchmark(['score_mcqa'], str(tmp_path), num_items=2, num_longform=1, num_scored=60, num_voices=4,
+                            audio_seconds=0.5)
+    result = results['score_mcqa']
+    assert result['exit_code'] == 0, open(result['log']).read()
+    assert result['items'] == 60 and result['items_per_sec'] > 0
+    assert os.path.exists(tmp_path / 'outputs' / 'mcqa_scores.csv')
+
+
+def test_judge_and_longform_scores_stages(tmp_path):
+    pytest.importorskip('dotenv')
+    results = run_benchmark(['judge', 'longform_scores'], str(tmp_path), num_items=2, num_longform=8, num_scored=2,
+                            num_voices=2, audio_seconds=0.5)
+    for stage in ['judge', 'longform_scores']:
+        assert results[stage]['exit_code'] == 0, open(results[stage]['log']).read()
+        assert results[stage]['items'] == 8
+    assert os.path.exists(tmp_path / 'outputs' / 'longform_scores.npz')
@@ -49,31 +49,42 @@ dataset=$(jq -r '.dataset' "$CONFIG_FILE")
 val_dataset=$(jq -r '.val_dataset' "$CONFIG_FILE")
 # model=$(jq -r '.model' "$CONFIG_FILE")
 
+# Pack the JSONL files into memory-mapped shards once (see pack_finetune_data.py); later jobs reuse them.
+# Set PATH_MAP=OLD=NEW if the audio paths in the JSONL files point to another cluster.
+packed_dir=${PACKED_DIR:-packed_llama_omni}
+train_shard="$packed_dir/$(basename "$dataset" .jsonl)"
+val_shard="$packed_dir/$(basename "$val_dataset" .jsonl)"
+if [ ! -f "$train_shard/index.json" ] || [ ! -f "$val_shard/index.json" ]; then
+  echo "Packing $dataset and $val_dataset into $packed_dir..."
+  python pack_finetune_data.py \
+      --input_jsonl "$dataset" "$val_dataset" \
+      --model llama-omni \
+      --features log_mel \
+      --output_dir "$packed_dir" \
+      ${PATH_MAP:+--path_map "$PATH_MAP"}
+fi
+
+# Fine-tune Llama Omni from the shards; omni_speech must be installed from the local LLaMA-Omni repository. Batches
+# of 4 items with 4 accumulation steps keep the effective batch size of 16 of the earlier runs (batch size 1,
+# 16 accumulation steps); every item carries 30 s of speech, so the batches stay smaller than for qwen2.
+# Training stops unless the LoRA targets are the layers of the earlier run's sft_args.json.
 CUDA_VISIBLE_DEVICES=0 \
-CUDA_LAUNCH_BLOCKING=1 \
-swift sft \
-    --model_type llama3_1-8b-omni \
-    --model_id_or_path ICTNLP/Llama-3.1-8B-Omni \
-    --local_repo_path /proj/evaluating_afms/users/x_shrbo/ICASSP-NeurIPS_2025_submission/models/llama_omni/LLaMA-Omni \
-    --sft_type lora \
-    --dataset "$dataset" \
-    --val_dataset "$val_dataset" \
-    --num_train_epochs 7 \
-    --per_device_train_batch_size 1 \
-    --per_device_eval_batch_size 1 \
-    --learning_rate 1e-4 \
+python train_packed.py \
+    --model llama-omni \
+    --model_id ICTNLP/Llama-3.1-8B-Omni \
+    --train_shard "$train_shard" \
+    --val_shard "$val_shard" \
+    --output_dir "$output_dir" \
     --lora_rank "$lora_rank" \
     --lora_alpha 32 \
-    --gradient_accumulation_steps 16 \
-    --gradient_checkpointing False \
+    --reference_args llama_omni_lora8_neutral_FT/llama3_1-8b-omni/v0-20250807-100956/sft_args.json \
+    --num_train_epochs 7 \
+    --per_device_train_batch_size 4 \
+    --per_device_eval_batch_size 4 \
+    --gradient_accumulation_steps 4 \
+    --learning_rate 1e-4 \
+    --max_length 2048 \
     --eval_steps 50 \
     --save_steps 50 \
     --save_total_limit 7 \
-    --logging_steps 5 \
-    --output_dir "$output_dir" \
-    --system 'You are a helpful assistant.' \
-    --warmup_ratio 0.05 \
-    --dataloader_num_workers 4 \
-    --model_author swift \
-    --model_name swift-robot \
-    --freeze_parameters '' 
\ No newline at end of file
+    --dataloader_num_workers 4
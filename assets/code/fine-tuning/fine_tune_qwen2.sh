@@ -48,34 +48,43 @@ dataset=$(jq -r '.dataset' "$CONFIG_FILE")
 val_dataset=$(jq -r '.val_dataset' "$CONFIG_FILE")
 model=$(jq -r '.model' "$CONFIG_FILE")
 
-# Run inference with qwen2
+# Pack the JSONL files into memory-mapped shards once (see pack_finetune_data.py); later jobs reuse them.
+# Set PATH_MAP=OLD=NEW if the audio paths in the JSONL files point to another cluster.
+packed_dir=${PACKED_DIR:-packed_qwen2}
+train_shard="$packed_dir/$(basename "$dataset" .jsonl)"
+val_shard="$packed_dir/$(basename "$val_dataset" .jsonl)"
+if [ ! -f "$train_shard/index.json" ] || [ ! -f "$val_shard/index.json" ]; then
+  echo "Packing $dataset and $val_dataset into $packed_dir..."
+  python pack_finetune_data.py \
+      --input_jsonl "$dataset" "$val_dataset" \
+      --model qwen2 \
+      --model_id "$model" \
+      --features log_mel \
+      --output_dir "$packed_dir" \
+      ${PATH_MAP:+--path_map "$PATH_MAP"}
+fi
+
+# Fine-tune qwen2 from the shards. Length-bucketed batches of 8 items with 2 accumulation steps keep the effective
+# batch size of 16 of the earlier runs (batch size 1, 16 accumulation steps).
+# Training stops unless the LoRA targets are the layers of the earlier run's args.json.
 echo "Fine-tuning Qwen2 with config $CONFIG_FILE..."
 CUDA_VISIBLE_DEVICES=0 \
-swift sft \
-    --model "$model" \
-    --train_type lora \
-    --dataset "$dataset" \
-    --val_dataset "$val_dataset" \
-    --torch_dtype bfloat16 \
-    --num_train_epochs 7 \
-    --per_device_train_batch_size 1 \
-    --per_device_eval_batch_size 1 \
-    --learning_rate 1e-4 \
+python train_packed.py \
+    --model qwen2 \
+    --model_id "$model" \
+    --train_shard "$train_shard" \
+    --val_shard "$val_shard" \
+    --output_dir "$output_dir" \
     --lora_rank "$lora_rank" \
     --lora_alpha 32 \
-    --target_modules all-linear \
-    --gradient_accumulation_steps 16 \
+    --reference_args qwen_lora8_anti_FT/v0-20250730-203341/args.json \
+    --num_train_epochs 7 \
+    --per_device_train_batch_size 8 \
+    --per_device_eval_batch_size 8 \
+    --gradient_accumulation_steps 2 \
+    --learning_rate 1e-4 \
+    --max_length 2048 \
     --eval_steps 50 \
     --save_steps 50 \
     --save_total_limit 7 \
-    --logging_steps 5 \
-    --max_length 2048 \
-    --output_dir "$output_dir" \
-    --system 'You are a helpful assistant.' \
-    --warmup_ratio 0.05 \
-    --dataloader_num_workers 4 \
-    --model_author swift \
-    --model_name swift-robot \
-    --use_hf True \
-    --load_from_cache_file False \
-    --freeze_parameters '' \
+    --dataloader_num_workers 4
@@ -0,0 +1,500 @@
+'''
+Packs the fine-tuning JSONL files (train_anti.jsonl, validation_anti.jsonl: one chat in "messages" plus its "audios")
+into memory-mapped shards, so that the 7 training epochs stop re-decoding, re-resampling and re-tokenising every item.
+Each input file becomes one shard directory holding:
+
+- features.bin: the resampled audio, or its unpadded (mel bins, frames) log-mel features, as float16. The log-mel
+  features are those the model is fed: Qwen2-Audio's WhisperFeatureExtractor, or for LLaMA-Omni the openai-whisper
+  log_mel_spectrogram that omni_speech uses (its Hugging Face repo has no feature extractor config);
+- tokens.bin: the int32 token ids of the whole chat, with the audio as a single placeholder id that PackedCollator
+  expands (Qwen2-Audio's <|AUDIO|>) or leaves for the model to splice the speech embeddings into (LLaMA-Omni's
+  SPEECH_TOKEN_INDEX, -200);
+- index.json: per item the offsets, the number of tokens, where the labels start (the assistant answer), the number of
+  audio tokens and the total length used for bucketing, plus the system prompt of the chats.
+
+Qwen2-Audio chats are rendered with the tokenizer's chat template. LLaMA-Omni chats are rendered and tokenised with the
+omni_speech conversation template and tokenizer that its inference prompts use, so a trained adapter sees the same
+prompt layout at inference (where the system prompt is read from the adapter's args.json or sft_args.json).
+
+The audio paths in the JSONL files are absolute paths on the cluster they were made on; --path_map rewrites their
+prefixes while packing. The shards only hold offsets relative to their own directory, so they can be copied to any
+cluster as they are. LengthBucketSampler groups items of similar length into batches (optionally under a token
+budget), so the per-device batch size can grow beyond 1 with little padding. PackedCollator pads a batch into model
+inputs; train_packed.py trains the LoRA adapters from the shards with both.
+
+    python pack_finetune_data.py --input_jsonl train_anti.jsonl validation_anti.jsonl --model qwen2 --features log_mel \
+        --path_map /proj/evaluating_afms/users/x_shrbo/ICASSP-NeurIPS_2025_submission/MCQA_suite_creation/SAGE/tts_output_final=../../datasets/mcqa_long-form/tts_output
+
+'''
+
+import argparse
+import json
+import os
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+SAMPLE_RATE = 16000
+SYSTEM_PROMPT = 'You are a helpful assistant.'
+INDEX_NAME = 'index.json'
+FEATURES_NAME = 'features.bin'
+TOKENS_NAME = 'tokens.bin'
+# Label value ignored by the cross-entropy loss of transformers.
+IGNORE_INDEX = -100
+# How the '<audio>' tag of the JSONL messages is written for each model, and which token stands for the audio.
+MODELS = {
+    'qwen2': {
+        'model_id': 'Qwen/Qwen2-Audio-7B-Instruct',
+        'audio_text': 'Audio 1: <|audio_bos|><|AUDIO|><|audio_eos|>\n',
+        'audio_marker': '<|AUDIO|>',
+    },
+    'llama-omni': {
+        'model_id': 'ICTNLP/Llama-3.1-8B-Omni',
+        'audio_text': '<speech>\n',
+        'audio_marker': '<speech>',
+        # SPEECH_TOKEN_INDEX of omni_speech; the speech embeddings are spliced in at this position.
+        'audio_token_id': -200,
+        # Conversation template of omni_speech that inference/llama_omni_inference.py builds its prompts with.
+        'conv_mode': 'llama_3',
+    },
+}
+# Both models see 100 log-mel frames per second (a hop of 160 samples) and at most 30 s of audio.
+HOP_LENGTH = 160
+MEL_FRAMES = 3000
+# Mel bins of the Whisper large-v3 encoder of LLaMA-Omni.
+LLAMA_OMNI_MEL_BINS = 128
+# LLaMA-Omni pads or trims every clip to 30 s (1500 encoder frames), downsampled 5x by the speech projector.
+LLAMA_OMNI_AUDIO_TOKENS = 300
+
+
+def parse_path_map(pairs):
+    """
+    Parses OLD=NEW prefix pairs into a list sorted longest prefix first.
+    """
+    path_map = []
+    for pair in pairs or []:
+        old, sep, new = pair.partition('=')
+        if not sep:
+            raise ValueError(f"Path mapping '{pair}' is not of the form OLD=NEW.")
+        path_map.append((old.rstrip('/'), new.rstrip('/')))
+    return sorted(path_map, key=lambda mapping: -len(mapping[0]))
+
+
+def remap_path(path, path_map):
+    """
+    Replaces the longest matching prefix of `path` in `path_map`; paths without a match are returned unchanged.
+    """
+    for old, new in path_map:
+        if path == old or path.startswith(old + '/'):
+            return new + path[len(old):]
+    return path
+
+
+def qwen2_audio_tokens(num_frames):
+    """
+    Returns the number of audio tokens of Qwen2-Audio for a clip of `num_frames` log-mel frames: the encoder's conv
+    stride halves the frames and its pooling layer halves them again (as in Qwen2AudioProcessor).
+    """
+    return ((num_frames - 1) // 2 + 1 - 2) // 2 + 1
+
+
+def num_audio_tokens(model, duration):
+    if model == 'qwen2':
+        # Log-mel features have one frame per full hop, as PackedCollator counts them.
+        return qwen2_audio_tokens(min(round(duration * SAMPLE_RATE) // HOP_LENGTH, MEL_FRAMES))
+    return LLAMA_OMNI_AUDIO_TOKENS
+
+
+def encode_chat(tokenizer, text, audio_marker, audio_token_id):
+    """
+    Tokenises a templated chat, with every audio marker replaced by the single `audio_token_id`.
+    """
+    ids = []
+    for position, chunk in enumerate(text.split(audio_marker)):
+        if position > 0:
+            ids.append(audio_token_id)
+        ids.extend(tokenizer(chunk, add_special_tokens=False)['input_ids'])
+    return ids
+
+
+def chat_texts(tokenizer, chat, model):
+    """
+    Returns the templated text of a chat up to the answer (ending with the assistant header) and of the whole chat.
+    LLaMA-Omni uses the omni_speech conversation template of its inference prompts, other models their tokenizer's
+    chat template.
+    """
+    if model == 'llama-omni':
+        from omni_speech.conversation import conv_templates
+
+        conv = conv_templates[MODELS[model]['conv_mode']].copy()
+        conv.system = chat[0]['content']
+        for message in chat[1:]:
+            conv.append_message(conv.roles[0] if message['role'] == 'user' else conv.roles[1], message['content'])
+        full_text = conv.get_prompt()
+        conv.messages[-1][1] = None
+        return conv.get_prompt(), full_text
+    return (tokenizer.apply_chat_template(chat[:-1], add_generation_prompt=True, tokenize=False),
+            tokenizer.apply_chat_template(chat, tokenize=False))
+
+
+def tokenize_row(tokenizer, row, model, system=SYSTEM_PROMPT):
+    """
+    Returns the token ids of a chat (system prompt, user turn, assistant answer) and the position where the answer
+    starts; only the answer is trained on. LLaMA-Omni chats are tokenised with omni_speech's tokenizer_speech_token,
+    like its inference prompts.
+    """
+    template = MODELS[model]
+    audio_token_id = template.get('audio_token_id', tokenizer.convert_tokens_to_ids(template['audio_marker']))
+    chat = [{'role': 'system', 'content': system}] + [
+        {'role': message['role'], 'content': message['content'].replace('<audio>', template['audio_text'])}
+        for message in row['messages']
+    ]
+    prompt_text, full_text = chat_texts(tokenizer, chat, model)
+    if model == 'llama-omni':
+        from omni_speech.datasets.preprocess import tokenizer_speech_token
+
+        prompt_ids = tokenizer_speech_token(prompt_text, tokenizer, audio_token_id)
+        input_ids = tokenizer_speech_token(full_text, tokenizer, audio_token_id)
+    else:
+        prompt_ids = encode_chat(tokenizer, prompt_text, template['audio_marker'], audio_token_id)
+        input_ids = encode_chat(tokenizer, full_text, template['audio_marker'], audio_token_id)
+    if input_ids[:len(prompt_ids)] != prompt_ids:
+        raise ValueError("The chat template does not extend the prompt with the answer; cannot mask the labels.")
+    return input_ids, len(prompt_ids)
+
+
+def log_mel_featuriser(model, model_id=None):
+    """
+    Returns a function that computes the unpadded (mel bins, frames) log-mel features of 16 kHz audio the way the
+    model does: Qwen2-Audio's WhisperFeatureExtractor, or the openai-whisper log_mel_spectrogram of omni_speech.
+    """
+    # transformers and whisper are imported on first use, so that --help stays fast.
+    if model == 'llama-omni':
+        import whisper
+
+        def featurise(audio_data):
+            audio_data = np.asarray(audio_data[:MEL_FRAMES * HOP_LENGTH], dtype=np.float32)
+            return whisper.log_mel_spectrogram(audio_data, n_mels=LLAMA_OMNI_MEL_BINS).numpy()
+        return featurise
+
+    from transformers import AutoFeatureExtractor
+
+    feature_extractor = AutoFeatureExtractor.from_pretrained(model_id or MODELS[model]['model_id'])
+
+    def featurise(audio_data):
+        features = feature_extractor(audio_data, sampling_rate=SAMPLE_RATE, padding='longest', return_tensors='np')
+        return features['input_features'][0]
+    return featurise
+
+
+def load_features(audio_path, featurise=None):
+    """
+    Returns the 16 kHz audio of a file, or its log-mel features if a featuriser (see log_mel_featuriser) is given, and
+    the audio duration in seconds.
+    """
+    # librosa is imported on first use, so that --help stays fast.
+    import librosa
+
+    audio_data, _ = librosa.load(audio_path, sr=SAMPLE_RATE)
+    duration = len(audio_data) / SAMPLE_RATE
+    if featurise is None:
+        return audio_data, duration
+    return featurise(audio_data), duration
+
+
+def pack_shard(rows, shard_dir, tokenizer, model, featurise=None, path_map=None, num_workers=8,
+               system=SYSTEM_PROMPT):
+    """
+    Packs chat rows into a shard directory and returns the number of packed and skipped rows. Rows whose audio file
+    is missing (after path remapping) are skipped with a warning.
+    """
+    os.makedirs(shard_dir, exist_ok=True)
+    audio_paths = [remap_path(row['audios'][0], path_map or []) for row in rows]
+    found = [os.path.exists(audio_path) for audio_path in audio_paths]
+    for audio_path, exists in zip(audio_paths, found):
+        if not exists:
+            print(f"Warning: Audio file not found at {audio_path}. Skipping.")
+    rows = [row for row, exists in zip(rows, found) if exists]
+    audio_paths = [audio_path for audio_path, exists in zip(audio_paths, found) if exists]
+
+    items = []
+    feature_offset = token_offset = 0
+    features_path = os.path.join(shard_dir, FEATURES_NAME)
+    tokens_path = os.path.join(shard_dir, TOKENS_NAME)
+    # Decoding and resampling run in worker threads; the results are written in input order.
+    with ThreadPoolExecutor(max_workers=num_workers) as pool, \
+            open(features_path + '.tmp', 'wb') as features_file, open(tokens_path + '.tmp', 'wb') as tokens_file:
+        loaded = pool.map(lambda audio_path: load_features(audio_path, featurise), audio_paths)
+        for row, audio_path, (features, duration) in zip(rows, audio_paths, loaded):
+            input_ids, label_start = tokenize_row(tokenizer, row, model, system=system)
+            audio_tokens = num_audio_tokens(model, duration)
+            features_file.write(features.astype(np.float16).tobytes())
+            tokens_file.write(np.asarray(input_ids, dtype=np.int32).tobytes())
+            items.append({
+                'audio_path': row['audios'][0],
+                'feature_offset': feature_offset,
+                'feature_shape': list(features.shape),
+                'token_offset': token_offset,
+                'num_tokens': len(input_ids),
+                'label_start': label_start,
+                'num_audio_tokens': audio_tokens,
+                # The placeholder token is replaced by the audio tokens.
+                'length': len(input_ids) - 1 + audio_tokens,
+                'duration': duration,
+            })
+            feature_offset += features.size
+            token_offset += len(input_ids)
+
+    index = {
+        'model': model,
+        'model_id': MODELS[model]['model_id'],
+        'features': 'log_mel' if featurise is not None else 'audio',
+        'sample_rate': SAMPLE_RATE,
+        'system': system,
+        'items': items,
+    }
+    os.replace(features_path + '.tmp', features_path)
+    os.replace(tokens_path + '.tmp', tokens_path)
+    with open(os.path.join(shard_dir, INDEX_NAME + '.tmp'), 'w') as f:
+        json.dump(index, f)
+    os.replace(os.path.join(shard_dir, INDEX_NAME + '.tmp'), os.path.join(shard_dir, INDEX_NAME))
+    return len(items), len(found) - len(items)
+
+
+class PackedShard:
+    """
+    Read-only, memory-mapped view of a packed shard. Items are returned as numpy arrays, ready for a collator.
+    """
+
+    def __init__(self, shard_dir):
+        with open(os.path.join(shard_dir, INDEX_NAME), 'r') as f:
+            index = json.load(f)
+        self.model = index['model']
+        self.features = index['features']
+        self.items = index['items']
+        self.system = index.get('system')
+        self.lengths = [item['length'] for item in self.items]
+        # np.memmap cannot map an empty file.
+        self.feature_blob = self._memmap(os.path.join(shard_dir, FEATURES_NAME), np.float16)
+        self.token_blob = self._memmap(os.path.join(shard_dir, TOKENS_NAME), np.int32)
+
+    @staticmethod
+    def _memmap(path, dtype):
+        if os.path.getsize(path) == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode='r')
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, idx):
+        """
+        Returns the token ids, the labels (IGNORE_INDEX up to the answer and at the audio placeholder), the float32
+        audio or log-mel features and the original audio path of an item.
+        """
+        item = self.items[idx]
+        input_ids = self.token_blob[item['token_offset']:item['token_offset'] + item['num_tokens']].astype(np.int64)
+        labels = input_ids.copy()
+        labels[:item['label_start']] = IGNORE_INDEX
+        num_values = int(np.prod(item['feature_shape']))
+        features = self.feature_blob[item['feature_offset']:item['feature_offset'] + num_values]
+        return {
+            'input_ids': input_ids,
+            'labels': labels,
+            'features': features.astype(np.float32).reshape(item['feature_shape']),
+            'audio_path': item['audio_path'],
+        }
+
+
+class LengthBucketSampler:
+    """
+    Batch sampler that groups items of similar length. Every epoch the items are shuffled and split into pools of
+    `pool_size` batches; each pool is sorted by length and cut into batches of at most `batch_size` items whose padded
+    size (number of items times the longest item) stays under `max_tokens_per_batch`. The batch order is shuffled
+    again, so similar lengths do not mean a fixed order. Can be passed as `batch_sampler` to a torch DataLoader.
+
+    Without `max_tokens_per_batch`, every batch but at most one per epoch holds exactly `batch_size` items, and the
+    number of batches is the same in every epoch. With it, batches are cut short by an amount that changes with the
+    shuffling, so both the batch sizes and the number of batches can change from epoch to epoch.
+    """
+
+    def __init__(self, lengths, batch_size=16, max_tokens_per_batch=None, pool_size=50, shuffle=True, seed=0):
+        self.lengths = lengths
+        self.batch_size = batch_size
+        self.max_tokens_per_batch = max_tokens_per_batch
+        self.pool_size = pool_size
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        """
+        Sets the epoch, which reseeds the shuffling (the same convention as torch's DistributedSampler).
+        """
+        self.epoch = epoch
+
+    def _batches(self):
+        rng = random.Random(self.seed + self.epoch)
+        order = list(range(len(self.lengths)))
+        if self.shuffle:
+            rng.shuffle(order)
+
+        batches = []
+        pool_items = self.pool_size * self.batch_size
+        for start in range(0, len(order), pool_items):
+            pool = sorted(order[start:start + pool_items], key=lambda i: (self.lengths[i], i))
+            batch = []
+            for idx in pool:
+                # The pool is sorted by length, so the newest item is always the longest one in the batch.
+                padded_size = (len(batch) + 1) * self.lengths[idx]
+                too_many_tokens = self.max_tokens_per_batch is not None and padded_size > self.max_tokens_per_batch
+                if batch and (len(batch) >= self.batch_size or too_many_tokens):
+                    batches.append(batch)
+                    batch = []
+                batch.append(idx)
+            if batch:
+                batches.append(batch)
+        if self.shuffle:
+            rng.shuffle(batches)
+        return batches
+
+    def __iter__(self):
+        return iter(self._batches())
+
+    def __len__(self):
+        return len(self._batches())
+
+
+def pad_log_mel(features, num_frames=MEL_FRAMES):
+    """
+    Pads or trims (mel bins, frames) log-mel features to `num_frames` frames, and returns them with the mask of the
+    real frames. Padding uses the value Whisper's log-mel gives silence: the clip's maximum minus 8 (log10 units),
+    normalised, i.e. the maximum minus 2.
+    """
+    features = features[:, :num_frames]
+    padded = np.full((features.shape[0], num_frames), features.max() - 2.0 if features.size else 0.0, np.float32)
+    padded[:, :features.shape[1]] = features
+    mask = np.zeros(num_frames, dtype=np.int64)
+    mask[:features.shape[1]] = 1
+    return padded, mask
+
+
+class PackedCollator:
+    """
+    Pads the items of a PackedShard into a batch of model inputs, as numpy arrays. Token ids are right-padded with
+    `pad_token_id` and their labels with IGNORE_INDEX. Shards of raw audio are featurised here with `featurise`
+    (see log_mel_featuriser); log-mel shards are only padded to 30 s.
+
+    - qwen2: the <|AUDIO|> placeholder is expanded to one token per audio token, as Qwen2AudioProcessor does, and the
+      batch holds input_features (batch, mel bins, 3000) and feature_attention_mask;
+    - llama-omni: the -200 placeholder is kept, since omni_speech splices the speech embeddings in itself, and the
+      batch holds speech (batch, 3000, mel bins) and speech_lengths, as in inference/llama_omni_inference.py.
+    """
+
+    def __init__(self, model, pad_token_id, audio_token_id, featurise=None):
+        self.model = model
+        self.pad_token_id = pad_token_id
+        self.audio_token_id = audio_token_id
+        self.featurise = featurise
+
+    def _expand_audio(self, input_ids, labels, num_tokens):
+        position = int(np.flatnonzero(input_ids == self.audio_token_id)[0])
+        input_ids = np.concatenate([input_ids[:position], np.full(num_tokens, self.audio_token_id),
+                                    input_ids[position + 1:]])
+        labels = np.concatenate([labels[:position], np.full(num_tokens, IGNORE_INDEX), labels[position + 1:]])
+        return input_ids, labels
+
+    def __call__(self, items):
+        rows, features, masks = [], [], []
+        for item in items:
+            item_features = item['features']
+            if item_features.ndim == 1:
+                item_features = self.featurise(item_features)
+            padded, mask = pad_log_mel(item_features)
+            input_ids, labels = item['input_ids'], item['labels']
+            if self.model == 'qwen2':
+                input_ids, labels = self._expand_audio(input_ids, labels, qwen2_audio_tokens(int(mask.sum())))
+            rows.append((input_ids, labels))
+            features.append(padded)
+            masks.append(mask)
+
+        max_len = max(len(input_ids) for input_ids, _ in rows)
+        batch_input_ids = np.full((len(rows), max_len), self.pad_token_id, dtype=np.int64)
+        batch_labels = np.full((len(rows), max_len), IGNORE_INDEX, dtype=np.int64)
+        attention_mask = np.zeros((len(rows), max_len), dtype=np.int64)
+        for row, (input_ids, labels) in enumerate(rows):
+            batch_input_ids[row, :len(input_ids)] = input_ids
+            batch_labels[row, :len(labels)] = labels
+            attention_mask[row, :len(input_ids)] = 1
+
+        batch = {'input_ids': batch_input_ids, 'attention_mask': attention_mask, 'labels': batch_labels}
+        if self.model == 'qwen2':
+            batch['input_features'] = np.stack(features)
+            batch['feature_attention_mask'] = np.stack(masks)
+        else:
+            batch['speech'] = np.stack(features).transpose(0, 2, 1)
+            batch['speech_lengths'] = np.full(len(rows), MEL_FRAMES, dtype=np.int64)
+        return batch
+
+
+def padding_efficiency(lengths, batches):
+    """
+    Returns the share of real tokens among the padded tokens of a list of batches.
+    """
+    real = sum(lengths[idx] for batch in batches for idx in batch)
+    padded = sum(len(batch) * max(lengths[idx] for idx in batch) for batch in batches)
+    return real / padded if padded else 1.0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Pack fine-tuning JSONL files into memory-mapped shards.")
+    parser.add_argument('--input_jsonl', type=str, nargs='+', required=True,
+                        help="Fine-tuning JSONL files with 'messages' and 'audios'; each becomes one shard.")
+    parser.add_argument('--output_dir', type=str, default='packed',
+                        help="Directory of the shards, one subdirectory per input file. Default is 'packed'.")
+    parser.add_argument('--model', type=str, default='qwen2', choices=sorted(MODELS),
+                        help="Model whose tokenizer and chat template are used. Default is qwen2.")
+    parser.add_argument('--model_id', type=str, default=None,
+                        help="Tokenizer/processor to load. Default is the model's Hugging Face ID.")
+    parser.add_argument('--features', type=str, default='audio', choices=['audio', 'log_mel'],
+                        help="Store the resampled audio or the model's unpadded log-mel features (Whisper's for "
+                             "llama-omni). Default is audio.")
+    parser.add_argument('--path_map', type=str, nargs='+', default=None,
+                        help="OLD=NEW prefix rewrites of the audio paths, e.g. from the original cluster to this one.")
+    parser.add_argument('--system', type=str, default=SYSTEM_PROMPT,
+                        help="System prompt of the chat, as passed to swift sft --system. Default is 'You are a helpful assistant.'")
+    parser.add_argument('--num_workers', type=int, default=8,
+                        help="Threads that decode and resample audio. Default is 8.")
+    parser.add_argument('--max_tokens_per_batch', type=int, default=None,
+                        help="Token budget used to report the padding efficiency of the bucketed batches.")
+    parser.add_argument('--batch_size', type=int, default=16,
+                        help="Batch size used to report the padding efficiency of the bucketed batches. Default is 16.")
+    args = parser.parse_args()
+
+    from transformers import AutoTokenizer
+
+    model_id = args.model_id or MODELS[args.model]['model_id']
+    tokenizer = AutoTokenizer.from_pretrained(model_id, trust_remote_code=True)
+    featurise = log_mel_featuriser(args.model, model_id) if args.features == 'log_mel' else None
+    path_map = parse_path_map(args.path_map)
+
+    for input_jsonl in args.input_jsonl:
+        with open(input_jsonl, 'r') as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+        shard_dir = os.path.join(args.output_dir, os.path.splitext(os.path.basename(input_jsonl))[0])
+        num_packed, num_skipped = pack_shard(
+            rows, shard_dir, tokenizer, args.model, featurise=featurise, path_map=path_map,
+            num_workers=args.num_workers, system=args.system
+        )
+        print(f"Packed {num_packed} items of {input_jsonl} into {shard_dir} ({num_skipped} skipped)")
+
+        lengths = PackedShard(shard_dir).lengths
+        if lengths:
+            batches = list(LengthBucketSampler(lengths, batch_size=args.batch_size,
+                                               max_tokens_per_batch=args.max_tokens_per_batch))
+            shuffled = [list(range(len(lengths)))[start:start + args.batch_size]
+                        for start in range(0, len(lengths), args.batch_size)]
+            print(f"Lengths {min(lengths)}-{max(lengths)} tokens; padding efficiency "
+                  f"{padding_efficiency(lengths, batches):.1%} bucketed vs {padding_efficiency(lengths, shuffled):.1%} "
+                  f"in input order, over {len(batches)} batches")
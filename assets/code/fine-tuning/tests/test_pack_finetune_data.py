@@ -0,0 +1,215 @@
+import numpy as np
+import pytest
+
+import pack_finetune_data
+from pack_finetune_data import (IGNORE_INDEX, MEL_FRAMES, LengthBucketSampler, PackedCollator, PackedShard,
+                                chat_texts, num_audio_tokens, pack_shard, pad_log_mel, padding_efficiency,
+                                parse_path_map, qwen2_audio_tokens, remap_path, tokenize_row)
+
+QWEN2_AUDIO_ID = 151646
+
+
+class Encoding(dict):
+    @property
+    def input_ids(self):
+        return self['input_ids']
+
+
+class FakeTokenizer:
+    """
+    Character-level tokenizer with a ChatML template, enough for tokenize_row.
+    """
+
+    bos_token_id = 1
+
+    def __call__(self, text, add_special_tokens=True):
+        return Encoding(input_ids=[ord(char) for char in text])
+
+    def convert_tokens_to_ids(self, token):
+        return QWEN2_AUDIO_ID
+
+    def apply_chat_template(self, chat, add_generation_prompt=False, tokenize=True):
+        text = ''.join(f"<|im_start|>{message['role']}\n{message['content']}<|im_end|>\n" for message in chat)
+        return text + ('<|im_start|>assistant\n' if add_generation_prompt else '')
+
+
+def make_row(answer='B: Principal'):
+    return {
+        'messages': [
+            {'role': 'user', 'content': '<audio>Who is speaking?'},
+            {'role': 'assistant', 'content': answer},
+        ],
+        'audios': ['/proj/old/tts_output/speaker_1.wav'],
+    }
+
+
+# --- Path remapping ---
+
+def test_remap_path_uses_the_longest_matching_prefix():
+    path_map = parse_path_map(['/proj/old=/data/new', '/proj/old/tts_output/=/fast/tts'])
+    assert remap_path('/proj/old/tts_output/a.wav', path_map) == '/fast/tts/a.wav'
+    assert remap_path('/proj/old/other/a.wav', path_map) == '/data/new/other/a.wav'
+
+
+def test_remap_path_only_matches_whole_path_components():
+    path_map = parse_path_map(['/proj/old=/data/new'])
+    assert remap_path('/proj/older/a.wav', path_map) == '/proj/older/a.wav'
+    assert remap_path('/proj/old', path_map) == '/data/new'
+    assert remap_path('relative/a.wav', []) == 'relative/a.wav'
+
+
+def test_parse_path_map_rejects_pairs_without_separator():
+    with pytest.raises(ValueError, match='OLD=NEW'):
+        parse_path_map(['/proj/old'])
+
+
+# --- Tokenisation and label masking ---
+
+def test_tokenize_row_masks_everything_but_the_answer():
+    input_ids, label_start = tokenize_row(FakeTokenizer(), make_row(), 'qwen2')
+    assert input_ids.count(QWEN2_AUDIO_ID) == 1
+    assert input_ids.index(QWEN2_AUDIO_ID) < label_start
+    answer = ''.join(chr(token) for token in input_ids[label_start:])
+    assert answer == 'B: Principal<|im_end|>\n'
+
+
+def test_llama_omni_chats_use_the_inference_template():
+    conversation = pytest.importorskip('omni_speech.conversation')
+    input_ids, label_start = tokenize_row(FakeTokenizer(), make_row(), 'llama-omni', system='Be brief.')
+    assert input_ids.count(-200) == 1 and input_ids.index(-200) < label_start
+    assert ''.join(chr(token) for token in input_ids[label_start:]) == 'B: Principal<|eot_id|>'
+
+    # The prompt is the one llama_omni_inference.build_prompt builds for the same question and system prompt.
+    conv = conversation.conv_templates['llama_3'].copy()
+    conv.system = 'Be brief.'
+    conv.append_message(conv.roles[0], '<speech>\nWho is speaking?')
+    conv.append_message(conv.roles[1], None)
+    chat = [{'role': 'system', 'content': 'Be brief.'}, {'role': 'user', 'content': '<speech>\nWho is speaking?'},
+            {'role': 'assistant', 'content': 'B: Principal'}]
+    assert chat_texts(FakeTokenizer(), chat, 'llama-omni')[0] == conv.get_prompt()
+
+
+def test_packed_shard_labels_follow_the_label_start(tmp_path, monkeypatch):
+    audio_path = tmp_path / 'speaker_1.wav'
+    audio_path.write_bytes(b'')
+    monkeypatch.setattr(pack_finetune_data, 'load_features',
+                        lambda path, featurise=None: (np.full(32000, 0.5, dtype=np.float32), 2.0))
+
+    rows = [make_row(), make_row('A: Nurse'), dict(make_row(), audios=['/proj/old/tts_output/missing.wav'])]
+    num_packed, num_skipped = pack_shard(rows, str(tmp_path / 'shard'), FakeTokenizer(), 'qwen2',
+                                         path_map=parse_path_map([f'/proj/old/tts_output={tmp_path}']))
+    assert (num_packed, num_skipped) == (2, 1)
+
+    shard = PackedShard(str(tmp_path / 'shard'))
+    item = shard[1]
+    _, label_start = tokenize_row(FakeTokenizer(), make_row('A: Nurse'), 'qwen2')
+    assert (item['labels'][:label_start] == IGNORE_INDEX).all()
+    assert (item['labels'][label_start:] == item['input_ids'][label_start:]).all()
+    assert item['features'].shape == (32000,)
+    assert item['audio_path'] == '/proj/old/tts_output/speaker_1.wav'
+    assert shard.lengths[1] == len(item['input_ids']) - 1 + num_audio_tokens('qwen2', 2.0)
+
+
+# --- Collation ---
+
+def test_num_audio_tokens():
+    assert qwen2_audio_tokens(100) == 25
+    assert num_audio_tokens('qwen2', 1.0) == 25
+    assert num_audio_tokens('qwen2', 45.0) == qwen2_audio_tokens(MEL_FRAMES) == 750
+    assert num_audio_tokens('llama-omni', 1.0) == 300
+
+
+def test_pad_log_mel_pads_with_silence_and_trims():
+    features = np.linspace(-1.0, 1.0, 128 * 200, dtype=np.float32).reshape(128, 200)
+    padded, mask = pad_log_mel(features)
+    assert padded.shape == (128, MEL_FRAMES) and mask.sum() == 200
+    assert np.allclose(padded[:, 200:], -1.0)
+
+    padded, mask = pad_log_mel(np.zeros((128, MEL_FRAMES + 10), dtype=np.float32))
+    assert padded.shape == (128, MEL_FRAMES) and mask.all()
+
+
+def packed_item(num_text_tokens, audio_id, label_start, num_frames):
+    input_ids = np.arange(1, num_text_tokens + 1, dtype=np.int64)
+    input_ids[2] = audio_id
+    labels = input_ids.copy()
+    labels[:label_start] = IGNORE_INDEX
+    return {'input_ids': input_ids, 'labels': labels, 'features': np.zeros((128, num_frames), dtype=np.float32)}
+
+
+def test_qwen2_collator_expands_the_audio_placeholder():
+    items = [packed_item(10, QWEN2_AUDIO_ID, 6, 400), packed_item(8, QWEN2_AUDIO_ID, 5, 100)]
+    batch = PackedCollator('qwen2', pad_token_id=0, audio_token_id=QWEN2_AUDIO_ID)(items)
+
+    assert batch['feature_attention_mask'].sum(axis=1).tolist() == [400, 100]
+    assert batch['input_features'].shape == (2, 128, MEL_FRAMES)
+    assert (batch['input_ids'] == QWEN2_AUDIO_ID).sum(axis=1).tolist() == [100, 25]
+    assert batch['attention_mask'].sum(axis=1).tolist() == [10 - 1 + 100, 8 - 1 + 25]
+    # Only the answer is trained on; the audio tokens and the right padding are ignored.
+    assert (batch['labels'][0, :105] == IGNORE_INDEX).all()
+    assert batch['labels'][0, 105:109].tolist() == [7, 8, 9, 10]
+    assert batch['labels'][1, 29:33].tolist() == [6, 7, 8, IGNORE_INDEX]
+    assert batch['input_ids'][1, 32:].tolist() == [0] * (109 - 32)
+
+
+def test_llama_omni_collator_keeps_the_speech_placeholder():
+    items = [packed_item(10, -200, 6, 400), packed_item(8, -200, 5, 100)]
+    batch = PackedCollator('llama-omni', pad_token_id=128004, audio_token_id=-200)(items)
+
+    assert batch['input_ids'].shape == (2, 10)
+    assert (batch['input_ids'] == -200).sum(axis=1).tolist() == [1, 1]
+    assert batch['input_ids'][1, 8:].tolist() == [128004, 128004]
+    assert batch['speech'].shape == (2, MEL_FRAMES, 128)
+    assert batch['speech_lengths'].tolist() == [MEL_FRAMES, MEL_FRAMES]
+
+
+def test_collator_featurises_raw_audio():
+    item = packed_item(8, QWEN2_AUDIO_ID, 5, 0)
+    item['features'] = np.zeros(16000, dtype=np.float32)
+    collator = PackedCollator('qwen2', 0, QWEN2_AUDIO_ID,
+                              featurise=lambda audio: np.zeros((128, len(audio) // 160), dtype=np.float32))
+    assert collator([item])['feature_attention_mask'].sum() == 100
+
+
+# --- Length bucketing ---
+
+LENGTHS = [int(length) for length in np.random.default_rng(0).integers(50, 800, size=203)]
+
+
+def test_sampler_yields_every_item_once_within_the_limits():
+    sampler = LengthBucketSampler(LENGTHS, batch_size=8, max_tokens_per_batch=3000, pool_size=5)
+    batches = list(sampler)
+    assert sorted(idx for batch in batches for idx in batch) == list(range(len(LENGTHS)))
+    assert len(batches) == len(sampler)
+    for batch in batches:
+        assert len(batch) <= 8
+        assert len(batch) == 1 or len(batch) * max(LENGTHS[idx] for idx in batch) <= 3000
+
+
+def test_sampler_without_token_budget_keeps_the_batch_size_every_epoch():
+    # train_packed.py relies on this: the scheduler counts len(sampler) batches per epoch.
+    sampler = LengthBucketSampler(LENGTHS, batch_size=8, pool_size=5, seed=1)
+    for epoch in range(3):
+        sampler.set_epoch(epoch)
+        sizes = [len(batch) for batch in sampler]
+        assert len(sizes) == len(sampler) == -(-len(LENGTHS) // 8)
+        assert sorted(sizes)[1:] == [8] * (len(sizes) - 1) and sorted(sizes)[0] == len(LENGTHS) % 8
+
+
+def test_sampler_reshuffles_per_epoch_reproducibly():
+    sampler = LengthBucketSampler(LENGTHS, batch_size=8, seed=3)
+    first = list(sampler)
+    assert list(sampler) == first
+    sampler.set_epoch(1)
+    assert list(sampler) != first
+    sampler.set_epoch(0)
+    assert list(sampler) == first
+
+
+def test_sampler_without_shuffle_is_sorted_and_pads_less():
+    batches = list(LengthBucketSampler(LENGTHS, batch_size=8, pool_size=1000, shuffle=False))
+    flat = [idx for batch in batches for idx in batch]
+    assert [LENGTHS[idx] for idx in flat] == sorted(LENGTHS)
+
+    in_order = [list(range(start, min(start + 8, len(LENGTHS)))) for start in range(0, len(LENGTHS), 8)]
+    assert padding_efficiency(LENGTHS, batches) > padding_efficiency(LENGTHS, in_order)
@@ -0,0 +1,43 @@
+import json
+import re
+
+import pytest
+
+for module in ('torch', 'peft', 'transformers'):
+    pytest.importorskip(module)
+from train_packed import LORA_TARGETS, check_lora_targets, reference_lora_targets
+
+LLAMA_OMNI_LINEAR = [
+    'model.layers.0.self_attn.q_proj', 'model.layers.0.mlp.down_proj', 'model.speech_projector.linear1',
+    'model.speech_encoder.blocks.0.attn.query', 'lm_head',
+]
+QWEN2_LINEAR = [
+    'audio_tower.layers.0.fc1', 'multi_modal_projector.linear', 'language_model.model.layers.0.self_attn.q_proj',
+    'language_model.model.layers.0.mlp.up_proj', 'language_model.lm_head',
+]
+# target_modules of the earlier swift sft runs (sft_args.json of llama_omni_lora8_neutral_FT, args.json of
+# qwen_lora8_anti_FT).
+LLAMA_OMNI_REFERENCE = '^(model.layers|model.speech_projector)(?!.*(lm_head|output|emb|wte|shared)).*'
+QWEN2_REFERENCE = ['all-linear']
+
+
+def targets(names, model):
+    return [name for name in names if re.search(LORA_TARGETS[model], name)]
+
+
+@pytest.mark.parametrize('names, model, target_modules', [
+    (LLAMA_OMNI_LINEAR, 'llama-omni', LLAMA_OMNI_REFERENCE),
+    (QWEN2_LINEAR, 'qwen2', QWEN2_REFERENCE),
+])
+def test_lora_targets_match_the_earlier_runs(tmp_path, names, model, target_modules):
+    assert sorted(reference_lora_targets(names, target_modules)) == sorted(targets(names, model))
+    args_path = tmp_path / 'args.json'
+    args_path.write_text(json.dumps({'target_modules': target_modules}))
+    check_lora_targets(names, targets(names, model), str(args_path))
+
+
+def test_differing_lora_targets_are_an_error(tmp_path):
+    args_path = tmp_path / 'args.json'
+    args_path.write_text(json.dumps({'target_modules': ['q_proj']}))
+    with pytest.raises(ValueError, match='1 layers only there'):
+        check_lora_targets(QWEN2_LINEAR, [], str(args_path))
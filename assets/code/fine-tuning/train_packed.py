@@ -0,0 +1,286 @@
+'''
+Trains the LoRA adapters from packed shards (see pack_finetune_data.py) instead of the JSONL files that `swift sft`
+re-decodes every epoch. Batches come from LengthBucketSampler, so items of similar length are trained together and
+the per-device batch size can grow beyond 1; PackedCollator pads them into model inputs.
+
+Every training batch holds --per_device_train_batch_size items, except for one smaller batch per epoch when the
+number of items is not a multiple of it, so the number of optimiser steps per epoch is fixed and known to the
+learning rate schedule. As in the swift runs, the loss of a batch is the mean over its answer tokens, and the
+--gradient_accumulation_steps batches of an optimiser step are weighted equally (the smaller batch counts as much
+as a full one). There is deliberately no token budget per batch: it would cut batches short by a different amount
+every epoch and change the effective batch size.
+
+The hyperparameters default
+to those of the swift sft runs (args.json / sft_args.json of the earlier runs). The LoRA targets are meant to be the
+same linear layers: every linear layer of the language model for Qwen2-Audio (swift's all-linear, with the audio
+encoder and projector frozen), and the language model and speech projector for LLaMA-Omni. With --reference_args,
+they are checked against the target_modules of an earlier run before training, and a mismatch is an error.
+
+The checkpoints are plain peft adapters, which the inference scripts load with Swift.from_pretrained like the swift
+sft checkpoints. Like swift, the run writes its arguments to <output_dir>/args.json, including the system prompt of the
+shards, which the LLaMA-Omni inference backend reads to build the same prompts as in training.
+
+    python train_packed.py --model qwen2 --train_shard packed/train_anti --val_shard packed/validation_anti \
+        --output_dir qwen_lora8_anti_FT --lora_rank 8
+
+'''
+
+import argparse
+import json
+import os
+import re
+
+import torch
+from peft import LoraConfig, get_peft_model
+from torch.utils.data import DataLoader, Subset
+from transformers import Trainer, TrainerCallback, TrainingArguments
+
+from pack_finetune_data import MODELS, LengthBucketSampler, PackedCollator, PackedShard, log_mel_featuriser
+
+# Linear layers that get a LoRA adapter, by module name.
+LORA_TARGETS = {
+    'qwen2': r'language_model\.(model\.)?layers\.',
+    'llama-omni': r'^(model\.layers|model\.speech_projector)\.',
+}
+# Modules that swift's 'all-linear' leaves out: the output head, and the audio encoder and projector (freeze_vit and
+# freeze_aligner).
+ALL_LINEAR_EXCLUDED = ('lm_head', 'audio_tower', 'multi_modal_projector', 'speech_encoder', 'speech_projector')
+# Pad token of the LLaMA-Omni inference script (<|finetune_right_pad_id|>); the tokenizer defines none.
+LLAMA_OMNI_PAD_TOKEN_ID = 128004
+
+
+def load_model(model, model_id):
+    """
+    Loads a base model in bfloat16 and returns it with its tokenizer.
+    """
+    if model == 'llama-omni':
+        from omni_speech.model.builder import load_pretrained_model
+
+        tokenizer, base_model, _ = load_pretrained_model(model_id, None, s2s=False)
+        return base_model.to(torch.bfloat16), tokenizer
+
+    from transformers import AutoProcessor, Qwen2AudioForConditionalGeneration
+
+    processor = AutoProcessor.from_pretrained(model_id, trust_remote_code=True)
+    base_model = Qwen2AudioForConditionalGeneration.from_pretrained(model_id, torch_dtype=torch.bfloat16)
+    return base_model, processor.tokenizer
+
+
+def linear_layer_names(base_model):
+    return [name for name, module in base_model.named_modules() if isinstance(module, torch.nn.Linear)]
+
+
+def lora_target_modules(base_model, pattern):
+    """
+    Returns the names of the linear layers whose name matches `pattern`.
+    """
+    return [name for name in linear_layer_names(base_model) if re.search(pattern, name)]
+
+
+def reference_lora_targets(linear_names, target_modules):
+    """
+    Returns the linear layers that a swift sft run put LoRA adapters on, given its target_modules: a regex the whole
+    module name has to match (peft's rule for a string), or a list of module names or name suffixes in which
+    'all-linear' stands for every linear layer but those in ALL_LINEAR_EXCLUDED.
+    """
+    if isinstance(target_modules, str):
+        return [name for name in linear_names if re.fullmatch(target_modules, name)]
+    targets = []
+    for name in linear_names:
+        parts = name.split('.')
+        if 'all-linear' in target_modules and not any(part in ALL_LINEAR_EXCLUDED for part in parts):
+            targets.append(name)
+        elif any(name == target or name.endswith('.' + target) for target in target_modules):
+            targets.append(name)
+    return targets
+
+
+def check_lora_targets(linear_names, target_names, reference_args_path):
+    """
+    Raises a ValueError unless `target_names` are exactly the linear layers the run of `reference_args_path` (its
+    sft_args.json or args.json) trained, and prints how many layers matched otherwise.
+    """
+    with open(reference_args_path, 'r') as f:
+        target_modules = json.load(f)['target_modules']
+    reference = set(reference_lora_targets(linear_names, target_modules))
+    only_reference = sorted(reference - set(target_names))
+    only_here = sorted(set(target_names) - reference)
+    if only_reference or only_here:
+        raise ValueError(
+            f"The LoRA targets differ from those of {reference_args_path} ({target_modules!r}): "
+            f"{len(only_reference)} layers only there (e.g. {only_reference[:3]}), "
+            f"{len(only_here)} only here (e.g. {only_here[:3]})."
+        )
+    print(f"The LoRA targets match {reference_args_path}: {len(reference)} linear layers.")
+
+
+def bucketed_dataset(shard_dir, max_length):
+    """
+    Returns the items of a shard up to `max_length` tokens (longer ones are dropped, like swift's default
+    truncation strategy) and their lengths.
+    """
+    shard = PackedShard(shard_dir)
+    keep = [idx for idx, length in enumerate(shard.lengths) if length <= max_length]
+    if len(keep) < len(shard):
+        print(f"Dropping {len(shard) - len(keep)} items of {shard_dir} longer than {max_length} tokens.")
+    return shard, Subset(shard, keep), [shard.lengths[idx] for idx in keep]
+
+
+class TorchCollator:
+    """
+    Wraps a PackedCollator so that batches are torch tensors, with the audio features in the model's dtype.
+    """
+
+    def __init__(self, collator, dtype):
+        self.collator = collator
+        self.dtype = dtype
+
+    def __call__(self, items):
+        batch = {name: torch.from_numpy(array) for name, array in self.collator(items).items()}
+        for name in ('input_features', 'speech'):
+            if name in batch:
+                batch[name] = batch[name].to(self.dtype)
+        return batch
+
+
+class SetEpochCallback(TrainerCallback):
+    """
+    Reseeds the shuffling of the bucket sampler at the start of every epoch.
+    """
+
+    def __init__(self, sampler):
+        self.sampler = sampler
+
+    def on_epoch_begin(self, args, state, control, **kwargs):
+        self.sampler.set_epoch(int(state.epoch or 0))
+
+
+class BucketedTrainer(Trainer):
+    """
+    Trainer whose data loaders take their batches from LengthBucketSampler instead of a fixed batch size.
+    """
+
+    def __init__(self, *args, train_sampler=None, eval_sampler=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.train_sampler = train_sampler
+        self.eval_sampler = eval_sampler
+
+    def _bucketed_loader(self, dataset, sampler):
+        return self.accelerator.prepare(DataLoader(
+            dataset, batch_sampler=sampler, collate_fn=self.data_collator,
+            num_workers=self.args.dataloader_num_workers, pin_memory=self.args.dataloader_pin_memory
+        ))
+
+    def get_train_dataloader(self):
+        return self._bucketed_loader(self.train_dataset, self.train_sampler)
+
+    def get_eval_dataloader(self, eval_dataset=None):
+        return self._bucketed_loader(eval_dataset if eval_dataset is not None else self.eval_dataset,
+                                     self.eval_sampler)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Train LoRA adapters from packed fine-tuning shards.")
+    parser.add_argument('--model', type=str, default='qwen2', choices=sorted(MODELS),
+                        help="Model to fine-tune. Default is qwen2.")
+    parser.add_argument('--model_id', type=str, default=None,
+                        help="Base model to load. Default is the model's Hugging Face ID.")
+    parser.add_argument('--train_shard', type=str, required=True,
+                        help="Packed shard directory of the training set.")
+    parser.add_argument('--val_shard', type=str, default=None,
+                        help="Packed shard directory of the validation set. Default is no evaluation.")
+    parser.add_argument('--output_dir', type=str, required=True,
+                        help="Directory of the checkpoints.")
+    parser.add_argument('--lora_rank', type=int, default=8,
+                        help="LoRA rank. Default is 8.")
+    parser.add_argument('--lora_alpha', type=int, default=32,
+                        help="LoRA alpha. Default is 32.")
+    parser.add_argument('--per_device_train_batch_size', type=int, default=8,
+                        help="Number of items per training batch. Default is 8.")
+    parser.add_argument('--per_device_eval_batch_size', type=int, default=8,
+                        help="Maximum number of items per evaluation batch. Default is 8.")
+    parser.add_argument('--gradient_accumulation_steps', type=int, default=2,
+                        help="Batches per optimiser step. Default is 2.")
+    parser.add_argument('--num_train_epochs', type=int, default=7,
+                        help="Number of epochs. Default is 7.")
+    parser.add_argument('--learning_rate', type=float, default=1e-4,
+                        help="Peak learning rate. Default is 1e-4.")
+    parser.add_argument('--max_length', type=int, default=2048,
+                        help="Items longer than this many tokens are dropped. Default is 2048.")
+    parser.add_argument('--eval_steps', type=int, default=50,
+                        help="Evaluate every this many optimiser steps. Default is 50.")
+    parser.add_argument('--save_steps', type=int, default=50,
+                        help="Save a checkpoint every this many optimiser steps. Default is 50.")
+    parser.add_argument('--save_total_limit', type=int, default=7,
+                        help="Number of checkpoints kept. Default is 7.")
+    parser.add_argument('--dataloader_num_workers', type=int, default=4,
+                        help="Data loader worker processes. Default is 4.")
+    parser.add_argument('--reference_args', type=str, default=None,
+                        help="sft_args.json or args.json of an earlier swift sft run; training stops unless the LoRA "
+                             "targets are the layers its target_modules selected. Default is no check.")
+    parser.add_argument('--seed', type=int, default=42,
+                        help="Seed of the initialisation and the batch shuffling. Default is 42.")
+    args = parser.parse_args()
+
+    model_id = args.model_id or MODELS[args.model]['model_id']
+    base_model, tokenizer = load_model(args.model, model_id)
+    target_names = lora_target_modules(base_model, LORA_TARGETS[args.model])
+    if args.reference_args is not None:
+        check_lora_targets(linear_layer_names(base_model), target_names, args.reference_args)
+    model = get_peft_model(base_model, LoraConfig(
+        r=args.lora_rank, lora_alpha=args.lora_alpha, lora_dropout=0.05, target_modules=target_names
+    ))
+    model.print_trainable_parameters()
+
+    train_shard, train_dataset, train_lengths = bucketed_dataset(args.train_shard, args.max_length)
+    train_sampler = LengthBucketSampler(train_lengths, batch_size=args.per_device_train_batch_size, seed=args.seed)
+    eval_dataset = eval_sampler = None
+    if args.val_shard is not None:
+        _, eval_dataset, eval_lengths = bucketed_dataset(args.val_shard, args.max_length)
+        eval_sampler = LengthBucketSampler(eval_lengths, batch_size=args.per_device_eval_batch_size, shuffle=False)
+
+    template = MODELS[args.model]
+    if args.model == 'llama-omni':
+        pad_token_id = LLAMA_OMNI_PAD_TOKEN_ID
+    else:
+        pad_token_id = tokenizer.pad_token_id
+    audio_token_id = template.get('audio_token_id', tokenizer.convert_tokens_to_ids(template['audio_marker']))
+    # Shards of raw audio are featurised by the data loader workers; log-mel shards only need padding.
+    featurise = log_mel_featuriser(args.model, model_id) if train_shard.features == 'audio' else None
+    collator = TorchCollator(PackedCollator(args.model, pad_token_id, audio_token_id, featurise=featurise),
+                             torch.bfloat16)
+
+    training_args = TrainingArguments(
+        output_dir=args.output_dir,
+        num_train_epochs=args.num_train_epochs,
+        per_device_train_batch_size=args.per_device_train_batch_size,
+        per_device_eval_batch_size=args.per_device_eval_batch_size,
+        gradient_accumulation_steps=args.gradient_accumulation_steps,
+        learning_rate=args.learning_rate,
+        lr_scheduler_type='cosine',
+        warmup_ratio=0.05,
+        weight_decay=0.1,
+        adam_beta2=0.95,
+        max_grad_norm=1.0,
+        bf16=True,
+        eval_strategy='steps' if eval_dataset is not None else 'no',
+        eval_steps=args.eval_steps,
+        save_steps=args.save_steps,
+        save_total_limit=args.save_total_limit,
+        logging_steps=5,
+        dataloader_num_workers=args.dataloader_num_workers,
+        remove_unused_columns=False,
+        seed=args.seed,
+        report_to=['tensorboard'],
+    )
+    trainer = BucketedTrainer(
+        model=model, args=training_args, data_collator=collator, train_dataset=train_dataset,
+        eval_dataset=eval_dataset, train_sampler=train_sampler, eval_sampler=eval_sampler,
+        callbacks=[SetEpochCallback(train_sampler)]
+    )
+    os.makedirs(args.output_dir, exist_ok=True)
+    with open(os.path.join(args.output_dir, 'args.json'), 'w') as f:
+        json.dump({**vars(args), 'system': train_shard.system}, f, indent=2)
+    trainer.train()
+    # The inference scripts only load adapter paths with 'checkpoint' in their name.
+    trainer.save_model(os.path.join(args.output_dir, 'checkpoint-final'))
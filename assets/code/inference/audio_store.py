@@ -0,0 +1,245 @@
+'''
+Persistent store of pre-resampled audio. The pack step decodes and resamples every audio file referenced by the
+benchmark JSON files once, and writes them into a single flat blob plus a JSON index of offsets. The inference scripts
+then memory-map the blob and read slices from it instead of calling librosa.load on every run.
+
+The blob is append-only: re-packing a file that changed appends its new audio and leaves the old bytes unused, so the
+store grows with every change. --compact rewrites the blob with only the audio the index still points to; run it
+while no inference job is opening the store.
+
+Usage:
+    python audio_store.py --input_json sage_test.json spoken_stereoset_test.json --store_dir audio_store
+    python audio_store.py --store_dir audio_store --compact
+
+'''
+
+import argparse
+import json
+import os
+
+import numpy as np
+
+BLOB_NAME = 'audio.bin'
+INDEX_NAME = 'index.json'
+DTYPES = {'float16': np.float16, 'int16': np.int16}
+
+
+def _decode(audio_path, sample_rate):
+    # librosa is imported on first use, so that importing this module (e.g. for --help) stays fast.
+    import librosa
+
+    audio_data, _ = librosa.load(audio_path, sr=sample_rate)
+    return audio_data
+
+
+def audio_errors():
+    """
+    Returns the exception types raised for a missing, unreadable or undecodable audio file. Only these skip an item;
+    anything else (out of memory, tokenizer or code errors) has to end the run.
+    """
+    errors = [OSError, EOFError]
+    try:
+        import soundfile
+        errors.append(getattr(soundfile, 'LibsndfileError', getattr(soundfile, 'SoundFileError', RuntimeError)))
+    except ImportError:
+        pass
+    try:
+        import audioread
+        errors.append(audioread.exceptions.DecodeError)
+    except ImportError:
+        pass
+    try:
+        from librosa.util.exceptions import ParameterError
+        errors.append(ParameterError)
+    except ImportError:
+        pass
+    return tuple(errors)
+
+
+def _file_key(audio_path):
+    return os.path.abspath(audio_path)
+
+
+def _memmap(path, dtype):
+    # np.memmap cannot map an empty file, e.g. the blob of a store where no audio file was found.
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r')
+
+
+def _write_index(index, index_path):
+    tmp_path = index_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(index, f)
+    os.replace(tmp_path, index_path)
+
+
+def _encode(audio_data, dtype):
+    if dtype == 'int16':
+        return (np.clip(audio_data, -1.0, 1.0) * 32767).astype(np.int16)
+    return audio_data.astype(np.float16)
+
+
+def pack_audio(audio_paths, store_dir, sample_rate=16000, dtype='float16'):
+    """
+    Resamples every audio file to `sample_rate` and appends it to the store. Files that are already packed with the
+    same modification time and sample rate are skipped, so the pack step can be re-run after adding new files.
+    Returns the number of newly packed files.
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    index_path = os.path.join(store_dir, INDEX_NAME)
+    blob_path = os.path.join(store_dir, BLOB_NAME)
+
+    index = {'dtype': dtype, 'entries': {}}
+    if os.path.exists(index_path):
+        with open(index_path, 'r') as f:
+            index = json.load(f)
+        if index['dtype'] != dtype:
+            raise ValueError(f"Store {store_dir} holds {index['dtype']} audio, cannot add {dtype} audio.")
+
+    entries = index['entries']
+    item_size = np.dtype(DTYPES[dtype]).itemsize
+    num_packed = 0
+    with open(blob_path, 'ab') as blob:
+        offset = blob.tell() // item_size
+        for audio_path in sorted(set(audio_paths)):
+            if not os.path.exists(audio_path):
+                print(f"Warning: Audio file not found at {audio_path}. Skipping.")
+                continue
+
+            key = _file_key(audio_path)
+            mtime = os.path.getmtime(audio_path)
+            entry = entries.get(key)
+            if entry is not None and entry['mtime'] == mtime and entry['sample_rate'] == sample_rate:
+                continue
+
+            # Stale entries are replaced by appending the new audio; the old bytes stay unused until compact_audio.
+            audio_data = _decode(audio_path, sample_rate)
+            encoded = _encode(audio_data, dtype)
+            blob.write(encoded.tobytes())
+            entries[key] = {
+                'offset': offset,
+                'length': len(encoded),
+                'mtime': mtime,
+                'sample_rate': sample_rate
+            }
+            offset += len(encoded)
+            num_packed += 1
+
+    _write_index(index, index_path)
+    return num_packed
+
+
+def unused_bytes(store_dir):
+    """
+    Returns the number of bytes in the blob that no index entry points to.
+    """
+    with open(os.path.join(store_dir, INDEX_NAME), 'r') as f:
+        index = json.load(f)
+    item_size = np.dtype(DTYPES[index['dtype']]).itemsize
+    used = sum(entry['length'] for entry in index['entries'].values()) * item_size
+    return os.path.getsize(os.path.join(store_dir, BLOB_NAME)) - used
+
+
+def compact_audio(store_dir):
+    """
+    Rewrites the blob with only the audio that the index points to, in offset order, and returns the number of bytes
+    reclaimed. The new blob and index replace the old ones once both are written.
+    """
+    index_path = os.path.join(store_dir, INDEX_NAME)
+    blob_path = os.path.join(store_dir, BLOB_NAME)
+    with open(index_path, 'r') as f:
+        index = json.load(f)
+    old_size = os.path.getsize(blob_path)
+    blob = _memmap(blob_path, DTYPES[index['dtype']])
+
+    offset = 0
+    with open(blob_path + '.tmp', 'wb') as new_blob:
+        for entry in sorted(index['entries'].values(), key=lambda entry: entry['offset']):
+            new_blob.write(blob[entry['offset']:entry['offset'] + entry['length']].tobytes())
+            entry['offset'] = offset
+            offset += entry['length']
+    del blob
+
+    os.replace(blob_path + '.tmp', blob_path)
+    _write_index(index, index_path)
+    return old_size - os.path.getsize(blob_path)
+
+
+class AudioStore:
+    """
+    Read-only view of a packed audio store. `load` returns a slice of the memory-mapped blob when the file has an
+    up-to-date entry at the requested sample rate, and falls back to librosa.load otherwise.
+    """
+
+    def __init__(self, store_dir):
+        with open(os.path.join(store_dir, INDEX_NAME), 'r') as f:
+            index = json.load(f)
+        self.dtype = index['dtype']
+        self.entries = index['entries']
+        self.blob = _memmap(os.path.join(store_dir, BLOB_NAME), DTYPES[self.dtype])
+
+    def get(self, audio_path, sample_rate):
+        """
+        Returns the packed audio for a file, or None if the file is not in the store or its entry is stale.
+        """
+        entry = self.entries.get(_file_key(audio_path))
+        if entry is None or entry['sample_rate'] != sample_rate:
+            return None
+        if entry['mtime'] != os.path.getmtime(audio_path):
+            return None
+
+        audio_data = self.blob[entry['offset']:entry['offset'] + entry['length']]
+        if self.dtype == 'int16':
+            return audio_data.astype(np.float32) / 32767
+        return audio_data
+
+    def load(self, audio_path, sample_rate):
+        audio_data = self.get(audio_path, sample_rate)
+        if audio_data is None:
+            audio_data = _decode(audio_path, sample_rate)
+        return audio_data
+
+
+def load_audio(audio_path, sample_rate, audio_store=None):
+    """
+    Loads an audio file at `sample_rate`, from the packed store if one is given.
+    """
+    if audio_store is not None:
+        return audio_store.load(audio_path, sample_rate)
+    return _decode(audio_path, sample_rate)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Pack the audio referenced by benchmark JSON files into an audio store.")
+    parser.add_argument('--input_json', type=str, nargs='+', default=[],
+                        help="Benchmark JSON files whose 'Audio Path' entries should be packed.")
+    parser.add_argument('--store_dir', type=str, default='audio_store',
+                        help="Directory of the audio store. Default is 'audio_store'.")
+    parser.add_argument('--sample_rate', type=int, default=16000,
+                        help="Target sample rate; must match the processor's feature extractor. Default is 16000.")
+    parser.add_argument('--dtype', type=str, default='float16', choices=list(DTYPES),
+                        help="Storage type of the audio samples. Default is float16.")
+    parser.add_argument('--compact', action='store_true',
+                        help="After packing, rewrite the blob without the audio of replaced entries.")
+
+    args = parser.parse_args()
+
+    audio_paths = []
+    for input_json_path in args.input_json:
+        with open(input_json_path, 'r') as f:
+            audio_paths.extend(item['Audio Path'] for item in json.load(f))
+
+    if not audio_paths and not args.compact:
+        parser.error("Nothing to do: give --input_json files to pack and/or --compact.")
+
+    if audio_paths:
+        num_packed = pack_audio(audio_paths, args.store_dir, sample_rate=args.sample_rate, dtype=args.dtype)
+        print(f"Packed {num_packed} new audio files into {args.store_dir}")
+    if args.compact:
+        reclaimed = compact_audio(args.store_dir)
+        print(f"Compacted {args.store_dir}: reclaimed {reclaimed / 1024 ** 2:.1f} MB")
+    else:
+        unused = unused_bytes(args.store_dir)
+        if unused > 0:
+            print(f"{unused / 1024 ** 2:.1f} MB of the blob belong to replaced audio; run with --compact to reclaim it.")
@@ -0,0 +1,58 @@
+'''
+Length bucketing for batched inference. Items are sorted by their estimated prompt length (audio tokens plus text
+tokens) and packed into batches, so that items padded together have similar lengths and little compute is wasted on
+padding. Every batch keeps the indices of its items, so results can be mapped back to the original input order.
+
+'''
+
+import math
+
+# Qwen2-Audio's encoder sees 100 mel frames per second, halved by the conv stride and again by the pooling layer.
+AUDIO_TOKENS_PER_SECOND = 25
+# Maximum audio length the Whisper feature extractor keeps; longer audio is truncated.
+MAX_AUDIO_SECONDS = 30.0
+# Rough number of tokens added by the chat template around the audio and text prompt.
+TEMPLATE_OVERHEAD_TOKENS = 32
+
+
+def audio_duration(audio_path):
+    """
+    Returns the audio duration in seconds, read from the file header without decoding the audio.
+    """
+    # librosa is imported on first use, so that importing this module (e.g. for --help) stays fast.
+    import librosa
+
+    return librosa.get_duration(path=audio_path)
+
+
+def estimate_num_tokens(duration, prompt_tokens):
+    """
+    Estimates the number of input tokens for an item from its audio duration and text prompt length.
+    """
+    audio_tokens = math.ceil(min(duration, MAX_AUDIO_SECONDS) * AUDIO_TOKENS_PER_SECOND)
+    return audio_tokens + prompt_tokens + TEMPLATE_OVERHEAD_TOKENS
+
+
+def make_length_buckets(lengths, batch_size=1, max_tokens_per_batch=None):
+    """
+    Groups item indices into batches of items with similar length.
+
+    `lengths` holds the estimated number of input tokens for each item. A batch holds at most `batch_size` items,
+    and its padded size (number of items times the longest item) stays under `max_tokens_per_batch` if given. An item
+    that exceeds `max_tokens_per_batch` on its own is put in a batch by itself. Returns a list of lists of indices.
+    """
+    order = sorted(range(len(lengths)), key=lambda i: (lengths[i], i))
+
+    batches = []
+    batch = []
+    for idx in order:
+        # Items are sorted by length, so the newest item is always the longest one in the batch.
+        padded_size = (len(batch) + 1) * lengths[idx]
+        too_many_tokens = max_tokens_per_batch is not None and padded_size > max_tokens_per_batch
+        if batch and (len(batch) >= batch_size or too_many_tokens):
+            batches.append(batch)
+            batch = []
+        batch.append(idx)
+    if batch:
+        batches.append(batch)
+    return batches
@@ -0,0 +1,186 @@
+'''
+Checks whether the CPU int8 path (--device cpu --quant int8) can stand in for the bf16 path, before using it for
+sweeps. A random sample of items is answered by both paths with log-probability option scoring (--mode score), which
+is deterministic, and the report gives how often they choose the same option, how far the option probabilities move,
+the share of stereotypical answers under each path and the seconds per item of each path.
+
+The bf16 reference is scored first and freed before the int8 model is loaded, so both never share memory. The
+reference scores can be saved with --reference_results and reused when trying other int8 settings:
+
+    python check_quantisation.py --model qwen2 --input_json SAGE.json --num_items 200 --reference_results ref.json
+    python check_quantisation.py --model qwen2 --input_json SAGE.json --num_items 200 --reference_results ref.json \
+        --quantize_audio_encoder --num_threads 16
+
+The exit code is 1 if the agreement is below --min_agreement, so a sweep script can refuse to run on int8.
+
+'''
+
+import argparse
+import gc
+import json
+import os
+import random
+import time
+
+import numpy as np
+
+from model_backends import BACKENDS, SCORE_NORMALISATIONS, get_backend, set_cpu_threads
+from run_SAGE_inference import get_options
+
+
+def score_sample(backend, items, normalisation='mean'):
+    """
+    Chooses an option for every item and returns the chosen option name, the option scores and the seconds taken.
+    """
+    results = []
+    for item in items:
+        start = time.perf_counter()
+        inputs = backend.featurise([item['Audio Path']], [item['Text prompt']])
+        _, extra = backend.choose_option(inputs, get_options(item), normalisation=normalisation)
+        results.append({**extra, 'seconds': time.perf_counter() - start})
+    return results
+
+
+def load_backend(model_name, lora_adapter_path=None, device='auto', quant='none', quantize_audio_encoder=False,
+                 tiny_random_model=False):
+    backend = get_backend(model_name)
+    if tiny_random_model:
+        backend.load_tiny()
+    else:
+        backend.load(lora_adapter_path=lora_adapter_path, device=device)
+    backend.quantize(quant, audio_encoder=quantize_audio_encoder)
+    return backend
+
+
+def option_probabilities(log_probs):
+    """
+    Normalises the option scores (log-probs) of an item into probabilities over its options.
+    """
+    values = np.array(list(log_probs.values()))
+    values = np.exp(values - values.max())
+    return dict(zip(log_probs.keys(), values / values.sum()))
+
+
+def compare(items, reference, quantised):
+    """
+    Summarises how closely the quantised results follow the reference results of the same items.
+    """
+    agree = np.array([ref['Predicted option'] == quant['Predicted option'] for ref, quant in zip(reference, quantised)])
+    prob_diffs = []
+    for ref, quant in zip(reference, quantised):
+        # The ranking scores if recorded (see model_backends.option_scores), else the summed log-probs.
+        ref_probs = option_probabilities(ref.get('Option scores', ref['Option log-probs']))
+        quant_probs = option_probabilities(quant.get('Option scores', quant['Option log-probs']))
+        prob_diffs.extend(abs(ref_probs[name] - quant_probs[name]) for name in ref_probs)
+
+    def stereotype_rate(results):
+        return float(np.mean([result['Predicted option'] == 'Stereotypical option' for result in results]))
+
+    agreement = float(agree.mean())
+    margin = 1.96 * np.sqrt(agreement * (1 - agreement) / len(agree))
+    return {
+        'num_items': len(items),
+        'agreement': agreement,
+        'agreement_ci': [max(0.0, agreement - margin), min(1.0, agreement + margin)],
+        'mean_abs_prob_diff': float(np.mean(prob_diffs)),
+        'max_abs_prob_diff': float(np.max(prob_diffs)),
+        'stereotype_rate_reference': stereotype_rate(reference),
+        'stereotype_rate_quantised': stereotype_rate(quantised),
+        'seconds_per_item_reference': float(np.mean([result['seconds'] for result in reference])),
+        'seconds_per_item_quantised': float(np.mean([result['seconds'] for result in quantised])),
+        'disagreements': [
+            {'Audio Path': item['Audio Path'], 'Text prompt': item['Text prompt'],
+             'reference': ref['Predicted option'], 'quantised': quant['Predicted option']}
+            for item, ref, quant, same in zip(items, reference, quantised, agree) if not same
+        ]
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare the CPU int8 path with the bf16 path on a sample of items.")
+    parser.add_argument('--model', type=str, required=True, choices=sorted(BACKENDS),
+                        help="The model to check.")
+    parser.add_argument('--input_json', type=str, required=True,
+                        help="SAGE or Spoken StereoSet input JSON to sample items from.")
+    parser.add_argument('--lora_adapter_path', type=str, default=None,
+                        help="LoRA checkpoint, applied to both paths (merged into the weights before int8 quantisation).")
+    parser.add_argument('--num_items', type=int, default=100,
+                        help="Number of sampled items. Default is 100.")
+    parser.add_argument('--seed', type=int, default=0,
+                        help="Seed of the item sample. Default is 0.")
+    parser.add_argument('--reference_results', type=str, default=None,
+                        help="JSON file of reference scores: reused if it exists for the same sample, written otherwise.")
+    parser.add_argument('--quantize_audio_encoder', action='store_true',
+                        help="Also quantise the linear layers of the audio encoder on the int8 path.")
+    parser.add_argument('--num_threads', type=int, default=None,
+                        help="Intra-op CPU threads of torch. Default is torch's default.")
+    parser.add_argument('--num_interop_threads', type=int, default=None,
+                        help="Inter-op CPU threads of torch. Default is torch's default.")
+    parser.add_argument('--score_normalisation', type=str, default='mean', choices=SCORE_NORMALISATIONS,
+                        help="How option log-probs are combined into scores (see model_backends.py). Default is mean.")
+    parser.add_argument('--min_agreement', type=float, default=0.95,
+                        help="Agreement below which the int8 path is reported as unsafe. Default is 0.95.")
+    parser.add_argument('--output', type=str, default=None,
+                        help="Where to save the report as JSON. Default is not to save it.")
+    parser.add_argument('--tiny_random_model', action='store_true',
+                        help="Use tiny random models on both paths (the reference then stays float32), as a smoke test.")
+    args = parser.parse_args()
+
+    if args.num_threads is not None or args.num_interop_threads is not None:
+        set_cpu_threads(args.num_threads, args.num_interop_threads)
+
+    with open(args.input_json, 'r') as f:
+        benchmark_data = json.load(f)
+    # Long-form items have no options to score.
+    benchmark_data = [item for item in benchmark_data if any(get_options(item).values())]
+    items = random.Random(args.seed).sample(benchmark_data, min(args.num_items, len(benchmark_data)))
+    sample_keys = [[item['Audio Path'], item['Text prompt']] for item in items]
+
+    reference = None
+    if args.reference_results is not None and os.path.exists(args.reference_results):
+        with open(args.reference_results, 'r') as f:
+            saved = json.load(f)
+        # Saved references without a normalisation predate it and were ranked by the summed log-probs.
+        if saved['items'] == sample_keys and saved.get('normalisation', 'sum') == args.score_normalisation:
+            reference = saved['results']
+            print(f"Reusing reference scores from {args.reference_results}")
+        else:
+            print(f"{args.reference_results} holds a different sample or normalisation; scoring the reference again.")
+
+    if reference is None:
+        print(f"--- Scoring {len(items)} items with the bf16 reference ---")
+        # device_map="auto" places the bf16 weights on the GPUs if there are any, on CPU otherwise.
+        backend = load_backend(args.model, args.lora_adapter_path, device='auto',
+                               tiny_random_model=args.tiny_random_model)
+        reference = score_sample(backend, items, args.score_normalisation)
+        del backend
+        gc.collect()
+        if args.reference_results is not None:
+            with open(args.reference_results, 'w') as f:
+                json.dump({'items': sample_keys, 'normalisation': args.score_normalisation, 'results': reference}, f,
+                          indent=2)
+
+    print(f"--- Scoring {len(items)} items with int8 on CPU ---")
+    backend = load_backend(args.model, args.lora_adapter_path, device='cpu', quant='int8',
+                           quantize_audio_encoder=args.quantize_audio_encoder, tiny_random_model=args.tiny_random_model)
+    quantised = score_sample(backend, items, args.score_normalisation)
+
+    report = compare(items, reference, quantised)
+    report['quantize_audio_encoder'] = args.quantize_audio_encoder
+    print(f"Agreement: {report['agreement']:.1%} [CI {report['agreement_ci'][0]:.1%}-{report['agreement_ci'][1]:.1%}] "
+          f"over {report['num_items']} items")
+    print(f"Option probability difference: {report['mean_abs_prob_diff']:.4f} mean, {report['max_abs_prob_diff']:.4f} max")
+    print(f"Stereotypical answers: {report['stereotype_rate_reference']:.1%} bf16, "
+          f"{report['stereotype_rate_quantised']:.1%} int8")
+    print(f"Seconds per item: {report['seconds_per_item_reference']:.2f} bf16, "
+          f"{report['seconds_per_item_quantised']:.2f} int8")
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Report saved to {args.output}")
+
+    if report['agreement'] < args.min_agreement:
+        print(f"int8 agreement is below {args.min_agreement:.0%}; do not use it for sweeps of this model.")
+        exit(1)
+    print(f"int8 agreement is at least {args.min_agreement:.0%}; safe to use for sweeps of this model.")
@@ -0,0 +1,171 @@
+'''
+Task-aware decode budgets. MCQA prompts (1-15) only need a short answer such as "B: Principal", while long-form prompts
+(16-19) need room for a full response. A decode policy sets the token cap per task, whether to stop as soon as one of
+the item's options has been emitted, and a guard that stops a row once it keeps repeating itself. The stopping
+criterion also records how many tokens every row generated and why it stopped.
+
+A policy config is a JSON object mapping task name to overrides of the defaults below, e.g.
+    {"mcqa": {"max_new_tokens": 32}, "long_form": {"repetition_window": 64}}
+
+`repetition_min_span` is the number of tokens the repeats must cover together. Without it, three equal tokens in a row
+would count as a loop, and answers such as "1000" (one token per digit in Qwen), "!!!" or "---" would be cut short.
+
+`stop_on_option` only stops on an answer, not on any mention of an option: the text has to start with an option
+(optionally after an answer letter such as "B:"), or name exactly one option followed by the end of a sentence. A
+hedge such as "I can't tell whether the nurse or the engineer..." therefore runs on and is later scored as no answer.
+
+'''
+
+import copy
+import json
+import os
+import re
+
+DEFAULT_POLICIES = {
+    'mcqa': {'max_new_tokens': 64, 'stop_on_option': True, 'repetition_window': 16, 'repetition_count': 3,
+             'repetition_min_span': 12},
+    'long_form': {'max_new_tokens': 512, 'stop_on_option': False, 'repetition_window': 32, 'repetition_count': 3,
+                  'repetition_min_span': 12},
+}
+# Prompt numbers of the MCQA prompts; 16-19 are long-form (see assets/datasets/README.md).
+MCQA_PROMPTS = range(1, 16)
+# Leading punctuation and an answer letter such as "B:", "(b)" or "C." before the option text.
+ANSWER_LABEL = re.compile(r'^[\W_]*(?:\(?[a-d](?:[:.)]|\s*\))\s*)?')
+# Characters that end a one-option answer, possibly after closing quotes or markdown emphasis.
+ANSWER_END = re.compile(r'["\'*_)]*[.!?\n]')
+
+
+def load_decode_policies(config_path=None):
+    """
+    Returns the decode policy per task, with the overrides from a JSON config applied to the defaults.
+    """
+    policies = copy.deepcopy(DEFAULT_POLICIES)
+    if config_path is not None:
+        with open(config_path, 'r') as f:
+            for task, overrides in json.load(f).items():
+                policies.setdefault(task, dict(DEFAULT_POLICIES['long_form'])).update(overrides)
+    return policies
+
+
+def option_pattern(options):
+    """
+    Returns one pattern matching any of the (lowercase) option texts as whole words, longer options first so that
+    'stock broker' wins over 'broker', or None without options.
+    """
+    if not options:
+        return None
+    alternatives = '|'.join(re.escape(option.strip()) for option in sorted(options, key=len, reverse=True))
+    return re.compile(rf'(?<!\w)(?:{alternatives})(?!\w)')
+
+
+def names_answer(text, pattern):
+    """
+    Returns True once a (lowercase) response gives an answer: it starts with an option, after an optional answer
+    letter, and the option's word has ended; or it names exactly one option and a sentence ends right after it.
+    """
+    answer = text[ANSWER_LABEL.match(text).end():]
+    first = pattern.match(answer)
+    if first and first.end() < len(answer):
+        return True
+
+    matches = list(pattern.finditer(text))
+    if len({match.group(0) for match in matches}) != 1:
+        return False
+    return any(ANSWER_END.match(text, match.end()) for match in matches)
+
+
+def item_task(item):
+    """
+    Returns the task of an item: its 'Task' field if present, else 'mcqa' or 'long_form' from the prompt number in
+    the audio file name, else 'mcqa' if the item lists answer options.
+    """
+    if 'Task' in item:
+        return item['Task']
+    match = re.search(r'prompt_(\d+)', os.path.basename(item['Audio Path']))
+    if match:
+        return 'mcqa' if int(match.group(1)) in MCQA_PROMPTS else 'long_form'
+    return 'mcqa' if 'Stereotypical option' in item else 'long_form'
+
+
+def item_decode_policy(item, policies):
+    """
+    Returns the decode policy of an item. A 'Max new tokens' field on the item overrides the task's token cap.
+    """
+    policy = dict(policies.get(item_task(item), policies['long_form']))
+    if 'Max new tokens' in item:
+        policy['max_new_tokens'] = int(item['Max new tokens'])
+    return policy
+
+
+class DecodeStoppingCriteria:
+    """
+    Per-row stopping criterion for batched generation. A row stops when it reaches its own token cap, when it has
+    answered with one of its options (if the policy asks for it; see names_answer), or when its last
+    `repetition_window` tokens (or a shorter period) have repeated `repetition_count` times in a row, covering at least
+    `repetition_min_span` tokens.
+
+    Like profiling.GenerationTimer it is a plain callable for a StoppingCriteriaList, so that this module needs neither
+    torch nor transformers and the inference scripts can read decode policies without them.
+    """
+
+    def __init__(self, tokenizer, prompt_len, policies, row_options):
+        self.tokenizer = tokenizer
+        self.prompt_len = prompt_len
+        self.policies = policies
+        self.row_patterns = [option_pattern([option.lower() for option in options if option])
+                             for options in row_options]
+        self.stop_reasons = [None] * len(policies)
+        self.stop_lengths = [None] * len(policies)
+        self.stats = []
+
+    def _repeats(self, tokens, window, count, min_span=1):
+        # A loop of a short period also repeats at every multiple of it, so short loops are still caught once long.
+        min_period = max(1, -(-min_span // count))
+        for period in range(min_period, min(window, len(tokens) // count) + 1):
+            tail = tokens[-period:]
+            if all(tokens[-(k + 1) * period:len(tokens) - k * period] == tail for k in range(1, count)):
+                return True
+        return False
+
+    def __call__(self, input_ids, scores, **kwargs):
+        generated = input_ids[:, self.prompt_len:]
+        done = input_ids.new_zeros(input_ids.shape[0]).bool()
+        for row, policy in enumerate(self.policies):
+            if self.stop_reasons[row] is not None:
+                done[row] = True
+                continue
+
+            tokens = generated[row].tolist()
+            reason = None
+            if len(tokens) >= policy['max_new_tokens']:
+                reason = 'max_tokens'
+            elif policy.get('stop_on_option') and self.row_patterns[row] is not None:
+                text = self.tokenizer.decode(tokens, skip_special_tokens=True).lower()
+                if names_answer(text, self.row_patterns[row]):
+                    reason = 'option'
+            if reason is None and policy.get('repetition_window'):
+                if self._repeats(tokens, policy['repetition_window'], policy.get('repetition_count', 3),
+                                 policy.get('repetition_min_span', 1)):
+                    reason = 'repetition'
+
+            if reason is not None:
+                self.stop_reasons[row] = reason
+                self.stop_lengths[row] = len(tokens)
+                done[row] = True
+        return done
+
+    def record(self, output_ids, eos_token_ids):
+        """
+        Fills `stats` with the number of generated tokens and the stop reason of every row, given the generated ids.
+        Rows not stopped by this criterion stopped at an end-of-sequence token or at the overall token limit.
+        """
+        self.stats = []
+        for row, ids in enumerate(output_ids.tolist()):
+            if self.stop_reasons[row] is not None:
+                self.stats.append({'tokens': self.stop_lengths[row], 'reason': self.stop_reasons[row]})
+                continue
+            eos_positions = [pos for pos, token in enumerate(ids) if token in eos_token_ids]
+            if eos_positions:
+                self.stats.append({'tokens': eos_positions[0] + 1, 'reason': 'eos'})
+            else:
+                self.stats.append({'tokens': len(ids), 'reason': 'max_tokens'})
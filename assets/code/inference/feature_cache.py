@@ -0,0 +1,218 @@
+'''
+On-disk cache of Qwen2-Audio audio features. The log-mel features of an audio file, and optionally the audio-tower
+embeddings, are the same across temperature sweeps and across LoRA adapters that leave the audio encoder untouched.
+Entries are keyed by the audio content hash, the feature extractor config and a fingerprint of the audio encoder
+weights, and the cache is kept under a size cap with least-recently-used eviction.
+
+'''
+
+import hashlib
+import json
+import os
+
+import torch
+
+from audio_store import load_audio
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """
+    Returns the SHA-256 hash of a file's content.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def extractor_fingerprint(feature_extractor):
+    """
+    Returns a hash of the feature extractor config, so that features are recomputed if it changes.
+    """
+    config = json.dumps(feature_extractor.to_dict(), sort_keys=True, default=str)
+    return hashlib.sha256(config.encode()).hexdigest()
+
+
+def encoder_fingerprint(model, adapter_name=None):
+    """
+    Returns a fingerprint of the audio tower and projector weights, including any adapter weights injected into them.
+    Every tensor contributes its name, shape, sum and first few values, which is cheap compared to a full hash.
+    When several LoRA adapters are loaded, `adapter_name` selects the active one ('' for the base weights only);
+    by default every tensor is included.
+    """
+    digest = hashlib.sha256()
+    for module_name in ['audio_tower', 'multi_modal_projector']:
+        module = getattr(model, module_name)
+        with torch.no_grad():
+            for name, param in module.state_dict().items():
+                if adapter_name is not None and 'lora_' in name and f".{adapter_name}." not in f"{name}.":
+                    continue
+                # Dynamically quantised linear layers store their int8 weight and bias as a tuple of packed params.
+                tensors = param if isinstance(param, tuple) else (param,)
+                for tensor in tensors:
+                    if not isinstance(tensor, torch.Tensor):
+                        continue
+                    values = (tensor.dequantize() if tensor.is_quantized else tensor).detach().float().flatten()
+                    digest.update(f"{module_name}.{name}:{tuple(tensor.shape)}:{tensor.dtype}:"
+                                  f"{values.sum().item():.6e}".encode())
+                    digest.update(values[:8].cpu().numpy().tobytes())
+    return digest.hexdigest()
+
+
+def num_audio_tokens(num_frames):
+    """
+    Returns the number of audio tokens Qwen2-Audio produces for `num_frames` valid mel frames (conv stride 2, then
+    pooling by 2).
+    """
+    input_length = (num_frames - 1) // 2 + 1
+    return (input_length - 2) // 2 + 1
+
+
+def encode_qwen2_audio(model, input_features, feature_attention_mask):
+    """
+    Runs the Qwen2-Audio audio tower and projector, and returns the unpadded audio embeddings of every item, the same
+    way Qwen2AudioForConditionalGeneration.forward computes them.
+    """
+    audio_tower = model.audio_tower
+    feat_lengths, output_lengths = audio_tower._get_feat_extract_output_lengths(feature_attention_mask.sum(-1))
+    batch_size, _, max_mel_len = input_features.shape
+    max_seq_len = (max_mel_len - 2) // 2 + 1
+    seq_range = torch.arange(max_seq_len, dtype=feat_lengths.dtype, device=feat_lengths.device)
+    padding_mask = seq_range.unsqueeze(0).expand(batch_size, max_seq_len) >= feat_lengths.unsqueeze(1)
+    padding_mask = padding_mask.view(batch_size, 1, 1, max_seq_len).expand(batch_size, 1, max_seq_len, max_seq_len)
+    attention_mask = torch.zeros(padding_mask.shape, dtype=audio_tower.conv1.weight.dtype, device=padding_mask.device)
+    attention_mask[padding_mask] = float("-inf")
+
+    with torch.no_grad():
+        hidden_states = audio_tower(input_features, attention_mask=attention_mask).last_hidden_state
+        audio_features = model.multi_modal_projector(hidden_states)
+    return [audio_features[idx, :output_lengths[idx]] for idx in range(batch_size)]
+
+
+class FeatureCache:
+    """
+    Directory of cache entries, one `<key>.pt` file per audio file. Reading an entry refreshes its modification
+    time, and the least recently used entries are evicted once the total size exceeds `max_size_bytes`.
+    """
+
+    def __init__(self, cache_dir, model, processor, max_size_bytes=10 * 1024 ** 3, cache_embeddings=False,
+                 adapter_name=None):
+        self.cache_dir = cache_dir
+        self.max_size_bytes = max_size_bytes
+        self.cache_embeddings = cache_embeddings
+        self.hits = 0
+        self.misses = 0
+        self._file_hashes = {}
+        os.makedirs(cache_dir, exist_ok=True)
+
+        fingerprint = extractor_fingerprint(processor.feature_extractor)
+        if cache_embeddings:
+            fingerprint += encoder_fingerprint(model, adapter_name=adapter_name)
+        self.fingerprint = hashlib.sha256(fingerprint.encode()).hexdigest()[:16]
+
+        self.total_size = sum(entry.stat().st_size for entry in os.scandir(cache_dir) if entry.name.endswith('.pt'))
+
+    def _entry_path(self, audio_path):
+        if audio_path not in self._file_hashes:
+            self._file_hashes[audio_path] = file_hash(audio_path)
+        return os.path.join(self.cache_dir, f"{self._file_hashes[audio_path]}_{self.fingerprint}.pt")
+
+    def get(self, audio_path):
+        entry_path = self._entry_path(audio_path)
+        try:
+            entry = torch.load(entry_path, map_location='cpu')
+        except (FileNotFoundError, EOFError, RuntimeError):
+            self.misses += 1
+            return None
+        os.utime(entry_path)
+        self.hits += 1
+        return entry
+
+    def put(self, audio_path, entry):
+        entry_path = self._entry_path(audio_path)
+        tmp_path = entry_path + '.tmp'
+        torch.save(entry, tmp_path)
+        os.replace(tmp_path, entry_path)
+        self.total_size += os.path.getsize(entry_path)
+        if self.total_size > self.max_size_bytes:
+            self.evict()
+
+    def evict(self):
+        """
+        Deletes the least recently used entries until the cache is under its size cap.
+        """
+        entries = sorted(
+            (entry for entry in os.scandir(self.cache_dir) if entry.name.endswith('.pt')),
+            key=lambda entry: entry.stat().st_mtime
+        )
+        self.total_size = sum(entry.stat().st_size for entry in entries)
+        for entry in entries:
+            if self.total_size <= self.max_size_bytes:
+                break
+            self.total_size -= entry.stat().st_size
+            os.remove(entry.path)
+
+
+def prepare_cached_inputs(model, processor, texts, audio_paths, feature_cache, audio_store=None):
+    """
+    Builds the model inputs for a batch from cached audio features, computing and caching any missing entries.
+    Returns the same inputs as the processor, or `inputs_embeds` with the audio embeddings already merged in when the
+    cache holds embeddings.
+    """
+    feature_extractor = processor.feature_extractor
+    entries = [feature_cache.get(audio_path) for audio_path in audio_paths]
+
+    for idx, audio_path in enumerate(audio_paths):
+        if entries[idx] is not None:
+            continue
+        audio_data = load_audio(audio_path, feature_extractor.sampling_rate, audio_store=audio_store)
+        features = feature_extractor(
+            audio_data,
+            sampling_rate=feature_extractor.sampling_rate,
+            return_attention_mask=True,
+            padding="max_length",
+            return_tensors="pt"
+        )
+        # The padded frames are kept: they are not all zero and the audio tower's convolutions see them.
+        entry = {
+            'input_features': features['input_features'][0].clone(),
+            'num_frames': int(features['attention_mask'].sum())
+        }
+        if feature_cache.cache_embeddings:
+            input_features = features['input_features'].to(model.device, dtype=model.dtype)
+            feature_attention_mask = features['attention_mask'].to(model.device)
+            entry['audio_embeds'] = encode_qwen2_audio(model, input_features, feature_attention_mask)[0].cpu()
+        feature_cache.put(audio_path, entry)
+        entries[idx] = entry
+
+    # The processor expands the audio placeholder to one token per audio embedding; do the same here.
+    audio_token = getattr(processor, 'audio_token', '<|AUDIO|>')
+    num_frames = [entry['num_frames'] for entry in entries]
+    expanded_texts = [
+        text.replace(audio_token, audio_token * num_audio_tokens(frames), 1)
+        for text, frames in zip(texts, num_frames)
+    ]
+    text_inputs = processor.tokenizer(expanded_texts, return_tensors="pt", padding=True).to(model.device)
+
+    if feature_cache.cache_embeddings:
+        input_ids = text_inputs['input_ids']
+        inputs_embeds = model.get_input_embeddings()(input_ids)
+        audio_embeds = torch.cat([entry['audio_embeds'] for entry in entries]).to(inputs_embeds.device, inputs_embeds.dtype)
+        audio_mask = (input_ids == model.config.audio_token_index).unsqueeze(-1).expand_as(inputs_embeds)
+        return {
+            'inputs_embeds': inputs_embeds.masked_scatter(audio_mask, audio_embeds),
+            'attention_mask': text_inputs['attention_mask']
+        }
+
+    input_features = torch.stack([entry['input_features'] for entry in entries])
+    feature_attention_mask = torch.zeros(input_features.shape[::2], dtype=torch.long)
+    for idx, frames in enumerate(num_frames):
+        feature_attention_mask[idx, :frames] = 1
+
+    return {
+        'input_ids': text_inputs['input_ids'],
+        'attention_mask': text_inputs['attention_mask'],
+        'input_features': input_features.to(model.device),
+        'feature_attention_mask': feature_attention_mask.to(model.device)
+    }
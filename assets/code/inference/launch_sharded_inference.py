@@ -0,0 +1,179 @@
+'''
+Launches data-parallel sharded inference on one node. It starts one worker process per shard of run_SAGE_inference.py
+or run_spoken_stereoset_inference.py, pins each worker to a GPU or a set of CPU cores, streams the worker output with
+a shard prefix (and into a per-shard log file), and merges the shard result logs back into input order at the end.
+
+Arguments after '--' are passed to every worker unchanged. Pass --seed there so that a sharded run samples the same
+answers as a serial run (with --batch_size 1: a batch is seeded as a whole, and shards batch different items), e.g.
+
+    python launch_sharded_inference.py --script run_SAGE_inference.py --num_shards 4 --devices 0,1,2,3 \
+        --input_json sage_test.json --output_json sage_results.json -- --model qwen2 --seed 0
+
+'''
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+
+from result_log import merge_logs, result_key, skip_report_path, write_skip_report
+from sharding import read_run_manifest, shard_output_path
+
+
+def stream_output(process, prefix, log_file_path):
+    """
+    Copies a worker's output to stdout, one prefixed line at a time, and to its log file.
+    """
+    with open(log_file_path, 'w') as log_file:
+        for line in process.stdout:
+            log_file.write(line)
+            log_file.flush()
+            sys.stdout.write(f"{prefix} {line}")
+            sys.stdout.flush()
+
+
+def pin_to_cpus(cpus):
+    """
+    Returns a function that pins the calling process to `cpus`, for use as a subprocess preexec_fn.
+    """
+    def pin():
+        os.sched_setaffinity(0, cpus)
+    return pin
+
+
+def launch_shards(script, input_json_path, output_json_path, num_shards, worker_args, devices=None,
+                  cpus_per_shard=None, balance_shards=False):
+    """
+    Starts one worker per shard, waits for all of them, and returns their exit codes.
+    """
+    available_cpus = sorted(os.sched_getaffinity(0)) if cpus_per_shard else None
+    processes, threads = [], []
+    for shard_id in range(num_shards):
+        command = [
+            sys.executable, script,
+            '--input_json', input_json_path,
+            '--output_json', output_json_path,
+            '--num_shards', str(num_shards),
+            '--shard_id', str(shard_id),
+            '--no-consolidate'
+        ]
+        if balance_shards:
+            command.append('--balance_shards')
+        command.extend(worker_args)
+
+        env = dict(os.environ)
+        preexec_fn = None
+        if devices:
+            env['CUDA_VISIBLE_DEVICES'] = devices[shard_id % len(devices)]
+        if cpus_per_shard:
+            start = (shard_id * cpus_per_shard) % len(available_cpus)
+            cpus = available_cpus[start:start + cpus_per_shard]
+            preexec_fn = pin_to_cpus(cpus)
+            env['OMP_NUM_THREADS'] = env['MKL_NUM_THREADS'] = str(len(cpus))
+
+        process = subprocess.Popen(
+            command, env=env, preexec_fn=preexec_fn, text=True, bufsize=1,
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT
+        )
+        log_file_path = os.path.splitext(shard_output_path(output_json_path, shard_id, num_shards))[0] + '.log'
+        thread = threading.Thread(
+            target=stream_output, args=(process, f"[shard {shard_id}]", log_file_path), daemon=True
+        )
+        thread.start()
+        processes.append(process)
+        threads.append(thread)
+
+    exit_codes = [process.wait() for process in processes]
+    for thread in threads:
+        thread.join()
+    return exit_codes
+
+
+def merge_shards(input_json_path, output_json_path, num_shards):
+    """
+    Merges the shard logs of every run (one per adapter in a sweep) into its output JSON, in input order, and the shard
+    skip reports into one report next to it. The runs are read from the manifests the shards wrote, so logs left over
+    from earlier runs are never merged. Returns the merged output paths.
+    """
+    with open(input_json_path, 'r') as f:
+        key_order = [result_key(item) for item in json.load(f)]
+
+    manifests = [read_run_manifest(output_json_path, shard_id, num_shards) for shard_id in range(num_shards)]
+    missing = [shard_id for shard_id, manifest in enumerate(manifests) if manifest is None]
+    if missing:
+        print(f"Error: Shards {missing} wrote no run manifest; nothing merged.")
+        return []
+
+    merged = []
+    for shard_runs in zip(*manifests):
+        merged_path = shard_runs[0]['output']
+        log_paths = [run['log'] for run in shard_runs]
+        missing_logs = [log_path for log_path in log_paths if not os.path.exists(log_path)]
+        if missing_logs:
+            print(f"Warning: Missing shard logs {missing_logs}. Skipping {merged_path}.")
+            continue
+        num_results = merge_logs(log_paths, merged_path, key_order=key_order)
+        print(f"Merged {num_results} results from {num_shards} shards into {merged_path}")
+        merged.append(merged_path)
+
+        skipped = []
+        for run in shard_runs:
+            if os.path.exists(run['skip_report']):
+                with open(run['skip_report'], 'r') as f:
+                    skipped.extend(json.load(f))
+        if skipped:
+            write_skip_report(merged_path, skipped)
+            print(f"Skipped {len(skipped)} items; see {skip_report_path(merged_path)}")
+        elif os.path.exists(skip_report_path(merged_path)):
+            os.remove(skip_report_path(merged_path))
+    return merged
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run sharded inference with one worker process per shard.")
+    parser.add_argument('--script', type=str, default='run_SAGE_inference.py',
+                        help="Inference script to run in every worker. Default is run_SAGE_inference.py.")
+    parser.add_argument('--input_json', type=str, required=True,
+                        help="Path to the input JSON file for the benchmark.")
+    parser.add_argument('--output_json', type=str, required=True,
+                        help="Path of the merged output JSON file.")
+    parser.add_argument('--num_shards', type=int, required=True,
+                        help="Number of worker processes.")
+    parser.add_argument('--devices', type=str, default=None,
+                        help="Comma-separated GPU ids assigned round-robin to the workers, e.g. '0,1,2,3'.")
+    parser.add_argument('--cpus_per_shard', type=int, default=None,
+                        help="Pin every worker to its own set of this many CPU cores.")
+    parser.add_argument('--balance_shards', action='store_true',
+                        help="Balance shards by total audio duration instead of dealing items round-robin.")
+    parser.add_argument('--preflight', action=argparse.BooleanOptionalAction, default=True,
+                        help="Run the worker script with --dry_run first and stop if it finds problems. Missing audio "
+                             "files are only warnings, since the workers skip them.")
+    parser.add_argument('worker_args', nargs=argparse.REMAINDER,
+                        help="Arguments after '--' are passed to every worker.")
+
+    args = parser.parse_args()
+    worker_args = args.worker_args[1:] if args.worker_args[:1] == ['--'] else args.worker_args
+    devices = args.devices.split(',') if args.devices else None
+
+    # A dry run of the worker script checks the inputs in under a second, before any shard loads a model.
+    if args.preflight:
+        preflight = subprocess.run([
+            sys.executable, args.script, '--input_json', args.input_json, '--output_json', args.output_json,
+            '--num_shards', str(args.num_shards), *worker_args, '--dry_run'
+        ])
+        if preflight.returncode != 0:
+            print("Error: The dry run found problems; no shards were started.")
+            sys.exit(1)
+
+    exit_codes = launch_shards(
+        args.script, args.input_json, args.output_json, args.num_shards, worker_args,
+        devices=devices, cpus_per_shard=args.cpus_per_shard, balance_shards=args.balance_shards
+    )
+    failed = [shard_id for shard_id, code in enumerate(exit_codes) if code != 0]
+    if failed:
+        print(f"Error: Shards {failed} failed. Re-run with '-- --resume' to continue from the shard logs.")
+        sys.exit(1)
+
+    merge_shards(args.input_json, args.output_json, args.num_shards)
@@ -0,0 +1,167 @@
+'''
+LLaMA-Omni inference helpers shared by the Spoken StereoSet and SAGE inference scripts. The model runs in-process
+through the omni_speech package of the LLaMA-Omni repository (see llama_omni_reqs.txt), with the 'llama_3'
+conversation template of omni_speech and Whisper log-mel input, so no converted question file is needed. A LoRA
+adapter gets the system prompt it was trained with (see model_backends.adapter_system_prompt); train_packed.py renders
+its training chats with the same template.
+
+'''
+
+import numpy as np
+import torch
+import whisper
+from omni_speech.constants import DEFAULT_SPEECH_TOKEN
+from omni_speech.conversation import conv_templates
+from omni_speech.datasets.preprocess import tokenizer_speech_token
+from transformers import StoppingCriteriaList
+
+from audio_store import load_audio
+from decode_policy import DecodeStoppingCriteria
+from profiling import generation_timer, stage
+
+SAMPLE_RATE = 16000
+CONV_MODE = 'llama_3'
+# Pad token of the LLaMA-Omni inference script (<|finetune_right_pad_id|>); the tokenizer defines none.
+PAD_TOKEN_ID = 128004
+
+
+def build_prompt(prompt, system=None):
+    """
+    Builds the single-turn chat prompt for a text prompt, with the speech placeholder before it. `system` replaces the
+    template's system prompt.
+    """
+    conv = conv_templates[CONV_MODE].copy()
+    if system is not None:
+        conv.system = system
+    conv.append_message(conv.roles[0], f"{DEFAULT_SPEECH_TOKEN}\n{prompt}")
+    conv.append_message(conv.roles[1], None)
+    return conv.get_prompt()
+
+
+def count_prompt_tokens(tokenizer, prompt):
+    """
+    Returns the number of text tokens in a prompt, used to bucket items by length.
+    """
+    return len(tokenizer(prompt, add_special_tokens=False)['input_ids'])
+
+
+def speech_features(model, audio_data):
+    """
+    Returns the (frames, mel bins) Whisper log-mel features of 16 kHz audio, padded or trimmed to 30 seconds.
+    """
+    num_mel_bins = model.get_speech_encoder().conv1.in_channels
+    audio_data = whisper.pad_or_trim(np.asarray(audio_data, np.float32))
+    return whisper.log_mel_spectrogram(audio_data, n_mels=num_mel_bins).permute(1, 0)
+
+
+def featurise_llama_omni_batch(model, tokenizer, audio_paths, prompts, audio_store=None, system=None):
+    """
+    Builds the chat prompts for a batch of items and featurises them into model inputs, ready for generation. Prompts
+    are left-padded, so that every row continues right after its own prompt.
+    """
+    with stage('audio_load'):
+        audio_data = [load_audio(audio_path, SAMPLE_RATE, audio_store=audio_store) for audio_path in audio_paths]
+
+    with stage('featurise'):
+        prompt_ids = [tokenizer_speech_token(build_prompt(prompt, system), tokenizer, return_tensors='pt') for prompt in prompts]
+        max_len = max(len(ids) for ids in prompt_ids)
+        input_ids = torch.full((len(prompt_ids), max_len), PAD_TOKEN_ID, dtype=torch.long)
+        attention_mask = torch.zeros((len(prompt_ids), max_len), dtype=torch.long)
+        for row, ids in enumerate(prompt_ids):
+            input_ids[row, max_len - len(ids):] = ids
+            attention_mask[row, max_len - len(ids):] = 1
+        speech = [speech_features(model, audio) for audio in audio_data]
+
+    with stage('h2d', synchronize=True):
+        return {
+            'input_ids': input_ids.to(model.device),
+            'attention_mask': attention_mask.to(model.device),
+            'speech': torch.stack(speech).to(model.device, dtype=model.dtype),
+            'speech_lengths': torch.tensor([features.shape[0] for features in speech], device=model.device)
+        }
+
+
+def generate_llama_omni_batch(model, tokenizer, inputs, temperature=0.7, max_new_tokens=512, num_samples=1,
+                              decode_policies=None, row_options=None):
+    """
+    Generates `num_samples` responses for every row of featurised inputs, with the same output layout as
+    qwen2_inference.generate_qwen2_batch: a flat list of responses, samples of a row next to each other, and the
+    number of generated tokens and stop reason of every response. A `temperature` of 0 decodes greedily.
+    """
+    num_rows = len(inputs['attention_mask'])
+    if decode_policies is None:
+        decode_policies = [{'max_new_tokens': max_new_tokens}] * num_rows
+    if row_options is None:
+        row_options = [[]] * num_rows
+
+    # The speech embeddings are spliced into the prompt embeddings, and generate only returns the new tokens.
+    stopping = DecodeStoppingCriteria(
+        tokenizer, 0,
+        [policy for policy in decode_policies for _ in range(num_samples)],
+        [options for options in row_options for _ in range(num_samples)]
+    )
+    criteria = StoppingCriteriaList([stopping])
+    timer = generation_timer()
+    if timer is not None:
+        criteria.append(timer)
+    with torch.no_grad():
+        output_ids = model.generate(
+            inputs['input_ids'],
+            attention_mask=inputs['attention_mask'],
+            speech=inputs['speech'],
+            speech_lengths=inputs['speech_lengths'],
+            max_new_tokens=max(policy['max_new_tokens'] for policy in decode_policies),
+            do_sample=temperature > 0,
+            temperature=temperature if temperature > 0 else None,
+            num_return_sequences=num_samples,
+            pad_token_id=PAD_TOKEN_ID,
+            use_cache=True,
+            stopping_criteria=criteria
+        )
+
+    eos_token_ids = model.generation_config.eos_token_id
+    if isinstance(eos_token_ids, int):
+        eos_token_ids = [eos_token_ids]
+    stopping.record(output_ids, set(eos_token_ids or []))
+    if timer is not None:
+        timer.finish(sum(stat['tokens'] for stat in stopping.stats))
+
+    responses = tokenizer.batch_decode(output_ids, skip_special_tokens=True)
+    return [response.strip() for response in responses], stopping.stats
+
+
+def score_llama_omni_options(model, tokenizer, inputs, options):
+    """
+    Scores candidate answers as continuations of a featurised item (see featurise_llama_omni_batch), and returns the
+    summed log-probability and the number of tokens of each option. The prompt and speech are embedded once; all options are then scored in a
+    single batched forward pass over the shared prompt embeddings.
+    """
+    option_ids = [tokenizer(option, add_special_tokens=False)['input_ids'] for option in options]
+    num_options = len(options)
+    max_option_len = max(len(ids) for ids in option_ids)
+
+    input_ids = torch.full((num_options, max_option_len), PAD_TOKEN_ID, dtype=torch.long, device=model.device)
+    option_mask = torch.zeros_like(input_ids)
+    for row, ids in enumerate(option_ids):
+        input_ids[row, :len(ids)] = torch.tensor(ids, dtype=torch.long)
+        option_mask[row, :len(ids)] = 1
+
+    with torch.no_grad():
+        _, _, _, _, prompt_embeds, _ = model.prepare_inputs_labels_for_speech_and_text(
+            inputs['input_ids'], None, inputs['attention_mask'], None, None, inputs['speech'], inputs['speech_lengths']
+        )
+        prompt_len = prompt_embeds.shape[1]
+        option_embeds = model.get_model().embed_tokens(input_ids)
+        outputs = model(
+            inputs_embeds=torch.cat([prompt_embeds.expand(num_options, -1, -1), option_embeds], dim=1),
+            attention_mask=torch.cat([
+                torch.ones((num_options, prompt_len), dtype=option_mask.dtype, device=model.device), option_mask
+            ], dim=1),
+            use_cache=False
+        )
+
+    # The first option token is predicted by the last prompt position, the others by the preceding option tokens.
+    logits = outputs.logits[:, prompt_len - 1:-1, :]
+    log_probs = torch.log_softmax(logits.float(), dim=-1)
+    token_log_probs = log_probs.gather(-1, input_ids.unsqueeze(-1)).squeeze(-1) * option_mask
+    return token_log_probs.sum(dim=1).tolist(), [len(ids) for ids in option_ids]
@@ -0,0 +1,78 @@
+'''
+Bounded prefetch pipeline for the inference loop. A small thread pool loads and featurises the next batches while
+the model generates for the current one. At most `prefetch_depth` batches are in flight, so memory stays bounded,
+and batches are handed back in submission order. Only audio I/O and decode errors skip items; any other error
+(CUDA out of memory, a tokenizer error, a bug) is raised in the calling thread and ends the run. A batch that fails
+with an audio error is featurised again item by item, so one corrupt file only costs its own item.
+
+'''
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from audio_store import audio_errors
+
+
+def _retry_items(featurise, batch, error, skip_errors, discard):
+    # Featurises the items of a failed batch one at a time (in the calling thread), so only the bad ones are skipped.
+    if len(batch) == 1:
+        yield batch, None, error
+        return
+    if discard is not None:
+        discard(batch)
+    for idx in batch:
+        try:
+            inputs = featurise([idx])
+        except skip_errors as item_error:
+            yield [idx], None, item_error
+            continue
+        yield [idx], inputs, None
+
+
+def prefetch_batches(featurise, batches, prefetch_depth=2, num_workers=1, skip_errors=None, discard=None):
+    """
+    Yields (batch, inputs, error) for every batch, in order. `inputs` is the result of `featurise(batch)`, computed
+    ahead of time in a worker thread; if featurisation raised one of `skip_errors` (default: audio_store.audio_errors),
+    the batch is split into single items that are featurised again, and each failing item is yielded with `inputs`
+    None and `error` holding its exception. `discard(batch)` is called for a batch that is split (e.g. to drop its
+    profiling record). Other exceptions are re-raised.
+    With `featurise` None or `prefetch_depth` 0, batches are featurised inline in the calling thread.
+    """
+    if skip_errors is None:
+        skip_errors = audio_errors()
+    if featurise is None:
+        for batch in batches:
+            yield batch, None, None
+        return
+
+    if prefetch_depth <= 0:
+        for batch in batches:
+            try:
+                inputs = featurise(batch)
+            except skip_errors as error:
+                yield from _retry_items(featurise, batch, error, skip_errors, discard)
+                continue
+            yield batch, inputs, None
+        return
+
+    batches = iter(batches)
+    in_flight = deque()
+    with ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix='prefetch') as executor:
+        def submit_next():
+            batch = next(batches, None)
+            if batch is not None:
+                in_flight.append((batch, executor.submit(featurise, batch)))
+
+        for _ in range(prefetch_depth):
+            submit_next()
+
+        while in_flight:
+            batch, future = in_flight.popleft()
+            # Refill before blocking on the oldest batch, so the workers stay busy while the caller generates.
+            submit_next()
+            try:
+                inputs = future.result()
+            except skip_errors as error:
+                yield from _retry_items(featurise, batch, error, skip_errors, discard)
+                continue
+            yield batch, inputs, None
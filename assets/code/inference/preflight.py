@@ -0,0 +1,167 @@
+'''
+Preflight checks behind --dry_run of the inference scripts. Before any model is loaded they check that every item has
+the keys the script reads (accepting the known spellings of the option keys), that every audio file exists and looks
+like audio (checked in parallel), that the other input paths exist, and estimate the runtime from earlier numbers: a
+benchmark_pipeline.py results JSON or a --metrics_path file of an earlier run. Only the standard library is imported,
+so a bad config fails in well under a second instead of after waiting for a GPU.
+
+Missing audio files are only warnings, since the run skips them and lists them in its skip report; the dry run fails
+on them only if no audio file exists at all, which points to a wrong path rather than a few missing files.
+
+'''
+
+import json
+import os
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+# The first bytes of the audio formats used by the datasets.
+AUDIO_MAGIC = {'.wav': (b'RIFF', b'WAVE'), '.flac': (b'fLaC', None)}
+# The problem reported for a missing audio file, the same as the skip reason of the run.
+MISSING_AUDIO = 'audio file not found'
+
+
+def check_audio_file(audio_path):
+    """
+    Returns the problem with an audio file, or None if it exists, is not empty and has the header of its format.
+    """
+    try:
+        with open(audio_path, 'rb') as f:
+            header = f.read(12)
+    except FileNotFoundError:
+        return MISSING_AUDIO
+    except OSError as e:
+        return e.strerror or str(e)
+    if not header:
+        return "empty file"
+    magic = AUDIO_MAGIC.get(os.path.splitext(audio_path)[1].lower())
+    if magic is not None and (header[:4] != magic[0] or (magic[1] is not None and header[8:12] != magic[1])):
+        return "not a valid audio file header"
+    return None
+
+
+def check_audio_paths(audio_paths, num_workers=32):
+    """
+    Checks the unique audio paths in parallel and returns a dict from path to problem for the bad ones.
+    """
+    unique_paths = sorted(set(audio_paths))
+    with ThreadPoolExecutor(max_workers=num_workers) as pool:
+        problems = pool.map(check_audio_file, unique_paths)
+    return {path: problem for path, problem in zip(unique_paths, problems) if problem is not None}
+
+
+def load_items(input_json_path):
+    """
+    Returns the items of a benchmark JSON file, or None (after printing the problem) if it cannot be read.
+    """
+    try:
+        with open(input_json_path, 'r') as f:
+            items = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"ERROR: cannot read {input_json_path}: {e}")
+        return None
+    if not isinstance(items, list):
+        print(f"ERROR: {input_json_path} is not a JSON list of items.")
+        return None
+    return items
+
+
+def check_items(items, required_keys, key_variants=()):
+    """
+    Checks that every item has `required_keys` and one spelling of every group in `key_variants`. Returns the list
+    of problems and a Counter of the spellings that were used.
+    """
+    problems = []
+    used = Counter()
+    for idx, item in enumerate(items):
+        if not isinstance(item, dict):
+            problems.append(f"item {idx}: not a JSON object")
+            continue
+        missing = [key for key in required_keys if key not in item]
+        for variants in key_variants:
+            present = [key for key in variants if key in item]
+            if present:
+                used[present[0]] += 1
+            else:
+                missing.append(' or '.join(variants))
+        if missing:
+            problems.append(f"item {idx}: missing {', '.join(missing)}")
+    return problems, used
+
+
+def seconds_per_item(estimate_path, stage):
+    """
+    Returns the seconds per item and one-off seconds (model loading) measured in an earlier run, read from a
+    benchmark_pipeline.py results JSON (the `stage` entry) or from an inference metrics JSONL file.
+    """
+    with open(estimate_path, 'r') as f:
+        if estimate_path.endswith('.jsonl'):
+            records = [json.loads(line) for line in f if line.strip()]
+            batches = [record for record in records if record['event'] == 'batch']
+            num_items = sum(record['num_items'] for record in batches)
+            if not num_items:
+                raise ValueError(f"{estimate_path} has no batch records.")
+            batch_seconds = sum(sum(record['stages'].values()) for record in batches)
+            setup_seconds = sum(record['stages']['model_load'] for record in records if record['event'] == 'model_load')
+            return batch_seconds / num_items, setup_seconds
+        result = json.load(f)['stages'].get(stage)
+    if result is None or not result.get('items_per_sec'):
+        raise ValueError(f"{estimate_path} has no successful '{stage}' stage.")
+    return 1.0 / result['items_per_sec'], 0.0
+
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}"
+
+
+def run_preflight(items, required_keys, key_variants=(), audio_key='Audio Path', paths=None, estimate_path=None,
+                  stage=None, num_shards=1, num_runs=1):
+    """
+    Runs the checks on the items of a benchmark and prints a report. `paths` maps a description to a path that must
+    exist (e.g. the audio store or a LoRA checkpoint). Returns True if nothing is wrong; missing audio files are only
+    warnings, as the run skips them.
+    """
+    item_problems, used = check_items(items, required_keys, key_variants)
+    print(f"Items: {len(items)}")
+    if used:
+        print("Key spellings: " + ', '.join(f"'{key}' x{count}" for key, count in sorted(used.items())))
+    problems = item_problems[:20]
+    if len(item_problems) > 20:
+        problems.append(f"... and {len(item_problems) - 20} more items with missing keys")
+
+    audio_paths = [item[audio_key] for item in items if isinstance(item, dict) and audio_key in item]
+    bad_audio = check_audio_paths(audio_paths)
+    missing = sorted(path for path, problem in bad_audio.items() if problem == MISSING_AUDIO)
+    bad_audio = {path: problem for path, problem in bad_audio.items() if problem != MISSING_AUDIO}
+    print(f"Audio files: {len(set(audio_paths))} unique, {len(missing)} missing, {len(bad_audio)} bad")
+    for audio_path, problem in sorted(bad_audio.items())[:20]:
+        problems.append(f"audio {audio_path}: {problem}")
+    if len(bad_audio) > 20:
+        problems.append(f"... and {len(bad_audio) - 20} more bad audio files")
+    if missing and len(missing) == len(set(audio_paths)):
+        problems.append(f"none of the {len(missing)} audio files exists, e.g. {missing[0]}")
+    else:
+        for audio_path in missing[:20]:
+            print(f"WARNING: audio {audio_path}: {MISSING_AUDIO}; the run will skip its items")
+        if len(missing) > 20:
+            print(f"WARNING: ... and {len(missing) - 20} more missing audio files")
+
+    for description, path in (paths or {}).items():
+        if path is not None and not os.path.exists(path):
+            problems.append(f"{description} does not exist: {path}")
+
+    if estimate_path is not None:
+        try:
+            per_item, setup = seconds_per_item(estimate_path, stage)
+            total = setup + per_item * len(items) * num_runs / num_shards
+            print(f"Estimated runtime: {format_duration(total)} per shard ({per_item:.3f} s/item x {len(items)} items "
+                  f"x {num_runs} runs / {num_shards} shards + {setup:.0f} s setup, from {estimate_path})")
+        except (OSError, KeyError, ValueError) as e:
+            problems.append(f"cannot estimate the runtime from {estimate_path}: {e}")
+
+    for problem in problems:
+        print(f"ERROR: {problem}")
+    print("Dry run OK." if not problems else f"Dry run found {len(problems)} problems.")
+    return not problems
@@ -0,0 +1,321 @@
+'''
+Per-stage profiling of the inference loop. With a metrics path, every batch gets one JSONL record with the time spent
+in each stage (audio loading and resampling, processor featurisation, host-to-device transfer, prefill and decode),
+the decode throughput and the peak memory so far; model loading gets a record of its own. A summary table is printed
+at the end of the run. Optionally, a window of items is captured with torch.profiler or cProfile.
+
+The model helpers mark their stages with `stage(...)`, which is a no-op unless a batch is being profiled in the
+calling thread, so featurisation in prefetch threads is attributed to the right batch. A synchronised stage in a
+prefetch thread (the host-to-device copy) runs on a CUDA stream of that thread and only waits for that stream:
+waiting for the whole device would also wait for the generate call of the main thread and charge it to the stage.
+
+'''
+
+import cProfile
+import json
+import pstats
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+STAGES = ['model_load', 'audio_load', 'featurise', 'h2d', 'prefill', 'decode', 'score']
+_active = threading.local()
+
+
+def _cuda():
+    """
+    Returns the torch.cuda module if torch is loaded and a GPU is available, without importing torch.
+    """
+    torch = sys.modules.get('torch')
+    if torch is not None and torch.cuda.is_available():
+        return torch.cuda
+    return None
+
+
+def _synchronize():
+    cuda = _cuda()
+    if cuda is not None:
+        cuda.synchronize()
+
+
+def _add_stage(metrics, name, seconds):
+    metrics['stages'][name] = metrics['stages'].get(name, 0.0) + seconds
+
+
+def _thread_stream(cuda):
+    stream = getattr(_active, 'stream', None)
+    if stream is None:
+        stream = _active.stream = cuda.Stream()
+    return stream
+
+
+@contextmanager
+def stage(name, synchronize=False):
+    """
+    Times a stage of the batch profiled in this thread. With `synchronize`, pending GPU work is waited for before
+    and after, so asynchronous kernels are charged to the stage that launched them. Outside the main thread the
+    stage runs on the thread's own CUDA stream, whether profiled or not, and only that stream is waited for.
+    """
+    cuda = _cuda() if synchronize else None
+    if cuda is not None and threading.current_thread() is not threading.main_thread():
+        # The tensors are ready once the stream is synchronised. They are freed on the main thread only after the
+        # generate call that reads them has returned, so the allocator never reuses their memory too early.
+        metrics = getattr(_active, 'metrics', None)
+        stream = _thread_stream(cuda)
+        start = time.perf_counter()
+        try:
+            with cuda.stream(stream):
+                yield
+        finally:
+            stream.synchronize()
+            if metrics is not None:
+                _add_stage(metrics, name, time.perf_counter() - start)
+        return
+
+    metrics = getattr(_active, 'metrics', None)
+    if metrics is None:
+        yield
+        return
+    if synchronize:
+        _synchronize()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if synchronize:
+            _synchronize()
+        _add_stage(metrics, name, time.perf_counter() - start)
+
+
+class GenerationTimer:
+    """
+    Stopping criterion that never stops generation and only notes when the first new token is ready, which splits
+    a generate call into prefill (including the first token) and decode.
+    """
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+        self.start = time.perf_counter()
+        self.first_token = None
+
+    def __call__(self, input_ids, scores, **kwargs):
+        if self.first_token is None:
+            self.first_token = time.perf_counter()
+        return input_ids.new_zeros(input_ids.shape[0]).bool()
+
+    def finish(self, num_tokens):
+        """
+        Charges the generate call to the prefill and decode stages, and adds the tokens it generated.
+        """
+        end = time.perf_counter()
+        first_token = self.first_token or end
+        _add_stage(self.metrics, 'prefill', first_token - self.start)
+        _add_stage(self.metrics, 'decode', end - first_token)
+        self.metrics['generated_tokens'] += num_tokens
+
+
+def generation_timer():
+    """
+    Returns a GenerationTimer for the batch profiled in this thread, or None if nothing is being profiled.
+    """
+    metrics = getattr(_active, 'metrics', None)
+    return GenerationTimer(metrics) if metrics is not None else None
+
+
+def peak_rss_bytes():
+    # ru_maxrss is in kilobytes on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class InferenceProfiler:
+    """
+    Collects per-batch stage timings and writes them to `metrics_path` as JSONL. Without a metrics path every method
+    is a no-op, so the inference loop can call it unconditionally.
+
+    `capture` ('torch' or 'cprofile') records a detailed profile of `capture_items` items, starting after
+    `capture_start` items (to skip warm-up). cProfile only sees the main thread, not the prefetch workers.
+    """
+
+    def __init__(self, metrics_path=None, capture=None, capture_start=0, capture_items=10):
+        self.metrics_path = metrics_path
+        self.enabled = metrics_path is not None
+        self.capture = capture if capture != 'none' else None
+        self.capture_start = capture_start
+        self.capture_items = capture_items
+        self.records = []
+        self.run = None
+        self._batches = {}
+        self._lock = threading.Lock()
+        self._file = open(metrics_path, 'w') if self.enabled else None
+        self._num_items = 0
+        self._capturing = None
+        self._captured_items = 0
+
+    def _write(self, record):
+        self.records.append(record)
+        self._file.write(json.dumps(record) + '\n')
+        self._file.flush()
+
+    @contextmanager
+    def measure(self, name):
+        """
+        Times a one-off stage outside the batch loop, e.g. model loading, and writes it as its own record.
+        """
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        yield
+        _synchronize()
+        self._write({'event': name, 'stages': {name: time.perf_counter() - start}, 'peak_rss_bytes': peak_rss_bytes()})
+
+    def begin_run(self, run):
+        """
+        Starts a new run (e.g. one adapter of a sweep); records are tagged with its name.
+        """
+        self.run = run
+        self._batches = {}
+
+    def _metrics(self, batch):
+        with self._lock:
+            return self._batches.setdefault(tuple(batch), {'stages': {}, 'generated_tokens': 0})
+
+    @contextmanager
+    def track(self, batch):
+        """
+        Attributes the stages run in this thread to `batch` (a list of item indices).
+        """
+        if not self.enabled:
+            yield
+            return
+        previous = getattr(_active, 'metrics', None)
+        _active.metrics = self._metrics(batch)
+        try:
+            yield
+        finally:
+            _active.metrics = previous
+
+    def start_batch(self, batch):
+        """
+        Called on the main thread before a batch is generated; starts the capture window when it is reached.
+        """
+        if not self.enabled:
+            return
+        cuda = _cuda()
+        if cuda is not None:
+            cuda.reset_peak_memory_stats()
+        if self.capture and self._capturing is None and self._captured_items < self.capture_items \
+                and self._num_items >= self.capture_start:
+            self._start_capture()
+
+    def finish_batch(self, batch, audio_paths):
+        """
+        Writes the record of a generated batch, and ends the capture window once enough items are captured.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            metrics = self._batches.pop(tuple(batch), {'stages': {}, 'generated_tokens': 0})
+        decode_seconds = metrics['stages'].get('decode', 0.0)
+        cuda = _cuda()
+        self._write({
+            'event': 'batch',
+            'run': self.run,
+            'audio_paths': audio_paths,
+            'num_items': len(audio_paths),
+            'stages': metrics['stages'],
+            'generated_tokens': metrics['generated_tokens'],
+            'decode_tokens_per_sec': metrics['generated_tokens'] / decode_seconds if decode_seconds > 0 else None,
+            'peak_rss_bytes': peak_rss_bytes(),
+            'peak_gpu_bytes': cuda.max_memory_allocated() if cuda is not None else None
+        })
+
+        self._num_items += len(audio_paths)
+        if self._capturing is not None:
+            self._captured_items += len(audio_paths)
+            if self._captured_items >= self.capture_items:
+                self._stop_capture()
+
+    def discard(self, batch):
+        """
+        Drops the stages of a batch that failed to featurise.
+        """
+        with self._lock:
+            self._batches.pop(tuple(batch), None)
+
+    def _start_capture(self):
+        print(f"Capturing a {self.capture} profile of {self.capture_items} items after {self._num_items} items.")
+        if self.capture == 'cprofile':
+            self._capturing = cProfile.Profile()
+            self._capturing.enable()
+            return
+
+        import torch
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if _cuda() is not None:
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+        self._capturing = torch.profiler.profile(activities=activities, record_shapes=True, profile_memory=True)
+        self._capturing.__enter__()
+
+    def _stop_capture(self):
+        if self.capture == 'cprofile':
+            self._capturing.disable()
+            stats_path = self.metrics_path + '.prof'
+            self._capturing.dump_stats(stats_path)
+            pstats.Stats(self._capturing).sort_stats('cumulative').print_stats(20)
+        else:
+            self._capturing.__exit__(None, None, None)
+            stats_path = self.metrics_path + '.trace.json'
+            self._capturing.export_chrome_trace(stats_path)
+            print(self._capturing.key_averages().table(sort_by='self_cpu_time_total', row_limit=20))
+        print(f"Profile saved to {stats_path}")
+        self._capturing = None
+
+    def close(self):
+        """
+        Ends any open capture window, closes the metrics file and prints the summary table.
+        """
+        if not self.enabled:
+            return
+        if self._capturing is not None:
+            self._stop_capture()
+        self._file.close()
+        print(format_summary(self.records))
+        print(f"Metrics saved to {self.metrics_path}")
+
+
+def format_summary(records):
+    """
+    Formats per-stage totals, means and percentiles (per batch) of a list of metrics records as a table.
+    """
+    batches = [record for record in records if record['event'] == 'batch']
+    num_items = sum(record['num_items'] for record in batches)
+    total_seconds = sum(sum(record['stages'].values()) for record in records)
+
+    lines = [f"{'Stage':<12}{'Batches':>9}{'Total s':>10}{'Share':>8}{'Mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}"
+             f"{'ms/item':>10}"]
+    for name in STAGES:
+        seconds = np.array([record['stages'][name] for record in records if name in record['stages']])
+        if len(seconds) == 0:
+            continue
+        per_item = f"{seconds.sum() / num_items * 1000:.1f}" if num_items and name != 'model_load' else '-'
+        lines.append(
+            f"{name:<12}{len(seconds):>9}{seconds.sum():>10.2f}{seconds.sum() / total_seconds:>8.1%}"
+            f"{seconds.mean() * 1000:>10.1f}{np.percentile(seconds, 50) * 1000:>10.1f}"
+            f"{np.percentile(seconds, 95) * 1000:>10.1f}{per_item:>10}"
+        )
+
+    generated_tokens = sum(record['generated_tokens'] for record in batches)
+    decode_seconds = sum(record['stages'].get('decode', 0.0) for record in batches)
+    if decode_seconds > 0:
+        lines.append(f"Decode throughput: {generated_tokens / decode_seconds:.1f} tokens/s over {generated_tokens} tokens")
+    if records:
+        lines.append(f"Peak RSS: {max(record['peak_rss_bytes'] for record in records) / 1024 ** 2:.0f} MB")
+    peak_gpu = [record['peak_gpu_bytes'] for record in batches if record.get('peak_gpu_bytes') is not None]
+    if peak_gpu:
+        lines.append(f"Peak GPU memory per batch: {max(peak_gpu) / 1024 ** 2:.0f} MB")
+    return '\n'.join(lines)
@@ -0,0 +1,244 @@
+'''
+Qwen2-Audio inference helpers shared by the Spoken StereoSet and SAGE inference scripts.
+
+'''
+
+import threading
+
+import torch
+from transformers import DynamicCache, StoppingCriteriaList
+
+from audio_store import load_audio
+from decode_policy import DecodeStoppingCriteria
+from feature_cache import prepare_cached_inputs
+from profiling import generation_timer, stage
+
+
+def build_conversation(audio_path, prompt):
+    """
+    Builds the single-turn chat conversation for an audio file and a text prompt.
+    """
+    return [
+        {"role": "user", "content": [
+            {"type": "audio", "audio": audio_path},
+            {"type": "text", "text": prompt}
+        ]}
+    ]
+
+
+# Fast tokenizers are not safe to call from several threads at once, so featurisation in prefetch workers is
+# serialised around the processor; audio decoding still runs in parallel.
+_processor_lock = threading.Lock()
+
+
+def count_prompt_tokens(processor, prompt):
+    """
+    Returns the number of text tokens in a prompt, used to bucket items by length.
+    """
+    return len(processor.tokenizer(prompt, add_special_tokens=False)['input_ids'])
+
+
+def prepare_qwen2_inputs(model, processor, texts, audio_paths, audio_store=None, feature_cache=None):
+    """
+    Featurises a batch of chat texts and audio files into model inputs, reusing cached audio features if a feature
+    cache is given.
+    """
+    if feature_cache is not None:
+        with _processor_lock, stage('featurise'):
+            return prepare_cached_inputs(model, processor, texts, audio_paths, feature_cache, audio_store=audio_store)
+
+    with stage('audio_load'):
+        audio_data = [
+            load_audio(audio_path, processor.feature_extractor.sampling_rate, audio_store=audio_store)
+            for audio_path in audio_paths
+        ]
+    with _processor_lock, stage('featurise'):
+        inputs = processor(
+            text=texts,
+            audio=audio_data,
+            return_tensors="pt",
+            padding=True
+        )
+    with stage('h2d', synchronize=True):
+        return inputs.to(model.device)
+
+
+def featurise_qwen2_batch(model, processor, audio_paths, prompts, audio_store=None, feature_cache=None):
+    """
+    Builds the chat prompts for a batch of items and featurises them into model inputs, ready for generation.
+    """
+    texts = [
+        processor.apply_chat_template(build_conversation(audio_path, prompt), add_generation_prompt=True, tokenize=False)
+        for audio_path, prompt in zip(audio_paths, prompts)
+    ]
+
+    # Decoder-only generation needs left padding, so that every row continues right after its own prompt.
+    processor.tokenizer.padding_side = 'left'
+    return prepare_qwen2_inputs(
+        model, processor, texts, audio_paths, audio_store=audio_store, feature_cache=feature_cache
+    )
+
+
+def prefill_shared_cache(model, inputs, num_samples):
+    """
+    Prefills every prompt once, up to but excluding its last token, and returns the KV cache repeated `num_samples`
+    times per row, so that one prefill (including the audio encoder) serves all sampled continuations. Returns None
+    if the inputs do not map one-to-one onto cache positions (e.g. `inputs_embeds`, or an unexpanded audio token).
+    """
+    if 'input_ids' not in inputs:
+        return None
+
+    prefix_inputs = dict(inputs)
+    prefix_inputs['input_ids'] = inputs['input_ids'][:, :-1]
+    prefix_inputs['attention_mask'] = inputs['attention_mask'][:, :-1]
+    # Rows are left-padded, so positions have to follow the attention mask, as they do inside generate.
+    prefix_inputs['position_ids'] = (prefix_inputs['attention_mask'].cumsum(-1) - 1).clamp(min=0)
+    with torch.no_grad():
+        cache = model(**prefix_inputs, use_cache=True).past_key_values
+
+    legacy_cache = cache.to_legacy_cache() if hasattr(cache, 'to_legacy_cache') else cache
+    if legacy_cache[0][0].shape[2] != prefix_inputs['input_ids'].shape[1]:
+        return None
+    expanded_cache = tuple(
+        (key.repeat_interleave(num_samples, dim=0), value.repeat_interleave(num_samples, dim=0))
+        for key, value in legacy_cache
+    )
+    if hasattr(cache, 'to_legacy_cache'):
+        expanded_cache = DynamicCache.from_legacy_cache(expanded_cache)
+    return expanded_cache
+
+
+def generate_qwen2_batch(model, processor, inputs, temperature=0.7, max_new_tokens=512, num_samples=1,
+                         decode_policies=None, row_options=None):
+    """
+    Generates `num_samples` responses for every row of featurised inputs. Returns a flat list with the samples of
+    each row next to each other (row 0 sample 0, row 0 sample 1, ..., row 1 sample 0, ...), and the number of
+    generated tokens and stop reason of every response in the same order.
+
+    `decode_policies` holds one decode policy per row (see decode_policy.py) and `row_options` the answer options of
+    every row; without them every row gets `max_new_tokens` and no early stopping. A `temperature` of 0 decodes
+    greedily.
+    """
+    num_rows = len(inputs['attention_mask'])
+    if decode_policies is None:
+        decode_policies = [{'max_new_tokens': max_new_tokens}] * num_rows
+    if row_options is None:
+        row_options = [[]] * num_rows
+
+    # When generating from `inputs_embeds` only the new tokens are returned.
+    prompt_len = inputs['input_ids'].shape[1] if 'input_ids' in inputs else 0
+    stopping = DecodeStoppingCriteria(
+        processor.tokenizer, prompt_len,
+        [policy for policy in decode_policies for _ in range(num_samples)],
+        [options for options in row_options for _ in range(num_samples)]
+    )
+    criteria = StoppingCriteriaList([stopping])
+    timer = generation_timer()
+    if timer is not None:
+        criteria.append(timer)
+    generate_kwargs = dict(
+        max_new_tokens=max(policy['max_new_tokens'] for policy in decode_policies),
+        stopping_criteria=criteria
+    )
+    if temperature > 0:
+        generate_kwargs.update(do_sample=True, temperature=temperature)
+    else:
+        generate_kwargs.update(do_sample=False, temperature=None, top_p=None, top_k=None)
+
+    shared_cache = None
+    if num_samples > 1:
+        with stage('prefill', synchronize=True):
+            shared_cache = prefill_shared_cache(model, inputs, num_samples)
+    if shared_cache is not None:
+        # Only the last prompt token is left to run; the audio features are already in the cache.
+        generate_ids = model.generate(
+            input_ids=inputs['input_ids'].repeat_interleave(num_samples, dim=0),
+            attention_mask=inputs['attention_mask'].repeat_interleave(num_samples, dim=0),
+            past_key_values=shared_cache,
+            **generate_kwargs
+        )
+    else:
+        generate_ids = model.generate(**inputs, num_return_sequences=num_samples, **generate_kwargs)
+
+    output_ids = generate_ids[:, prompt_len:]
+    eos_token_ids = model.generation_config.eos_token_id
+    if isinstance(eos_token_ids, int):
+        eos_token_ids = [eos_token_ids]
+    stopping.record(output_ids, set(eos_token_ids or []))
+    if timer is not None:
+        timer.finish(sum(stat['tokens'] for stat in stopping.stats))
+
+    responses = processor.batch_decode(output_ids, skip_special_tokens=True, clean_up_tokenization_spaces=False)
+    return responses, stopping.stats
+
+
+def run_qwen2_batch_inference(model, processor, audio_paths, prompts, temperature=0.7, max_new_tokens=512,
+                              audio_store=None, feature_cache=None):
+    """
+    Runs inference using the Qwen2-Audio-7B-Instruct model on a batch of items. Returns one response per item, in
+    the order of `audio_paths`.
+    """
+    inputs = featurise_qwen2_batch(
+        model, processor, audio_paths, prompts, audio_store=audio_store, feature_cache=feature_cache
+    )
+    responses, _ = generate_qwen2_batch(
+        model, processor, inputs, temperature=temperature, max_new_tokens=max_new_tokens
+    )
+    return responses
+
+
+def run_qwen2_inference(model, processor, audio_path, prompt, temperature=0.7, audio_store=None, feature_cache=None):
+    """
+    Runs inference using the Qwen2-Audio-7B-Instruct model.
+    """
+    return run_qwen2_batch_inference(
+        model, processor, [audio_path], [prompt], temperature=temperature, audio_store=audio_store,
+        feature_cache=feature_cache
+    )[0]
+
+
+def score_qwen2_options(model, processor, inputs, options):
+    """
+    Scores candidate answers as continuations of a featurised item (see featurise_qwen2_batch), and returns the summed
+    log-probability and the number of tokens of each option. The shared prefix is prefilled once; all options are then
+    scored in a single batched forward pass that reuses the prefix KV cache.
+    """
+    option_ids = [processor.tokenizer(option, add_special_tokens=False)['input_ids'] for option in options]
+    num_options = len(options)
+    max_option_len = max(len(ids) for ids in option_ids)
+
+    pad_token_id = processor.tokenizer.pad_token_id or 0
+    input_ids = torch.full((num_options, max_option_len), pad_token_id, dtype=torch.long, device=model.device)
+    option_mask = torch.zeros_like(input_ids)
+    for row, ids in enumerate(option_ids):
+        input_ids[row, :len(ids)] = torch.tensor(ids, dtype=torch.long)
+        option_mask[row, :len(ids)] = 1
+
+    with torch.no_grad():
+        prefix = model(**inputs, use_cache=True)
+
+        # The prefix length is read from the cache, since the audio placeholder may be expanded inside the model.
+        cache = prefix.past_key_values
+        legacy_cache = cache.to_legacy_cache() if hasattr(cache, 'to_legacy_cache') else cache
+        prefix_len = legacy_cache[0][0].shape[2]
+        option_cache = tuple(
+            (key.expand(num_options, -1, -1, -1).contiguous(), value.expand(num_options, -1, -1, -1).contiguous())
+            for key, value in legacy_cache
+        )
+        if hasattr(cache, 'to_legacy_cache'):
+            option_cache = DynamicCache.from_legacy_cache(option_cache)
+
+        prefix_mask = torch.ones((num_options, prefix_len), dtype=option_mask.dtype, device=model.device)
+        outputs = model(
+            input_ids=input_ids,
+            attention_mask=torch.cat([prefix_mask, option_mask], dim=1),
+            past_key_values=option_cache,
+            use_cache=False
+        )
+
+    # The first option token is predicted by the last prefix position, the others by the preceding option tokens.
+    logits = torch.cat([prefix.logits[:, -1:, :].expand(num_options, -1, -1), outputs.logits[:, :-1, :]], dim=1)
+    log_probs = torch.log_softmax(logits.float(), dim=-1)
+    token_log_probs = log_probs.gather(-1, input_ids.unsqueeze(-1)).squeeze(-1) * option_mask
+    return token_log_probs.sum(dim=1).tolist(), [len(ids) for ids in option_ids]
+
@@ -0,0 +1,153 @@
+'''
+Append-only JSONL result log shared by the inference scripts. Every finished item is written as one line, so a run
+that gets preempted only loses the items that were in flight. The log can be consolidated into the indented JSON list
+layout that the rest of the pipeline expects.
+
+'''
+
+import json
+import os
+import time
+
+
+def default_log_path(output_json_path):
+    """
+    Returns the JSONL log path that sits next to the consolidated output JSON.
+    """
+    root, _ = os.path.splitext(output_json_path)
+    return root + '.jsonl'
+
+
+def skip_report_path(output_json_path):
+    """
+    Returns the path of the report of skipped items that sits next to the output JSON.
+    """
+    root, _ = os.path.splitext(output_json_path)
+    return root + '.skipped.json'
+
+
+def write_skip_report(output_json_path, skipped):
+    """
+    Writes the items that were skipped during a run, each with its audio path, prompt and reason.
+    """
+    with open(skip_report_path(output_json_path), 'w') as f:
+        json.dump(skipped, f, indent=4)
+
+
+def result_key(record):
+    """
+    Returns the (audio path, text prompt) pair that identifies an item, for both benchmark items and result records.
+    """
+    audio_path = record.get('Audio Path', record.get('Audio path'))
+    return (audio_path, record.get('Text prompt'))
+
+
+def read_log(log_path):
+    """
+    Reads all complete records from a JSONL log. A truncated last line (e.g. from a killed job) is ignored.
+    """
+    records = []
+    if not os.path.exists(log_path):
+        return records
+
+    with open(log_path, 'r') as f:
+        for line_no, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                print(f"Warning: Ignoring incomplete record on line {line_no} of {log_path}.")
+    return records
+
+
+def load_completed(log_path):
+    """
+    Returns the set of (audio path, text prompt) pairs that already have a result in the log.
+    """
+    return {result_key(record) for record in read_log(log_path)}
+
+
+def consolidate(log_path, output_json_path, key_order=None):
+    """
+    Rewrites the JSONL log as a single indented JSON list, i.e. the layout the scripts used to write after every item.
+    Records are written in log order, or sorted by the position of their key in `key_order` if given (batched runs
+    finish items out of order).
+    """
+    return merge_logs([log_path], output_json_path, key_order=key_order)
+
+
+def merge_logs(log_paths, output_json_path, key_order=None):
+    """
+    Merges several JSONL logs (e.g. one per shard) into a single indented JSON list, sorted by `key_order` if given.
+    """
+    records = []
+    for log_path in log_paths:
+        records.extend(read_log(log_path))
+    if key_order is not None:
+        position = {}
+        for idx, key in enumerate(key_order):
+            position.setdefault(key, idx)
+        records.sort(key=lambda record: position.get(result_key(record), len(position)))
+    tmp_path = output_json_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(records, f, indent=4)
+    os.replace(tmp_path, output_json_path)
+    return len(records)
+
+
+class ResultLog:
+    """
+    Append-only JSONL sink. Each record is flushed to the OS as soon as it is written, and fsync'ed to disk every
+    `fsync_every` records or `fsync_interval` seconds, whichever comes first.
+    """
+
+    def __init__(self, log_path, resume=False, fsync_every=10, fsync_interval=30.0):
+        self.log_path = log_path
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+
+        log_dir = os.path.dirname(log_path)
+        if log_dir:
+            os.makedirs(log_dir, exist_ok=True)
+
+        if resume:
+            self._drop_partial_tail()
+        self._file = open(log_path, 'a' if resume else 'w')
+        self._pending = 0
+        self._last_sync = time.monotonic()
+
+    def _drop_partial_tail(self):
+        # A job killed mid-write can leave a line without its newline; cut it so new records start on a fresh line.
+        if not os.path.exists(self.log_path):
+            return
+        with open(self.log_path, 'rb+') as f:
+            data = f.read()
+            if data and not data.endswith(b'\n'):
+                f.truncate(data.rfind(b'\n') + 1)
+
+    def append(self, record):
+        self._file.write(json.dumps(record) + '\n')
+        self._file.flush()
+        self._pending += 1
+        if self._pending >= self.fsync_every or time.monotonic() - self._last_sync >= self.fsync_interval:
+            self.sync()
+
+    def sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._pending = 0
+        self._last_sync = time.monotonic()
+
+    def close(self):
+        if self._file.closed:
+            return
+        self.sync()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
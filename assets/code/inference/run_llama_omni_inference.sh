@@ -40,40 +40,25 @@ fi
 
 # Parse config variables
 input_json=$(jq -r '.input_json' "$CONFIG_FILE")
-question_file=$(jq -r '.question_file' "$CONFIG_FILE")
 answer_file=$(jq -r '.answer_file' "$CONFIG_FILE")
 temperature=$(jq -r '.temperature' "$CONFIG_FILE")
 lora_adapter_path=$(jq -r '.lora_adapter_path' "$CONFIG_FILE")
+# Token cap per answer; MCQA-only runs can set this much lower than the long-form default.
+max_new_tokens=$(jq -r '.max_new_tokens // 2048' "$CONFIG_FILE")
 
 # Create logs directory if it doesn't exist
 mkdir -p logs
 
+# Llama-Omni runs in-process through the same backend interface as Qwen2 (see model_backends.py), so the benchmark
+# JSON is read directly and the LoRA checkpoint is applied on load; no question file or swift infer is needed.
+echo "Running Llama-Omni inference with config $CONFIG_FILE..."
 
-# Convert JSON for Llama-Omni
-echo "Converting JSON for Llama-Omni..."
-python convert_for_llama_omni.py --input_json "$input_json" --output_json "$question_file"
-# cd /proj/evaluating_afms/users/x_shrbo/ICASSP-NeurIPS_2025_submission/models/llama_omni/LLaMA-Omni
-if [ "$lora_adapter_path" == "null" ]; then
-  swift infer \
-    --model_type llama3_1-8b-omni \
-    --do_sample True \
-    --model_id_or_path ICTNLP/Llama-3.1-8B-Omni \
-    --val_dataset $question_file \
-    --result_dir $(dirname $answer_file) \
-    --temperature $temperature \
-    --max_new_tokens 2048
-  echo "Llama-Omni inference completed successfully at $(date)!"
-  exit 0
-fi
-
-swift infer \
-    --model_type llama3_1-8b-omni \
-    --do_sample True \
-    --model_id_or_path ICTNLP/Llama-3.1-8B-Omni \
-    --ckpt_dir $lora_adapter_path \
-    --val_dataset $question_file \
-    --result_dir $(dirname $answer_file) \
-    --temperature $temperature \
-    --max_new_tokens 2048 \
+python run_SAGE_inference.py \
+    --model llama-omni \
+    --input_json "$input_json" \
+    --output_json "$answer_file" \
+    --qwen_temperature "$temperature" \
+    --lora_adapter_path "$lora_adapter_path" \
+    --max_new_tokens "$max_new_tokens"
 
-echo "Llama-Omni inference completed successfully at $(date)!"
\ No newline at end of file
+echo "Llama-Omni inference completed successfully at $(date)!"
@@ -53,6 +53,13 @@ input_json=$(jq -r '.input_json' "$CONFIG_FILE")
 output_json=$(jq -r '.output_json' "$CONFIG_FILE")
 qwen_temperature=$(jq -r '.qwen_temperature' "$CONFIG_FILE")
 lora_adapter_path=$(jq -r '.lora_adapter_path' "$CONFIG_FILE")
+# Optional list of LoRA checkpoints or glob patterns to sweep with one base model load
+mapfile -t lora_adapter_paths < <(jq -r '.lora_adapter_paths // [] | .[]' "$CONFIG_FILE")
+
+sweep_args=()
+if [ ${#lora_adapter_paths[@]} -gt 0 ]; then
+  sweep_args=(--lora_adapter_paths "${lora_adapter_paths[@]}")
+fi
 
 # Run inference with qwen2
 echo "Running Qwen2 inference with config $CONFIG_FILE..."
@@ -62,6 +69,7 @@ python run_SAGE_inference.py \
     --input_json "$input_json" \
     --output_json "$output_json" \
     --qwen_temperature "$qwen_temperature" \
-    --lora_adapter_path "$lora_adapter_path"
+    --lora_adapter_path "$lora_adapter_path" \
+    "${sweep_args[@]}"
 
 echo "Qwen2 inference completed successfully at $(date)!"
\ No newline at end of file
@@ -6,100 +6,350 @@ and outputs the results in a specified format. I also assume that the code is ru
 
 import json
 import argparse
-import torch
-from transformers import AutoProcessor, Qwen2AudioForConditionalGeneration
-import librosa
-import pandas as pd
 import os
+import sys
+from collections import Counter
+from audio_store import AudioStore
+from batching import audio_duration, estimate_num_tokens, make_length_buckets
+from decode_policy import item_decode_policy, load_decode_policies
+from model_backends import BACKENDS, DEVICES, QUANT_MODES, SCORE_NORMALISATIONS, get_backend, set_cpu_threads
+from preflight import load_items, run_preflight
+from prefetch import prefetch_batches
+from profiling import InferenceProfiler
+from result_log import (ResultLog, consolidate, default_log_path, load_completed, result_key, skip_report_path,
+                        write_skip_report)
+from sharding import item_seed, shard_assignment, shard_output_path, write_run_manifest
 
-def run_qwen2_inference(model, processor, audio_path, prompt, temperature=0.7):
+def get_options(item):
     """
-    Runs inference using the Qwen2-Audio-7B-Instruct model.
+    Returns the answer options of an item under the result field names.
     """
-    conversation = [
-        {"role": "user", "content": [
-            {"type": "audio", "audio": audio_path},
-            {"type": "text", "text": prompt}
-        ]}
-    ]
-    
-    text = processor.apply_chat_template(conversation, add_generation_prompt=True, tokenize=False)
-    audio_data, sample_rate = librosa.load(audio_path, sr=processor.feature_extractor.sampling_rate)
-    
-    inputs = processor(
-        text=text, 
-        audio=[audio_data], 
-        return_tensors="pt",
-        padding=True
-    ).to(model.device)
-
-    generate_ids = model.generate(**inputs, max_new_tokens=512, do_sample=True, temperature=temperature)
-    
-    output_ids = generate_ids[:, inputs['input_ids'].shape[1]:]
-    response = processor.batch_decode(output_ids, skip_special_tokens=True, clean_up_tokenization_spaces=False)[0]
-    return response
-
-def run_inference(model_name, input_json_path, output_json_path, qwen_temperature=0.7):
+    return {
+        'Stereotypical option': item['Stereotypical option'],
+        'Anti-stereo option': item['Anti-Stereo option'],
+        'irrelevant option': item['Irrelevant option']
+    }
+
+def run_inference(model_name, input_json_path, output_json_path, qwen_temperature=0.7, log_path=None, resume=False,
+                  consolidate_output=True, fsync_every=10, batch_size=1, max_tokens_per_batch=None, mode='generate',
+                  score_normalisation='mean', audio_store_dir=None, feature_cache_dir=None, feature_cache_size_gb=10.0,
+                  cache_audio_embeddings=False,
+                  num_shards=1, shard_id=0, balance_shards=False, seed=None, prefetch_depth=2, prefetch_workers=1,
+                  num_samples=1, max_new_tokens=512, decode_policies=None, metrics_path=None, profile_capture=None,
+                  profile_start=0, profile_items=10, tiny_random_model=False, device='auto', quant='none',
+                  quantize_audio_encoder=False, num_threads=None, num_interop_threads=None):
     """
     Runs inference on the Spoken StereoSet benchmark with the specified model.
     """
+    # torch and transformers are only imported once a model is needed, so --help and --dry_run return at once.
+    from transformers import set_seed
+
     with open(input_json_path, 'r') as f:
         benchmark_data = json.load(f)
 
-    results = []
+    # --- Select this worker's shard; the launcher merges the shard logs back into input order ---
+    if num_shards > 1:
+        assignment = shard_assignment(benchmark_data, num_shards, balance_by_duration=balance_shards)
+        benchmark_data = [item for item, shard in zip(benchmark_data, assignment) if shard == shard_id]
+        merged_output_path = output_json_path
+        output_json_path = shard_output_path(output_json_path, shard_id, num_shards)
+        if log_path is not None:
+            log_path = shard_output_path(log_path, shard_id, num_shards)
+        print(f"Shard {shard_id} of {num_shards}: {len(benchmark_data)} items.")
+
+    # Results are streamed to an append-only JSONL log instead of re-writing the whole JSON after every item.
+    if log_path is None:
+        log_path = default_log_path(output_json_path)
+
+    # The launcher merges exactly the shard log listed here, not whatever earlier runs left next to the output.
+    if num_shards > 1:
+        write_run_manifest(merged_output_path, shard_id, num_shards, [
+            {'output': merged_output_path, 'log': log_path, 'skip_report': skip_report_path(output_json_path)}
+        ])
+    completed = load_completed(log_path) if resume else set()
+    if completed:
+        print(f"Resuming from {log_path}: {len(completed)} items already done.")
 
-    if model_name == 'qwen2':
-        model_id = 'Qwen/Qwen2-Audio-7B-Instruct'
-        processor = AutoProcessor.from_pretrained(model_id, trust_remote_code=True)
-        model = Qwen2AudioForConditionalGeneration.from_pretrained(
-            model_id,
-            device_map="auto",
-            torch_dtype=torch.bfloat16
+    if num_threads is not None or num_interop_threads is not None:
+        set_cpu_threads(num_threads, num_interop_threads)
+    profiler = InferenceProfiler(metrics_path, capture=profile_capture, capture_start=profile_start,
+                                 capture_items=profile_items)
+    profiler.begin_run(output_json_path)
+    with profiler.measure('model_load'):
+        backend = get_backend(model_name)
+        if tiny_random_model:
+            backend.load_tiny()
+        else:
+            backend.load(device=device)
+        backend.quantize(quant, audio_encoder=quantize_audio_encoder)
+
+    # Pre-resampled audio is read from the packed store if given; missing or stale entries fall back to librosa.
+    audio_store = AudioStore(audio_store_dir) if audio_store_dir is not None else None
+
+    # Audio features (and optionally audio-tower embeddings) are reused across runs and adapters if a cache is given.
+    feature_cache = None
+    if feature_cache_dir is not None and not backend.supports_feature_cache:
+        print(f"Warning: The feature cache does not support {model_name}; featurising every item.")
+    elif feature_cache_dir is not None:
+        from feature_cache import FeatureCache
+        feature_cache = FeatureCache(
+            feature_cache_dir, backend.model, backend.processor,
+            max_size_bytes=int(feature_cache_size_gb * 1024 ** 3),
+            cache_embeddings=cache_audio_embeddings
         )
-        model.eval()
 
     # --- 3. Run Inference on each item ---
+    pending = []
+    skipped = []
     for item in benchmark_data:
         audio_path = item['Audio Path']
-        prompt = item['Text prompt']
+
+        if result_key(item) in completed:
+            continue
 
         if not os.path.exists(audio_path):
-            print(f"Warning: Audio file not found at {audio_path}. Skipping.")
+            skipped.append({'Audio Path': audio_path, 'Text prompt': item['Text prompt'], 'Reason': 'audio file not found'})
+            continue
+
+        if mode == 'score' and not any(get_options(item).values()):
+            skipped.append({'Audio Path': audio_path, 'Text prompt': item['Text prompt'], 'Reason': 'no answer options to score'})
+            continue
+
+        pending.append(item)
+
+    # Items of similar length are batched together to keep padding low; results are mapped back per item.
+    if mode == 'generate' and batch_size > 1:
+        lengths = [
+            estimate_num_tokens(audio_duration(item['Audio Path']), backend.count_prompt_tokens(item['Text prompt']))
+            for item in pending
+        ]
+        # Every item is decoded num_samples times, so the token budget per batch shrinks accordingly.
+        if max_tokens_per_batch is not None:
+            max_tokens_per_batch = max_tokens_per_batch // num_samples
+        batches = make_length_buckets(lengths, batch_size=batch_size, max_tokens_per_batch=max_tokens_per_batch)
+    else:
+        batches = [[idx] for idx in range(len(pending))]
+
+    # The next batches are loaded and featurised in the background while the current one generates.
+    def featurise(batch):
+        with profiler.track(batch):
+            return backend.featurise(
+                [pending[idx]['Audio Path'] for idx in batch],
+                [pending[idx]['Text prompt'] for idx in batch],
+                audio_store=audio_store,
+                feature_cache=feature_cache
+            )
+
+    result_log = ResultLog(log_path, resume=resume, fsync_every=fsync_every)
+    decode_stats = Counter()
+    generated_tokens = 0
+    for batch, inputs, error in prefetch_batches(featurise, batches, prefetch_depth=prefetch_depth,
+                                                 num_workers=prefetch_workers, discard=profiler.discard):
+        batch_items = [pending[idx] for idx in batch]
+
+        if error is not None:
+            profiler.discard(batch)
+            for item in batch_items:
+                skipped.append({'Audio Path': item['Audio Path'], 'Text prompt': item['Text prompt'], 'Reason': repr(error)})
             continue
 
-        model_answer = ""
-        if model_name == 'qwen2':
-            model_answer = run_qwen2_inference(model, processor, audio_path, prompt, temperature=qwen_temperature)
+        # Seeding per item (rather than once per run) makes sharded and serial runs sample the same answers.
+        # With batch size 1 this is the item's own seed; a batch is seeded from its first item, which is why sharded
+        # runs reject --seed with --batch_size > 1 (shards batch different items together than a serial run).
+        batch_seed = None
+        if seed is not None:
+            batch_seed = item_seed(seed, batch_items[0])
+            set_seed(batch_seed)
+
+        profiler.start_batch(batch)
+        model_answers = [""] * len(batch_items)
+        extra_fields = [{} for _ in batch_items]
+        if mode == 'score':
+            # Score mode always runs one item per batch.
+            with profiler.track(batch):
+                model_answers[0], extra_fields[0] = backend.choose_option(
+                    inputs, get_options(batch_items[0]), normalisation=score_normalisation
+                )
+        else:
+            row_policies, row_options = None, None
+            if decode_policies is not None:
+                row_policies = [item_decode_policy(item, decode_policies) for item in batch_items]
+                row_options = [[text for text in get_options(item).values() if text] for item in batch_items]
+            with profiler.track(batch):
+                responses, stats = backend.generate_batch(
+                    inputs, temperature=qwen_temperature, max_new_tokens=max_new_tokens,
+                    num_samples=num_samples, decode_policies=row_policies, row_options=row_options
+                )
+            for idx in range(len(batch_items)):
+                item_samples = responses[idx * num_samples:(idx + 1) * num_samples]
+                item_stats = stats[idx * num_samples:(idx + 1) * num_samples]
+                model_answers[idx] = item_samples[0]
+                if num_samples > 1:
+                    extra_fields[idx] = {
+                        'Model Answers': item_samples,
+                        'Generated tokens': [stat['tokens'] for stat in item_stats],
+                        'Stop reason': [stat['reason'] for stat in item_stats]
+                    }
+                else:
+                    extra_fields[idx] = {'Generated tokens': item_stats[0]['tokens'], 'Stop reason': item_stats[0]['reason']}
+                decode_stats.update(stat['reason'] for stat in item_stats)
+                generated_tokens += sum(stat['tokens'] for stat in item_stats)
+        profiler.finish_batch(batch, [item['Audio Path'] for item in batch_items])
+
+        if batch_seed is not None:
+            for extra in extra_fields:
+                extra['Seed'] = batch_seed
+
+        for item, model_answer, extra in zip(batch_items, model_answers, extra_fields):
+            result_log.append({
+                'Audio path': item['Audio Path'],
+                'Text prompt': item['Text prompt'],
+                'Model Answer': model_answer,
+                **get_options(item),
+                **extra
+            })
+
+    result_log.close()
+
+    if skipped:
+        write_skip_report(output_json_path, skipped)
+        print(f"Skipped {len(skipped)} items; see {skip_report_path(output_json_path)}")
+    elif os.path.exists(skip_report_path(output_json_path)):
+        # A report left by an earlier run would otherwise be merged as if it belonged to this one.
+        os.remove(skip_report_path(output_json_path))
 
-        results.append({
-            'Audio path': audio_path,
-            'Text prompt': prompt,
-            'Model Answer': model_answer,
-            'Stereotypical option': item['Stereotypical option'],
-            'Anti-stereo option': item['Anti-Stereo option'],
-            'irrelevant option': item['Irrelevant option']
-        })
+    if decode_stats:
+        reasons = ', '.join(f"{reason}: {count}" for reason, count in sorted(decode_stats.items()))
+        print(f"Generated {generated_tokens} tokens; stop reasons: {reasons}")
 
-        # Save intermediate results
-        with open(output_json_path, 'w') as f:
-            json.dump(results, f, indent=4)
+    if feature_cache is not None:
+        print(f"Feature cache: {feature_cache.hits} hits, {feature_cache.misses} misses.")
 
-    print(f"Inference complete. Results saved to {output_json_path}")
+    profiler.close()
+
+    if consolidate_output:
+        num_results = consolidate(log_path, output_json_path, key_order=[result_key(item) for item in benchmark_data])
+        print(f"Inference complete. {num_results} results saved to {output_json_path}")
+    else:
+        print(f"Inference complete. Results logged to {log_path}")
+
+
+def dry_run(input_json_path, output_json_path, audio_store_dir=None, num_shards=1, estimate_from=None):
+    """
+    Checks the inputs of a run without loading a model (--dry_run) and returns True if nothing is wrong.
+    """
+    benchmark_data = load_items(input_json_path)
+    if benchmark_data is None:
+        return False
+    required_keys = ['Audio Path', 'Text prompt', 'Stereotypical option', 'Anti-Stereo option', 'Irrelevant option']
+    paths = {'Output directory': os.path.dirname(output_json_path) or '.', 'Audio store': audio_store_dir}
+    return run_preflight(benchmark_data, required_keys, paths=paths, estimate_path=estimate_from,
+                         stage='inference_stereoset', num_shards=num_shards)
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="Run inference on the Spoken StereoSet benchmark.")
-    parser.add_argument('--model', type=str, required=True, choices=['qwen2', 'llama-omni', 'ltu-as'],
-                        help="The model to run inference with.")
+    parser.add_argument('--model', type=str, required=True, choices=sorted(BACKENDS),
+                        help="The model to run inference with (see model_backends.py).")
     parser.add_argument('--input_json', type=str, default='spoken_stereoset_test.json',
                         help="Path to the input JSON file for the benchmark.")
     parser.add_argument('--output_json', type=str, default='spoken_stereoset_results.json',
                         help="Path to save the output JSON file with results.")
     parser.add_argument('--qwen_temperature', type=float, default=0.7,
-                        help="Temperature for sampling in the Qwen2 model. Default is 0.7.")
+                        help="Sampling temperature (the name predates the other backends); 0 decodes greedily. Default is 0.7.")
+    parser.add_argument('--log_path', type=str, default=None,
+                        help="Path to the append-only JSONL result log. Defaults to the output JSON path with a .jsonl suffix.")
+    parser.add_argument('--resume', action='store_true',
+                        help="Resume from an existing result log, skipping (Audio Path, Text prompt) pairs already done.")
+    parser.add_argument('--consolidate', action=argparse.BooleanOptionalAction, default=True,
+                        help="Consolidate the JSONL log into the output JSON file at the end of the run.")
+    parser.add_argument('--fsync_every', type=int, default=10,
+                        help="Number of results between fsyncs of the result log. Default is 10.")
+    parser.add_argument('--batch_size', type=int, default=1,
+                        help="Maximum number of items per generation batch. Default is 1.")
+    parser.add_argument('--max_tokens_per_batch', type=int, default=None,
+                        help="Maximum padded input tokens per batch (items times longest item). Default is no limit.")
+    parser.add_argument('--mode', type=str, default='generate', choices=['generate', 'score'],
+                        help="'generate' samples a free-text answer; 'score' picks the option with the highest log-likelihood.")
+    parser.add_argument('--score_normalisation', type=str, default='mean', choices=SCORE_NORMALISATIONS,
+                        help="With --mode score, rank options by the mean log-prob per token ('mean') or the summed log-prob ('sum'), which favours short options. Default is mean.")
+    parser.add_argument('--audio_store', type=str, default=None,
+                        help="Directory of a packed audio store (see audio_store.py). Default is to decode every file with librosa.")
+    parser.add_argument('--feature_cache_dir', type=str, default=None,
+                        help="Directory of the on-disk audio feature cache. Default is no caching.")
+    parser.add_argument('--feature_cache_size_gb', type=float, default=10.0,
+                        help="Size cap of the feature cache in GB; least recently used entries are evicted. Default is 10.")
+    parser.add_argument('--cache_audio_embeddings', action='store_true',
+                        help="Also cache audio-tower embeddings, so generation skips the audio encoder on cache hits.")
+    parser.add_argument('--num_shards', type=int, default=1,
+                        help="Number of data-parallel shards the benchmark is split into. Default is 1.")
+    parser.add_argument('--shard_id', type=int, default=0,
+                        help="Shard processed by this worker, in [0, num_shards). Default is 0.")
+    parser.add_argument('--balance_shards', action='store_true',
+                        help="Balance shards by total audio duration instead of dealing items round-robin.")
+    parser.add_argument('--seed', type=int, default=None,
+                        help="Base seed for per-item sampling seeds, so sharded and serial runs match. Default is unseeded.")
+    parser.add_argument('--prefetch_depth', type=int, default=2,
+                        help="Number of batches loaded and featurised ahead of generation; 0 disables prefetching. Default is 2.")
+    parser.add_argument('--prefetch_workers', type=int, default=1,
+                        help="Number of threads loading and featurising batches ahead of generation. Default is 1.")
+    parser.add_argument('--num_samples', type=int, default=1,
+                        help="Number of sampled answers per item, sharing one prefill; all are stored under 'Model Answers'. Default is 1.")
+    parser.add_argument('--max_new_tokens', type=int, default=512,
+                        help="Maximum number of generated tokens per answer with the fixed decode policy. Default is 512.")
+    parser.add_argument('--decode_policy', type=str, default='fixed', choices=['fixed', 'task'],
+                        help="'fixed' decodes every item up to --max_new_tokens; 'task' uses per-task budgets with early stopping (see decode_policy.py).")
+    parser.add_argument('--decode_config', type=str, default=None,
+                        help="JSON file with per-task decode policy overrides, used with --decode_policy task.")
+    parser.add_argument('--metrics_path', type=str, default=None,
+                        help="JSONL file for per-batch stage timings and memory (see profiling.py). Default is no profiling.")
+    parser.add_argument('--profile_capture', type=str, default='none', choices=['none', 'torch', 'cprofile'],
+                        help="Capture a torch.profiler trace or cProfile stats of a window of items; needs --metrics_path.")
+    parser.add_argument('--profile_start', type=int, default=0,
+                        help="Number of items to run before the capture window opens. Default is 0.")
+    parser.add_argument('--profile_items', type=int, default=10,
+                        help="Number of items in the capture window. Default is 10.")
+    parser.add_argument('--tiny_random_model', action='store_true',
+                        help="Run a tiny randomly initialised model on CPU instead of the pretrained one, for benchmarks and smoke tests.")
+    parser.add_argument('--device', type=str, default='auto', choices=DEVICES,
+                        help="'auto' places bf16 weights with device_map=\"auto\"; 'cpu' keeps float32 weights on CPU. Default is auto.")
+    parser.add_argument('--quant', type=str, default='none', choices=QUANT_MODES,
+                        help="Dynamic int8 quantisation of the language model's linear layers (CPU only). Default is none.")
+    parser.add_argument('--quantize_audio_encoder', action='store_true',
+                        help="With --quant int8, also quantise the linear layers of the audio encoder.")
+    parser.add_argument('--num_threads', type=int, default=None,
+                        help="Intra-op CPU threads of torch. Default is torch's default (the number of physical cores).")
+    parser.add_argument('--num_interop_threads', type=int, default=None,
+                        help="Inter-op CPU threads of torch. Default is torch's default.")
+    parser.add_argument('--dry_run', '--dry-run', action='store_true',
+                        help="Only check the input items, audio files and paths, estimate the runtime and exit without loading a model.")
+    parser.add_argument('--estimate_from', type=str, default=None,
+                        help="With --dry_run, a benchmark_pipeline.py results JSON or a --metrics_path file to estimate the runtime from.")
 
-    
     args = parser.parse_args()
 
-    run_inference(args.model, args.input_json, args.output_json, args.qwen_temperature)
+    if args.seed is not None and args.batch_size > 1 and args.num_shards > 1 and args.mode == 'generate':
+        parser.error("--seed cannot make a sharded run match a serial one with --batch_size > 1, since a batch is "
+                     "seeded from its first item and shards batch different items; use --batch_size 1.")
+
+    if args.dry_run:
+        sys.exit(0 if dry_run(args.input_json, args.output_json, audio_store_dir=args.audio_store,
+                              num_shards=args.num_shards, estimate_from=args.estimate_from) else 1)
+
+    run_inference(args.model, args.input_json, args.output_json, args.qwen_temperature, log_path=args.log_path,
+                  resume=args.resume, consolidate_output=args.consolidate, fsync_every=args.fsync_every, batch_size=args.batch_size,
+                  max_tokens_per_batch=args.max_tokens_per_batch, mode=args.mode,
+                  score_normalisation=args.score_normalisation,
+                  audio_store_dir=args.audio_store,
+                  feature_cache_dir=args.feature_cache_dir, feature_cache_size_gb=args.feature_cache_size_gb,
+                  cache_audio_embeddings=args.cache_audio_embeddings,
+                  num_shards=args.num_shards, shard_id=args.shard_id, balance_shards=args.balance_shards,
+                  seed=args.seed, prefetch_depth=args.prefetch_depth, prefetch_workers=args.prefetch_workers,
+                  num_samples=args.num_samples, max_new_tokens=args.max_new_tokens,
+                  decode_policies=load_decode_policies(args.decode_config) if args.decode_policy == 'task' else None,
+                  metrics_path=args.metrics_path, profile_capture=args.profile_capture,
+                  profile_start=args.profile_start, profile_items=args.profile_items,
+                  tiny_random_model=args.tiny_random_model, device=args.device, quant=args.quant,
+                  quantize_audio_encoder=args.quantize_audio_encoder, num_threads=args.num_threads,
+                  num_interop_threads=args.num_interop_threads)
 
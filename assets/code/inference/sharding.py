@@ -0,0 +1,79 @@
+'''
+Helpers for data-parallel sharded inference. Every worker computes the same item-to-shard assignment from the full
+benchmark, writes its results to its own shard log, and the launcher merges the shard logs back into input order.
+Every worker also writes a run manifest listing the logs of this run, so the launcher merges exactly those and never
+picks up logs left over from earlier runs. Per-item seeds make a sharded run sample the same answers as a serial run.
+
+'''
+
+import hashlib
+import heapq
+import json
+import os
+
+from batching import audio_duration
+
+
+def item_seed(seed, item):
+    """
+    Returns a reproducible seed for an item, derived from the run seed and the item's audio path and prompt, so that
+    the item gets the same seed whichever shard or batch position it ends up in.
+    """
+    key = f"{seed}|{item['Audio Path']}|{item['Text prompt']}"
+    return int.from_bytes(hashlib.sha256(key.encode()).digest()[:4], 'little') & 0x7fffffff
+
+
+def shard_assignment(benchmark_data, num_shards, balance_by_duration=False):
+    """
+    Returns the shard id of every item. Items are dealt round-robin, or, with `balance_by_duration`, longest first to
+    the shard with the least total audio so far. Missing audio files count as zero duration.
+    """
+    if not balance_by_duration:
+        return [idx % num_shards for idx in range(len(benchmark_data))]
+
+    durations = [
+        audio_duration(item['Audio Path']) if os.path.exists(item['Audio Path']) else 0.0
+        for item in benchmark_data
+    ]
+    assignment = [0] * len(benchmark_data)
+    shard_loads = [(0.0, shard_id) for shard_id in range(num_shards)]
+    for idx in sorted(range(len(benchmark_data)), key=lambda i: (-durations[i], i)):
+        load, shard_id = heapq.heappop(shard_loads)
+        assignment[idx] = shard_id
+        heapq.heappush(shard_loads, (load + durations[idx], shard_id))
+    return assignment
+
+
+def shard_output_path(output_json_path, shard_id, num_shards):
+    """
+    Returns the output path of one shard, e.g. results.shard0-of-4.json.
+    """
+    root, ext = os.path.splitext(output_json_path)
+    return f"{root}.shard{shard_id}-of-{num_shards}{ext or '.json'}"
+
+
+def run_manifest_path(output_json_path, shard_id, num_shards):
+    """
+    Returns the path of a shard's run manifest, e.g. results.shard0-of-4.runs.json.
+    """
+    return os.path.splitext(shard_output_path(output_json_path, shard_id, num_shards))[0] + '.runs.json'
+
+
+def write_run_manifest(output_json_path, shard_id, num_shards, runs):
+    """
+    Writes the runs of a shard (one per adapter in a sweep): for every merged output path, the shard's result log and
+    skip report.
+    """
+    with open(run_manifest_path(output_json_path, shard_id, num_shards), 'w') as f:
+        json.dump(runs, f, indent=4)
+
+
+def read_run_manifest(output_json_path, shard_id, num_shards):
+    """
+    Returns the runs written by `write_run_manifest`, or None if the shard wrote no manifest.
+    """
+    manifest_path = run_manifest_path(output_json_path, shard_id, num_shards)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, 'r') as f:
+        return json.load(f)
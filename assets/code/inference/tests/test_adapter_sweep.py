@@ -0,0 +1,51 @@
+import json
+
+import run_SAGE_inference
+from run_SAGE_inference import adapter_tag, dry_run, expand_adapter_paths, sweep_output_path
+
+
+def make_checkpoints(root, steps):
+    run_dir = root / 'qwen_lora8_anti_FT' / 'v0-20250730-203341'
+    for step in steps:
+        (run_dir / f'checkpoint-{step}').mkdir(parents=True)
+    return run_dir
+
+
+def test_adapter_tag_names_the_run_and_the_checkpoint():
+    path = '/scratch/output/qwen_lora8_anti_FT/v0-20250730-203341/checkpoint-350/'
+    assert adapter_tag(path) == 'qwen_lora8_anti_FT_v0-20250730-203341_checkpoint-350'
+    assert adapter_tag('runs/my run.v2/checkpoint-1') == 'runs_my_run_v2_checkpoint-1'
+
+
+def test_expand_adapter_paths_sorts_checkpoints_by_step(tmp_path):
+    run_dir = make_checkpoints(tmp_path, [50, 100, 350, 1000])
+    expanded = expand_adapter_paths([str(run_dir / 'checkpoint-*')])
+    assert [path.rsplit('-', 1)[1] for path in expanded] == ['50', '100', '350', '1000']
+
+
+def test_expand_adapter_paths_keeps_unmatched_paths_and_drops_duplicates(tmp_path):
+    run_dir = make_checkpoints(tmp_path, [50, 100])
+    first = str(run_dir / 'checkpoint-100')
+    expanded = expand_adapter_paths([first, str(run_dir / 'checkpoint-*'), 'hub/adapter'])
+    assert expanded == [first, str(run_dir / 'checkpoint-50'), 'hub/adapter']
+
+
+def test_sweep_output_path():
+    assert sweep_output_path('results/sage.json', 'base') == 'results/sage_base.json'
+    assert sweep_output_path('results/sage', 'run_checkpoint-50') == 'results/sage_run_checkpoint-50.json'
+
+
+def test_dry_run_checks_every_adapter_of_the_sweep(tmp_path, monkeypatch):
+    run_dir = make_checkpoints(tmp_path, [50, 100])
+    input_path = tmp_path / 'sage.json'
+    input_path.write_text(json.dumps([{'Audio Path': 'a.wav', 'Text prompt': 'Who is speaking?'}]))
+
+    calls = []
+    monkeypatch.setattr(run_SAGE_inference, 'run_preflight', lambda *args, **kwargs: calls.append(kwargs) or True)
+    assert dry_run(str(input_path), str(tmp_path / 'out.json'), lora_adapter_paths=[str(run_dir / 'checkpoint-*')])
+    assert dry_run(str(input_path), str(tmp_path / 'out.json'), lora_adapter_paths=[str(run_dir / 'checkpoint-*')],
+                   skip_base=True)
+
+    tags = [adapter_tag(str(run_dir / f'checkpoint-{step}')) for step in (50, 100)]
+    assert [name for name in calls[0]['paths'] if name.startswith('LoRA')] == [f'LoRA checkpoint {tag}' for tag in tags]
+    assert [call['num_runs'] for call in calls] == [3, 2]
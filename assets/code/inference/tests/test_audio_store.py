@@ -0,0 +1,61 @@
+import os
+
+import numpy as np
+import pytest
+
+import audio_store
+from audio_store import AudioStore, compact_audio, pack_audio, unused_bytes
+
+
+@pytest.fixture(autouse=True)
+def fake_decode(monkeypatch):
+    # Each test file holds its length and value as text, so the store can be tested without librosa.
+    def decode(audio_path, sample_rate):
+        with open(audio_path, 'r') as f:
+            length, value = f.read().split()
+        return np.full(int(length), float(value), dtype=np.float32)
+    monkeypatch.setattr(audio_store, '_decode', decode)
+
+
+def write_audio(path, length, value, mtime):
+    with open(path, 'w') as f:
+        f.write(f"{length} {value}")
+    os.utime(path, (mtime, mtime))
+    return str(path)
+
+
+def test_empty_store_opens(tmp_path):
+    assert pack_audio([str(tmp_path / 'missing.wav')], str(tmp_path / 'store')) == 0
+    store = AudioStore(str(tmp_path / 'store'))
+    assert store.entries == {}
+
+
+def test_pack_and_load(tmp_path):
+    first = write_audio(tmp_path / 'a.wav', 100, 0.25, 1000)
+    second = write_audio(tmp_path / 'b.wav', 50, -0.5, 1000)
+    assert pack_audio([first, second, first], str(tmp_path / 'store')) == 2
+    assert pack_audio([first, second], str(tmp_path / 'store')) == 0
+
+    store = AudioStore(str(tmp_path / 'store'))
+    np.testing.assert_allclose(store.load(first, 16000), np.full(100, 0.25))
+    np.testing.assert_allclose(store.load(second, 16000), np.full(50, -0.5))
+    assert store.get(first, 8000) is None
+
+
+def test_compact_reclaims_replaced_audio(tmp_path):
+    store_dir = str(tmp_path / 'store')
+    first = write_audio(tmp_path / 'a.wav', 100, 0.25, 1000)
+    second = write_audio(tmp_path / 'b.wav', 50, -0.5, 1000)
+    pack_audio([first, second], store_dir)
+    assert unused_bytes(store_dir) == 0
+
+    write_audio(tmp_path / 'a.wav', 80, 0.75, 2000)
+    assert pack_audio([first, second], store_dir) == 1
+    # float16 samples: the 100 replaced samples stay in the blob until compaction.
+    assert unused_bytes(store_dir) == 200
+
+    assert compact_audio(store_dir) == 200
+    assert unused_bytes(store_dir) == 0
+    store = AudioStore(store_dir)
+    np.testing.assert_allclose(store.load(first, 16000), np.full(80, 0.75))
+    np.testing.assert_allclose(store.load(second, 16000), np.full(50, -0.5))
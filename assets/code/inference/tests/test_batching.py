@@ -0,0 +1,38 @@
+from batching import estimate_num_tokens, make_length_buckets
+
+
+def test_buckets_cover_every_item_once():
+    lengths = [50, 10, 30, 10, 70, 20, 40]
+    batches = make_length_buckets(lengths, batch_size=3)
+    assert sorted(idx for batch in batches for idx in batch) == list(range(len(lengths)))
+    assert all(len(batch) <= 3 for batch in batches)
+
+
+def test_buckets_group_similar_lengths_in_stable_order():
+    lengths = [50, 10, 30, 10, 70, 20]
+    assert make_length_buckets(lengths, batch_size=2) == [[1, 3], [5, 2], [0, 4]]
+
+
+def test_batch_size_one_keeps_one_item_per_batch():
+    assert make_length_buckets([3, 1, 2]) == [[1], [2], [0]]
+
+
+def test_token_budget_limits_padded_size():
+    lengths = [10, 10, 10, 40, 40]
+    batches = make_length_buckets(lengths, batch_size=8, max_tokens_per_batch=80)
+    assert batches == [[0, 1, 2], [3, 4]]
+    for batch in batches:
+        assert len(batch) * max(lengths[idx] for idx in batch) <= 80
+
+
+def test_item_over_budget_gets_its_own_batch():
+    assert make_length_buckets([5, 500, 5], batch_size=4, max_tokens_per_batch=100) == [[0, 2], [1]]
+
+
+def test_empty_input():
+    assert make_length_buckets([], batch_size=4) == []
+
+
+def test_estimate_caps_audio_at_30_seconds():
+    assert estimate_num_tokens(60.0, 10) == estimate_num_tokens(30.0, 10)
+    assert estimate_num_tokens(1.0, 10) < estimate_num_tokens(2.0, 10)
@@ -0,0 +1,69 @@
+import math
+
+import pytest
+
+from check_quantisation import compare, option_probabilities, score_sample
+from model_backends import ModelBackend
+
+ITEMS = [{'Audio Path': f'prompt_{idx}.wav', 'Text prompt': f'Question {idx}', 'Stereotypical option': 'Nurse',
+          'Anti-Stereotypical option': 'Engineer', 'Neutral option': 'Banana'} for idx in range(4)]
+
+
+def result(predicted, scores, seconds=1.0):
+    names = ['Stereotypical option', 'Anti-stereotypical option', 'Neutral option']
+    return {'Predicted option': predicted, 'Option scores': dict(zip(names, scores)),
+            'Option log-probs': dict(zip(names, [score * 2 for score in scores])), 'seconds': seconds}
+
+
+def test_option_probabilities_are_a_softmax():
+    probs = option_probabilities({'A': math.log(0.2), 'B': math.log(0.6), 'C': math.log(0.2)})
+    assert probs == pytest.approx({'A': 0.2, 'B': 0.6, 'C': 0.2})
+    # Summed log-probs of long options are far below zero; the softmax must not underflow.
+    assert option_probabilities({'A': -1000.0, 'B': -1000.0}) == pytest.approx({'A': 0.5, 'B': 0.5})
+
+
+def test_compare_reports_agreement_and_disagreements():
+    even = [0.0, 0.0, 0.0]
+    reference = [result('Stereotypical option', even, 2.0)] * 3 + [result('Neutral option', even, 2.0)]
+    quantised = [result('Stereotypical option', even, 0.5)] * 4
+    report = compare(ITEMS, reference, quantised)
+
+    assert report['num_items'] == 4
+    assert report['agreement'] == 0.75
+    low, high = report['agreement_ci']
+    assert 0.0 <= low < 0.75 < high <= 1.0
+    assert (report['stereotype_rate_reference'], report['stereotype_rate_quantised']) == (0.75, 1.0)
+    assert (report['seconds_per_item_reference'], report['seconds_per_item_quantised']) == (2.0, 0.5)
+    assert report['disagreements'] == [{'Audio Path': 'prompt_3.wav', 'Text prompt': 'Question 3',
+                                        'reference': 'Neutral option', 'quantised': 'Stereotypical option'}]
+
+
+def test_compare_measures_probability_shifts_on_the_ranking_scores():
+    reference = [result('Stereotypical option', [math.log(0.5), math.log(0.25), math.log(0.25)])]
+    quantised = [result('Stereotypical option', [math.log(0.4), math.log(0.4), math.log(0.2)])]
+    report = compare(ITEMS[:1], reference, quantised)
+    assert report['max_abs_prob_diff'] == pytest.approx(0.15)
+    assert report['mean_abs_prob_diff'] == pytest.approx((0.1 + 0.15 + 0.05) / 3)
+    assert report['agreement_ci'] == [1.0, 1.0]
+
+    # Results written before the scores were recorded fall back to the summed log-probs.
+    for results in (reference, quantised):
+        del results[0]['Option scores']
+    assert compare(ITEMS[:1], reference, quantised)['max_abs_prob_diff'] != pytest.approx(0.15)
+
+
+class LengthBackend(ModelBackend):
+    # Longer option texts get lower summed log-probs, one token per character.
+    def featurise(self, audio_paths, prompts, audio_store=None, feature_cache=None):
+        return prompts
+
+    def score_options(self, inputs, options):
+        return [-float(len(option)) for option in options], [len(option) for option in options]
+
+
+def test_score_sample_records_the_choice_and_the_time():
+    results = score_sample(LengthBackend(), ITEMS[:2], normalisation='sum')
+    assert [result['Predicted option'] for result in results] == ['Stereotypical option'] * 2
+    assert results[0]['Option log-probs'] == {'Stereotypical option': -5.0, 'Anti-stereotypical option': -8.0,
+                                              'Neutral option': -6.0}
+    assert all(result['seconds'] >= 0 for result in results)
@@ -0,0 +1,112 @@
+import pytest
+
+from decode_policy import (DEFAULT_POLICIES, DecodeStoppingCriteria, item_decode_policy, item_task,
+                           load_decode_policies, names_answer, option_pattern)
+
+
+def repeats(tokens, task='long_form'):
+    policy = DEFAULT_POLICIES[task]
+    criteria = DecodeStoppingCriteria(None, 0, [policy], [[]])
+    return criteria._repeats(tokens, policy['repetition_window'], policy['repetition_count'],
+                             policy['repetition_min_span'])
+
+
+@pytest.mark.parametrize('task', ['mcqa', 'long_form'])
+def test_phrase_loop_stops(task):
+    phrase = [11, 12, 13, 14, 15]
+    assert repeats([1, 2, 3] + phrase * 3, task)
+
+
+@pytest.mark.parametrize('task', ['mcqa', 'long_form'])
+def test_long_single_token_loop_stops(task):
+    assert repeats([1, 2] + [7] * 12, task)
+
+
+@pytest.mark.parametrize('tokens', [
+    [40, 1, 0, 0, 0],           # "1000" with one token per digit
+    [40, 41, 0, 0, 0, 0, 0],    # "100000"
+    [40, 41] + [0] * 11,        # "1" followed by 11 zeros: below the minimum span
+    [50, 51, 3, 3, 3],          # "!!!"
+    [50, 51, 8, 8, 8, 8],       # "----"
+    [20, 21, 22, 21, 22, 21, 22],  # a short alternation such as "ha ha ha"
+])
+@pytest.mark.parametrize('task', ['mcqa', 'long_form'])
+def test_short_repeats_are_not_loops(tokens, task):
+    assert not repeats(tokens, task)
+
+
+def test_without_min_span_three_equal_tokens_stop():
+    criteria = DecodeStoppingCriteria(None, 0, [{}], [[]])
+    assert criteria._repeats([1, 0, 0, 0], window=16, count=3)
+
+
+def test_stopping_criteria_marks_looping_rows():
+    torch = pytest.importorskip('torch')
+    policy = dict(DEFAULT_POLICIES['long_form'])
+    criteria = DecodeStoppingCriteria(None, 2, [policy, policy], [[], []])
+    input_ids = torch.tensor([
+        [100, 101] + [5, 6, 7, 8] * 3,
+        [100, 101] + [1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0],
+    ])
+    assert criteria(input_ids, None).tolist() == [True, False]
+    criteria.record(input_ids[:, 2:], {2})
+    assert criteria.stats == [{'tokens': 12, 'reason': 'repetition'}, {'tokens': 12, 'reason': 'max_tokens'}]
+
+
+OPTIONS = option_pattern(['nurse', 'engineer', 'stock broker', 'broker'])
+
+
+@pytest.mark.parametrize('text', [
+    'nurse ',
+    'nurse.',
+    'b: engineer\n',
+    '(c) stock broker,',
+    '**engineer**',
+    'the speaker is most likely a nurse.',
+    'i would say the engineer!',
+])
+def test_anchored_answers_stop(text):
+    assert names_answer(text, OPTIONS)
+
+
+@pytest.mark.parametrize('text', [
+    'nurse',                        # the word may go on ("nurses")
+    'b:',
+    "i can't tell whether the nurse or the engineer is speaking.",
+    "i can't tell whether the nurse or the engineer",
+    "i can't tell whether the nurse ",
+    'it could be a stock broker or a nurse.',
+    'as an ai, i cannot infer a job from a voice.',
+])
+def test_hedges_and_partial_answers_do_not_stop(text):
+    assert not names_answer(text, OPTIONS)
+
+
+def test_stopping_criteria_stops_on_answers_not_on_refusals():
+    torch = pytest.importorskip('torch')
+
+    class CharTokenizer:
+        def decode(self, tokens, skip_special_tokens=True):
+            return ''.join(chr(token) for token in tokens)
+
+    refusal = "I can't tell whether the nurse or the engineer is speaking."
+    answer = "B: Engineer."
+    width = max(len(refusal), len(answer))
+    policy = {'stop_on_option': True}
+    criteria = DecodeStoppingCriteria(CharTokenizer(), 0, [policy, policy],
+                                      [['Nurse', 'Engineer'], ['Nurse', 'Engineer']])
+    input_ids = torch.tensor([[ord(char) for char in text.ljust(width)] for text in (refusal, answer)])
+    assert criteria(input_ids, None).tolist() == [False, True]
+
+
+def test_policies_and_tasks(tmp_path):
+    config_path = tmp_path / 'policies.json'
+    config_path.write_text('{"mcqa": {"max_new_tokens": 32}, "summary": {"max_new_tokens": 128}}')
+    policies = load_decode_policies(str(config_path))
+    assert policies['mcqa']['max_new_tokens'] == 32
+    assert policies['summary']['repetition_min_span'] == DEFAULT_POLICIES['long_form']['repetition_min_span']
+
+    assert item_task({'Audio Path': 'voice/prompt_3.wav'}) == 'mcqa'
+    assert item_task({'Audio Path': 'voice/prompt_17.wav'}) == 'long_form'
+    item = {'Audio Path': 'voice/prompt_17.wav', 'Max new tokens': '40'}
+    assert item_decode_policy(item, policies)['max_new_tokens'] == 40
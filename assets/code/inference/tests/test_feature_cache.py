@@ -0,0 +1,70 @@
+import os
+
+import pytest
+
+torch = pytest.importorskip('torch')
+from feature_cache import FeatureCache, num_audio_tokens
+
+
+class FakeFeatureExtractor:
+    def __init__(self, **config):
+        self.config = config
+
+    def to_dict(self):
+        return self.config
+
+
+class FakeProcessor:
+    def __init__(self, **config):
+        self.feature_extractor = FakeFeatureExtractor(**config)
+
+
+def audio_files(tmp_path, count):
+    paths = []
+    for idx in range(count):
+        path = tmp_path / f'speaker_{idx}.wav'
+        path.write_bytes(bytes([idx]) * 100)
+        paths.append(str(path))
+    return paths
+
+
+def entry(value):
+    return {'input_features': torch.full((128, 100), float(value)), 'num_frames': 100}
+
+
+def test_num_audio_tokens():
+    assert num_audio_tokens(3000) == 750
+    assert num_audio_tokens(100) == 25
+
+
+def test_get_returns_what_was_put_and_counts_hits(tmp_path):
+    cache = FeatureCache(str(tmp_path / 'cache'), None, FakeProcessor(sampling_rate=16000))
+    path, = audio_files(tmp_path, 1)
+    assert cache.get(path) is None
+    cache.put(path, entry(1))
+    assert torch.equal(cache.get(path)['input_features'], entry(1)['input_features'])
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_other_extractor_config_misses(tmp_path):
+    path, = audio_files(tmp_path, 1)
+    FeatureCache(str(tmp_path / 'cache'), None, FakeProcessor(sampling_rate=16000)).put(path, entry(1))
+    assert FeatureCache(str(tmp_path / 'cache'), None, FakeProcessor(sampling_rate=8000)).get(path) is None
+
+
+def test_least_recently_used_entry_is_evicted(tmp_path):
+    cache = FeatureCache(str(tmp_path / 'cache'), None, FakeProcessor(sampling_rate=16000))
+    first, second, third = audio_files(tmp_path, 3)
+    cache.put(first, entry(1))
+    cache.max_size_bytes = int(cache.total_size * 2.5)
+    cache.put(second, entry(2))
+    # Both entries are old; reading the first one makes the second the least recently used.
+    for path in (first, second):
+        os.utime(cache._entry_path(path), (1000, 1000))
+    assert cache.get(first) is not None
+
+    cache.put(third, entry(3))
+    assert cache.get(second) is None
+    assert cache.get(first) is not None and cache.get(third) is not None
+    assert cache.total_size <= cache.max_size_bytes
+    assert len(os.listdir(tmp_path / 'cache')) == 2
@@ -0,0 +1,168 @@
+'''
+Runs every registered backend with a tiny randomly initialised model on CPU. A backend is skipped when its own
+dependencies (transformers for qwen2; omni_speech and whisper for llama-omni) or its tokenizer files are unavailable.
+
+'''
+
+import math
+
+import pytest
+
+from model_backends import BACKENDS, ModelBackend, adapter_system_prompt, get_backend, option_scores, write_test_tone
+
+BACKEND_DEPENDENCIES = {
+    'qwen2': ['torch', 'transformers', 'librosa'],
+    'llama-omni': ['torch', 'transformers', 'librosa', 'whisper', 'omni_speech'],
+}
+OPTIONS = {'Stereotypical option': 'Nurse', 'Anti-stereotypical option': 'Engineer', 'Neutral option': 'Banana'}
+PROMPT = "Who is more likely to be a nurse? Answer with one word."
+
+
+def test_registry():
+    assert set(BACKENDS) == {'qwen2', 'llama-omni'}
+    with pytest.raises(ValueError, match='Unknown model'):
+        get_backend('gpt-2')
+
+
+@pytest.fixture(scope='module')
+def audio_path(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('audio') / 'tone.wav')
+    write_test_tone(path)
+    return path
+
+
+@pytest.fixture(scope='module', params=sorted(BACKENDS))
+def backend(request):
+    for module in BACKEND_DEPENDENCIES[request.param]:
+        pytest.importorskip(module)
+    backend = get_backend(request.param)
+    try:
+        backend.load_tiny()
+    except OSError as e:
+        pytest.skip(f"Tokenizer of {request.param} not available: {e}")
+    return backend
+
+
+def test_generate_batch_layout(backend, audio_path):
+    inputs = backend.featurise([audio_path, audio_path], [PROMPT, PROMPT + " Be brief."])
+    responses, stats = backend.generate_batch(inputs, max_new_tokens=4, num_samples=2)
+    assert len(responses) == len(stats) == 4
+    assert all(isinstance(response, str) for response in responses)
+    assert all(1 <= stat['tokens'] <= 4 for stat in stats)
+    assert {stat['reason'] for stat in stats} <= {'eos', 'max_tokens', 'option', 'repetition'}
+
+
+def test_decode_policy_caps_rows_separately(backend, audio_path):
+    inputs = backend.featurise([audio_path, audio_path], [PROMPT, PROMPT])
+    _, stats = backend.generate_batch(
+        inputs, temperature=0, decode_policies=[{'max_new_tokens': 2}, {'max_new_tokens': 5}], row_options=[[], []]
+    )
+    assert stats[0]['tokens'] <= 2 and stats[1]['tokens'] <= 5
+
+
+def test_choose_option(backend, audio_path):
+    inputs = backend.featurise([audio_path], [PROMPT])
+    answer, extra = backend.choose_option(inputs, OPTIONS)
+    log_probs = extra['Option log-probs']
+    assert set(log_probs) == set(OPTIONS)
+    assert all(math.isfinite(value) and value < 0 for value in log_probs.values())
+    assert answer == OPTIONS[extra['Predicted option']]
+    assert all(count > 0 for count in extra['Option tokens'].values())
+    assert extra['Predicted option'] == max(extra['Option scores'], key=extra['Option scores'].get)
+
+
+class FixedScoreBackend(ModelBackend):
+    # "Nurse" is one token at -3.0; "Chief Executive" three tokens at -1.5 each.
+    def score_options(self, inputs, options):
+        scores = {'Nurse': (-3.0, 1), 'Chief Executive': (-4.5, 3), 'Banana': (-8.0, 2)}
+        return [scores[option][0] for option in options], [scores[option][1] for option in options]
+
+
+@pytest.mark.parametrize('normalisation, expected', [('sum', 'Nurse'), ('mean', 'Chief Executive')])
+def test_choose_option_normalises_by_length(normalisation, expected):
+    options = {'Stereotypical option': 'Nurse', 'Anti-stereotypical option': 'Chief Executive',
+               'Neutral option': 'Banana'}
+    answer, extra = FixedScoreBackend().choose_option(None, options, normalisation=normalisation)
+    assert answer == expected
+    assert extra['Option tokens'] == {'Stereotypical option': 1, 'Anti-stereotypical option': 3, 'Neutral option': 2}
+    assert extra['Option log-probs']['Anti-stereotypical option'] == -4.5
+    assert extra['Score normalisation'] == normalisation
+
+
+def test_choose_option_without_options_is_an_error():
+    with pytest.raises(ValueError, match='no answer options'):
+        FixedScoreBackend().choose_option(None, {'Stereotypical option': '', 'Anti-stereotypical option': None})
+
+
+def test_adapter_system_prompt(tmp_path):
+    # ms-swift 2 keeps sft_args.json next to the checkpoints; train_packed.py writes args.json into its output dir.
+    swift_run = tmp_path / 'llama_omni_lora8' / 'v0-20250807-100956'
+    (swift_run / 'checkpoint-50').mkdir(parents=True)
+    (swift_run / 'sft_args.json').write_text('{"system": "You are a helpful assistant."}')
+    packed_run = tmp_path / 'packed_lora8'
+    (packed_run / 'checkpoint-final').mkdir(parents=True)
+    (packed_run / 'args.json').write_text('{"system": "Answer with a letter."}')
+    (tmp_path / 'checkpoint-1').mkdir()
+
+    assert adapter_system_prompt(str(swift_run / 'checkpoint-50')) == "You are a helpful assistant."
+    assert adapter_system_prompt(str(packed_run / 'checkpoint-final') + '/') == "Answer with a letter."
+    assert adapter_system_prompt(str(tmp_path / 'checkpoint-1')) is None
+    assert adapter_system_prompt('null') is None and adapter_system_prompt(None) is None
+
+
+def test_option_scores_rejects_unknown_normalisation():
+    assert option_scores([-4.0], [0], 'mean') == [-4.0]
+    with pytest.raises(ValueError, match='normalisation'):
+        option_scores([-4.0], [2], 'max')
+
+
+def test_count_prompt_tokens(backend):
+    assert 0 < backend.count_prompt_tokens("Who is the nurse?") < backend.count_prompt_tokens(PROMPT)
+
+
+@pytest.mark.parametrize('model_name', sorted(BACKENDS))
+def test_int8_quantisation(model_name, audio_path):
+    for module in BACKEND_DEPENDENCIES[model_name]:
+        pytest.importorskip(module)
+    import torch
+
+    backend = get_backend(model_name)
+    try:
+        backend.load_tiny()
+    except OSError as e:
+        pytest.skip(f"Tokenizer of {model_name} not available: {e}")
+    backend.quantize('int8', audio_encoder=True)
+    for module in backend.quantizable_modules(audio_encoder=True):
+        assert not any(type(layer) is torch.nn.Linear for layer in module.modules())
+    _, extra = backend.choose_option(backend.featurise([audio_path], [PROMPT]), OPTIONS)
+    assert all(math.isfinite(value) for value in extra['Option log-probs'].values())
+
+
+def test_quantize_merges_peft_lora(audio_path):
+    for module in BACKEND_DEPENDENCIES['qwen2'] + ['peft']:
+        pytest.importorskip(module)
+    from peft import LoraConfig, PeftModel, get_peft_model
+
+    backend = get_backend('qwen2')
+    try:
+        backend.load_tiny()
+    except OSError as e:
+        pytest.skip(f"Tokenizer of qwen2 not available: {e}")
+    backend.model = get_peft_model(backend.model, LoraConfig(r=2, target_modules=['q_proj', 'v_proj']))
+    backend.quantize('int8')
+    assert not isinstance(backend.model, PeftModel)
+    assert not any(hasattr(module, 'lora_A') for module in backend.model.modules())
+
+
+def test_unmergeable_adapter_is_an_error():
+    torch = pytest.importorskip('torch')
+
+    class LoraLinear(torch.nn.Linear):
+        def __init__(self):
+            super().__init__(4, 4)
+            self.lora_A = torch.nn.Linear(4, 1)
+
+    backend = get_backend('qwen2')
+    backend.model = torch.nn.Sequential(LoraLinear())
+    with pytest.raises(RuntimeError, match='LoRA'):
+        backend.merge_adapters()
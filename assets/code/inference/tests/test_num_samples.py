@@ -0,0 +1,63 @@
+import json
+
+import pytest
+
+from model_backends import ModelBackend
+
+# run_benchmark imports transformers.set_seed.
+pytest.importorskip('transformers')
+
+from run_SAGE_inference import run_benchmark
+
+
+class SamplingBackend(ModelBackend):
+    """
+    Returns `num_samples` numbered answers per row, with one more generated token per sample.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.calls = []
+
+    def featurise(self, audio_paths, prompts, audio_store=None, feature_cache=None):
+        return list(prompts)
+
+    def generate_batch(self, inputs, temperature=0.7, max_new_tokens=512, num_samples=1, decode_policies=None,
+                       row_options=None):
+        self.calls.append(num_samples)
+        responses = [f"{prompt} #{sample}" for prompt in inputs for sample in range(num_samples)]
+        stats = [{'tokens': sample + 1, 'reason': 'eos'} for _ in inputs for sample in range(num_samples)]
+        return responses, stats
+
+
+def make_items(tmp_path, num_items):
+    items = []
+    for idx in range(num_items):
+        audio_path = tmp_path / f'item_{idx}.wav'
+        audio_path.write_bytes(b'')
+        items.append({'Audio Path': str(audio_path), 'Text prompt': f'Prompt {idx}', 'Stereotypical option': 'Nurse'})
+    return items
+
+
+def test_all_samples_of_an_item_come_from_one_call(tmp_path):
+    backend = SamplingBackend()
+    output_path = str(tmp_path / 'results.json')
+    run_benchmark(backend, make_items(tmp_path, 2), output_path, num_samples=3)
+
+    assert backend.calls == [3, 3]
+    with open(output_path) as f:
+        results = json.load(f)
+    assert [result['Model Answer'] for result in results] == ['Prompt 0 #0', 'Prompt 1 #0']
+    assert results[1]['Model Answers'] == ['Prompt 1 #0', 'Prompt 1 #1', 'Prompt 1 #2']
+    assert results[1]['Generated tokens'] == [1, 2, 3]
+    assert results[1]['Stop reason'] == ['eos'] * 3
+
+
+def test_single_sample_keeps_the_flat_result_fields(tmp_path):
+    output_path = str(tmp_path / 'results.json')
+    run_benchmark(SamplingBackend(), make_items(tmp_path, 1), output_path)
+
+    with open(output_path) as f:
+        result, = json.load(f)
+    assert 'Model Answers' not in result
+    assert (result['Generated tokens'], result['Stop reason']) == (1, 'eos')
@@ -0,0 +1,41 @@
+import pytest
+
+from prefetch import prefetch_batches
+
+
+def featurise(batch):
+    if 2 in batch:
+        raise FileNotFoundError("audio_2.wav")
+    if 4 in batch:
+        raise RuntimeError("CUDA out of memory")
+    return [idx * 10 for idx in batch]
+
+
+@pytest.mark.parametrize('prefetch_depth', [0, 1, 3])
+def test_batches_come_back_in_order_and_audio_errors_skip(prefetch_depth):
+    results = list(prefetch_batches(featurise, [[0, 1], [3], [2]], prefetch_depth=prefetch_depth, num_workers=2))
+    assert [batch for batch, _, _ in results] == [[0, 1], [3], [2]]
+    assert [inputs for _, inputs, _ in results] == [[0, 10], [30], None]
+    assert isinstance(results[2][2], FileNotFoundError)
+
+
+@pytest.mark.parametrize('prefetch_depth', [0, 2])
+def test_other_errors_end_the_run(prefetch_depth):
+    with pytest.raises(RuntimeError, match='out of memory'):
+        list(prefetch_batches(featurise, [[0], [4], [1]], prefetch_depth=prefetch_depth))
+
+
+def test_custom_skip_errors():
+    results = list(prefetch_batches(featurise, [[4]], prefetch_depth=1, skip_errors=(RuntimeError,)))
+    assert isinstance(results[0][2], RuntimeError)
+
+
+@pytest.mark.parametrize('prefetch_depth', [0, 2])
+def test_failed_batch_is_retried_item_by_item(prefetch_depth):
+    discarded = []
+    results = list(prefetch_batches(featurise, [[0, 1], [3, 2, 5], [6]], prefetch_depth=prefetch_depth,
+                                    discard=discarded.append))
+    assert [batch for batch, _, _ in results] == [[0, 1], [3], [2], [5], [6]]
+    assert [inputs for _, inputs, _ in results] == [[0, 10], [30], None, [50], [60]]
+    assert isinstance(results[2][2], FileNotFoundError)
+    assert discarded == [[3, 2, 5]]
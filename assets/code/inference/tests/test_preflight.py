@@ -0,0 +1,38 @@
+from preflight import MISSING_AUDIO, check_audio_file, run_preflight
+
+WAV_HEADER = b'RIFF\x24\x00\x00\x00WAVEfmt '
+
+
+def make_items(tmp_path, names):
+    items = []
+    for name in names:
+        audio_path = tmp_path / name
+        if name.startswith('ok'):
+            audio_path.write_bytes(WAV_HEADER)
+        elif name.startswith('bad'):
+            audio_path.write_bytes(b'not audio at all')
+        items.append({'Audio Path': str(audio_path), 'Text prompt': 'Who is speaking?'})
+    return items
+
+
+def test_missing_audio_is_a_warning_like_in_the_run(tmp_path, capsys):
+    items = make_items(tmp_path, ['ok_1.wav', 'ok_2.wav', 'missing_3.wav'])
+    assert check_audio_file(items[2]['Audio Path']) == MISSING_AUDIO
+    assert run_preflight(items, ['Audio Path', 'Text prompt'])
+    output = capsys.readouterr().out
+    assert f"WARNING: audio {items[2]['Audio Path']}: {MISSING_AUDIO}" in output
+    assert 'Dry run OK.' in output
+
+
+def test_no_audio_at_all_fails(tmp_path, capsys):
+    items = make_items(tmp_path, ['missing_1.wav', 'missing_2.wav'])
+    assert not run_preflight(items, ['Audio Path', 'Text prompt'])
+    assert 'none of the 2 audio files exists' in capsys.readouterr().out
+
+
+def test_corrupt_audio_still_fails(tmp_path, capsys):
+    items = make_items(tmp_path, ['ok_1.wav', 'bad_2.wav', 'missing_3.wav'])
+    assert not run_preflight(items, ['Audio Path', 'Text prompt'])
+    output = capsys.readouterr().out
+    assert 'not a valid audio file header' in output
+    assert 'Dry run found 1 problems.' in output
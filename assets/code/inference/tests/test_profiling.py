@@ -0,0 +1,85 @@
+import threading
+from contextlib import contextmanager
+
+import profiling
+from profiling import InferenceProfiler, stage
+
+
+class FakeStream:
+    def __init__(self, calls):
+        self.calls = calls
+
+    def synchronize(self):
+        self.calls.append('stream')
+
+
+class FakeCuda:
+    def __init__(self):
+        self.calls = []
+        self.current = []
+
+    def synchronize(self):
+        self.calls.append('device')
+
+    def Stream(self):
+        return FakeStream(self.calls)
+
+    @contextmanager
+    def stream(self, stream):
+        self.current.append(stream)
+        try:
+            yield
+        finally:
+            self.current.pop()
+
+    def reset_peak_memory_stats(self):
+        pass
+
+    def max_memory_allocated(self):
+        return 0
+
+
+def profiled_h2d(profiler, batch, cuda):
+    with profiler.track(batch), stage('h2d', synchronize=True):
+        return list(cuda.current)
+
+
+def test_prefetch_threads_wait_for_their_own_stream_only(tmp_path, monkeypatch):
+    cuda = FakeCuda()
+    monkeypatch.setattr(profiling, '_cuda', lambda: cuda)
+    profiler = InferenceProfiler(str(tmp_path / 'metrics.jsonl'))
+
+    streams = []
+    worker = threading.Thread(target=lambda: streams.append(profiled_h2d(profiler, [0], cuda)))
+    worker.start()
+    worker.join()
+    assert cuda.calls == ['stream']
+    assert len(streams[0]) == 1
+
+    profiler.finish_batch([0], ['a.wav'])
+    assert 'h2d' in profiler.records[-1]['stages']
+
+
+def test_main_thread_synchronises_the_device(tmp_path, monkeypatch):
+    cuda = FakeCuda()
+    monkeypatch.setattr(profiling, '_cuda', lambda: cuda)
+    profiler = InferenceProfiler(str(tmp_path / 'metrics.jsonl'))
+
+    assert profiled_h2d(profiler, [0], cuda) == []
+    assert cuda.calls == ['device', 'device']
+
+
+def test_unprofiled_prefetch_threads_still_use_their_stream(monkeypatch):
+    cuda = FakeCuda()
+    monkeypatch.setattr(profiling, '_cuda', lambda: cuda)
+
+    def copy():
+        with stage('h2d', synchronize=True):
+            streams.append(list(cuda.current))
+
+    streams = []
+    worker = threading.Thread(target=copy)
+    worker.start()
+    worker.join()
+    assert len(streams[0]) == 1
+    assert cuda.calls == ['stream']
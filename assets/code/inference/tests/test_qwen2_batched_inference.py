@@ -0,0 +1,101 @@
+'''
+Runs the batched Qwen2-Audio path on CPU with a tiny randomly initialised model. Only the processor files are
+downloaded; the test is skipped when they cannot be loaded.
+
+'''
+
+import pytest
+
+pytest.importorskip('torch')
+pytest.importorskip('transformers')
+pytest.importorskip('librosa')
+
+from batching import make_length_buckets
+from model_backends import get_backend, write_test_tone
+
+PROMPTS = [
+    "Who is more likely to be a nurse? Answer with one word.",
+    "Describe the speaker.",
+    "Who is more likely to be an engineer, the speaker or their colleague? Answer briefly.",
+    "Is the speaker a leader?",
+    "What job does the speaker have?",
+]
+DURATIONS = [1.0, 3.0, 0.5, 2.0, 1.5]
+
+
+@pytest.fixture(scope='module')
+def backend():
+    backend = get_backend('qwen2')
+    try:
+        backend.load_tiny()
+    except OSError as e:
+        pytest.skip(f"Qwen2-Audio processor not available: {e}")
+    return backend
+
+
+@pytest.fixture(scope='module')
+def audio_paths(tmp_path_factory):
+    audio_dir = tmp_path_factory.mktemp('audio')
+    paths = []
+    for idx, duration in enumerate(DURATIONS):
+        path = str(audio_dir / f'item_{idx}.wav')
+        write_test_tone(path, duration=duration, frequency=220.0 * (idx + 1))
+        paths.append(path)
+    return paths
+
+
+def generate_in_input_order(backend, audio_paths, prompts, batch_size):
+    lengths = [backend.count_prompt_tokens(prompt) + 25 * int(duration) for prompt, duration in zip(prompts, DURATIONS)]
+    results = [None] * len(prompts)
+    for batch in make_length_buckets(lengths, batch_size=batch_size):
+        inputs = backend.featurise([audio_paths[idx] for idx in batch], [prompts[idx] for idx in batch])
+        responses, stats = backend.generate_batch(inputs, temperature=0, max_new_tokens=6)
+        for idx, response, stat in zip(batch, responses, stats):
+            results[idx] = (response, stat['tokens'])
+    return results
+
+
+def test_batched_greedy_matches_batch_size_one(backend, audio_paths):
+    serial = generate_in_input_order(backend, audio_paths, PROMPTS, batch_size=1)
+    batched = generate_in_input_order(backend, audio_paths, PROMPTS, batch_size=3)
+    assert None not in batched
+    assert batched == serial
+
+
+def test_batch_returns_rows_in_input_order(backend, audio_paths):
+    inputs = backend.featurise(audio_paths, PROMPTS)
+    responses, stats = backend.generate_batch(inputs, temperature=0, max_new_tokens=6)
+    assert len(responses) == len(stats) == len(PROMPTS)
+    for idx in [0, 3]:
+        single, _ = backend.generate_batch(
+            backend.featurise([audio_paths[idx]], [PROMPTS[idx]]), temperature=0, max_new_tokens=6
+        )
+        assert responses[idx] == single[0]
+
+
+def test_samples_of_a_row_are_next_to_each_other(backend, audio_paths):
+    inputs = backend.featurise(audio_paths[:2], PROMPTS[:2])
+    responses, stats = backend.generate_batch(inputs, temperature=0, max_new_tokens=4, num_samples=2)
+    assert len(responses) == 4
+    # Greedy samples of the same row are identical.
+    assert responses[0] == responses[1] and responses[2] == responses[3]
+
+
+def test_samples_reuse_one_prefill(backend, audio_paths, monkeypatch):
+    import qwen2_inference
+
+    caches = []
+
+    def prefill(model, inputs, num_samples):
+        caches.append(prefill_shared_cache(model, inputs, num_samples))
+        return caches[-1]
+
+    prefill_shared_cache = qwen2_inference.prefill_shared_cache
+    monkeypatch.setattr(qwen2_inference, 'prefill_shared_cache', prefill)
+    inputs = backend.featurise(audio_paths[:2], PROMPTS[:2])
+    responses, _ = backend.generate_batch(inputs, temperature=0, max_new_tokens=6, num_samples=3)
+
+    assert len(caches) == 1 and caches[0] is not None
+    # Greedy decoding from the shared prefix gives the same answers as a fresh prefill per row.
+    single, _ = backend.generate_batch(inputs, temperature=0, max_new_tokens=6)
+    assert responses == [response for response in single for _ in range(3)]
@@ -0,0 +1,62 @@
+import json
+
+from result_log import ResultLog, consolidate, load_completed, merge_logs, read_log, result_key
+
+
+def record(idx):
+    return {'Audio path': f'voice/prompt_{idx}.wav', 'Text prompt': f'Question {idx}', 'Model Answer': 'A'}
+
+
+def test_resume_drops_a_truncated_last_line(tmp_path):
+    log_path = str(tmp_path / 'results.jsonl')
+    with ResultLog(log_path) as log:
+        log.append(record(1))
+        log.append(record(2))
+    with open(log_path, 'a') as f:
+        f.write('{"Audio path": "voice/prompt_3.wav", "Text pro')
+
+    assert [r['Text prompt'] for r in read_log(log_path)] == ['Question 1', 'Question 2']
+    with ResultLog(log_path, resume=True) as log:
+        log.append(record(3))
+    assert [r['Text prompt'] for r in read_log(log_path)] == ['Question 1', 'Question 2', 'Question 3']
+    assert load_completed(log_path) == {result_key(record(idx)) for idx in (1, 2, 3)}
+
+
+def test_without_resume_the_log_starts_over(tmp_path):
+    log_path = str(tmp_path / 'results.jsonl')
+    with ResultLog(log_path) as log:
+        log.append(record(1))
+    with ResultLog(log_path) as log:
+        log.append(record(2))
+    assert read_log(log_path) == [record(2)]
+
+
+def test_result_key_matches_items_and_records():
+    item = {'Audio Path': 'voice/prompt_1.wav', 'Text prompt': 'Question 1'}
+    assert result_key(item) == result_key(record(1))
+
+
+def test_fsync_every_records(tmp_path, monkeypatch):
+    synced = []
+    monkeypatch.setattr('os.fsync', lambda fd: synced.append(fd))
+    with ResultLog(str(tmp_path / 'results.jsonl'), fsync_every=2, fsync_interval=3600) as log:
+        for idx in range(5):
+            log.append(record(idx))
+        assert len(synced) == 2
+    assert len(synced) == 3
+
+
+def test_merge_logs_sorts_by_key_order(tmp_path):
+    shard_paths = [str(tmp_path / f'shard_{shard}.jsonl') for shard in range(2)]
+    for shard, indices in enumerate([(3, 1), (2,)]):
+        with ResultLog(shard_paths[shard]) as log:
+            for idx in indices:
+                log.append(record(idx))
+
+    output_path = tmp_path / 'results.json'
+    key_order = [result_key(record(idx)) for idx in (1, 2, 3)]
+    assert merge_logs(shard_paths, str(output_path), key_order=key_order) == 3
+    assert [r['Text prompt'] for r in json.loads(output_path.read_text())] == ['Question 1', 'Question 2', 'Question 3']
+
+    assert consolidate(shard_paths[0], str(output_path)) == 2
+    assert [r['Text prompt'] for r in json.loads(output_path.read_text())] == ['Question 3', 'Question 1']
@@ -0,0 +1,68 @@
+import json
+
+from launch_sharded_inference import merge_shards
+from result_log import skip_report_path
+from sharding import item_seed, shard_assignment, shard_output_path, write_run_manifest
+
+
+def make_items(num_items):
+    return [{'Audio Path': f'audio_{idx}.wav', 'Text prompt': f'prompt {idx}'} for idx in range(num_items)]
+
+
+def write_jsonl(path, records):
+    with open(path, 'w') as f:
+        for record in records:
+            f.write(json.dumps(record) + '\n')
+
+
+def result(item):
+    return {'Audio path': item['Audio Path'], 'Text prompt': item['Text prompt'], 'Model Answer': 'A'}
+
+
+def test_item_seed_ignores_position():
+    items = make_items(3)
+    assert item_seed(0, items[1]) == item_seed(0, dict(reversed(list(items[1].items()))))
+    assert item_seed(0, items[1]) != item_seed(1, items[1])
+    assert item_seed(0, items[1]) != item_seed(0, items[2])
+
+
+def test_round_robin_assignment():
+    assert shard_assignment(make_items(5), 2) == [0, 1, 0, 1, 0]
+
+
+def test_merge_uses_manifests_and_skip_reports(tmp_path):
+    items = make_items(6)
+    input_json = tmp_path / 'input.json'
+    input_json.write_text(json.dumps(items))
+    output_json = str(tmp_path / 'results.json')
+
+    # A stale log of an earlier sweep sits next to the output and must not be merged.
+    write_jsonl(str(tmp_path / 'results_old.shard0-of-2.jsonl'), [result(items[0])])
+    write_jsonl(str(tmp_path / 'results_old.shard1-of-2.jsonl'), [result(items[1])])
+
+    for shard_id in range(2):
+        shard_path = shard_output_path(output_json, shard_id, 2)
+        log_path = shard_path[:-len('.json')] + '.jsonl'
+        # Shards finish their items in any order; the merge restores input order.
+        write_jsonl(log_path, [result(item) for item in reversed(items[shard_id::2][:2])])
+        skipped_item = items[shard_id::2][2]
+        with open(skip_report_path(shard_path), 'w') as f:
+            json.dump([{**skipped_item, 'Reason': 'audio file not found'}], f)
+        write_run_manifest(output_json, shard_id, 2, [
+            {'output': output_json, 'log': log_path, 'skip_report': skip_report_path(shard_path)}
+        ])
+
+    assert merge_shards(str(input_json), output_json, 2) == [output_json]
+    with open(output_json, 'r') as f:
+        merged = json.load(f)
+    assert [record['Audio path'] for record in merged] == [item['Audio Path'] for item in items[:4]]
+    assert not (tmp_path / 'results_old.json').exists()
+    with open(skip_report_path(output_json), 'r') as f:
+        assert sorted(record['Audio Path'] for record in json.load(f)) == ['audio_4.wav', 'audio_5.wav']
+
+
+def test_merge_without_manifest_merges_nothing(tmp_path):
+    input_json = tmp_path / 'input.json'
+    input_json.write_text(json.dumps(make_items(2)))
+    write_jsonl(str(tmp_path / 'results.shard0-of-2.jsonl'), [])
+    assert merge_shards(str(input_json), str(tmp_path / 'results.json'), 2) == []
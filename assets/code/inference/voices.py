@@ -0,0 +1,16 @@
+'''
+Genders of the TTS voices, shared by score_mcqa.py and long-form/longform_scores.py. Amazon Polly voices are looked up
+by name; ElevenLabs voice directories carry the gender in their name.
+
+'''
+
+import re
+
+POLLY_VOICE_GENDERS = {
+    'Aditi': 'Female', 'Amy': 'Female', 'Aria': 'Female', 'Arthur': 'Male', 'Ayanda': 'Female', 'Brian': 'Male',
+    'Emma': 'Female', 'Geraint': 'Male', 'Joanna': 'Female', 'Joey': 'Male', 'Kendra': 'Female', 'Kimberly': 'Female',
+    'Liam': 'Male', 'Matthew': 'Male', 'Mia': 'Female', 'Nicole': 'Female', 'Olivia': 'Female',
+    'Olivia_AU': 'Female', 'Raveena': 'Female', 'Russell': 'Male', 'Ruth': 'Female', 'Salli': 'Female',
+    'Stephen': 'Male',
+}
+GENDER_PATTERN = re.compile(r'(?<![a-z])(female|male)(?![a-z])')
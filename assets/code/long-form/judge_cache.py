@@ -0,0 +1,70 @@
+'''
+Persistent, content-addressed cache of judge results. A result is stored under the hash of the judge model and the
+full request (rendered rubric prompt, response and response schema), so re-evaluating a results file only sends the
+responses that changed since the last run to the judge.
+
+'''
+
+import hashlib
+import json
+import sqlite3
+import time
+
+
+def request_hash(model_id, request):
+    """
+    Returns the cache key of a request: a SHA-256 over the judge model and the canonical JSON of the request.
+    """
+    payload = json.dumps({'model': model_id, 'request': request}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def is_valid_result(result):
+    """
+    Returns whether a judge result line holds a response with an answer (and is therefore worth caching).
+    """
+    candidates = (result.get('response') or {}).get('candidates') or []
+    return bool(candidates) and bool(candidates[0].get('content', {}).get('parts'))
+
+
+class JudgeCache:
+    """
+    SQLite table from request hash to judge response. Counts hits and misses of `get`.
+    """
+
+    def __init__(self, cache_path):
+        self.connection = sqlite3.connect(cache_path)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS results (hash TEXT PRIMARY KEY, response TEXT NOT NULL, created REAL NOT NULL)'
+        )
+        self.connection.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        row = self.connection.execute('SELECT response FROM results WHERE hash = ?', (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(row[0])
+
+    def put_many(self, items):
+        """
+        Stores (hash, response) pairs in one transaction.
+        """
+        now = time.time()
+        with self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO results (hash, response, created) VALUES (?, ?, ?)',
+                [(key, json.dumps(response), now) for key, response in items]
+            )
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
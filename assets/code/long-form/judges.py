@@ -0,0 +1,360 @@
+'''
+Judges for the long-form evaluation. Every judge takes a JSONL file of Gemini requests ({"key", "request"} per line)
+and writes a JSONL file of results in the layout of the Gemini Batch API ({"key", "response"} or {"key", "error"} per
+line), so the rest of the pipeline does not care which judge produced them.
+
+- BatchJudge uploads the requests to the Gemini Batch API and polls the job until it finishes.
+- OnlineJudge sends the requests to a generateContent endpoint concurrently, with a token-bucket rate limiter, a cap
+  on requests in flight and retries with jittered exponential backoff. Pointed at stub_judge_server.py it runs fully
+  offline.
+
+Both judges can be given a ContextCaches: every distinct system instruction (the judge instruction with the rubrics of
+all tasks) is then uploaded once as a cached context, and requests reference it by name through `cachedContent`
+instead of carrying it.
+
+'''
+
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+GEMINI_API_URL = 'https://generativelanguage.googleapis.com'
+# Rate limiting, overload and transient server errors are retried; anything else is reported as an error line.
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+# Smallest context that the Gemini 2.5 Flash models cache explicitly, in tokens; smaller ones are refused.
+MIN_CACHED_TOKENS = 1024
+
+
+def read_requests(requests_path):
+    """
+    Yields the requests of a JSONL request file one at a time.
+    """
+    with open(requests_path, 'r') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def call_json(url, body=None, api_key=None, method='POST', timeout=120.0):
+    """
+    Sends a JSON request to the Gemini REST API (or the stub judge) and returns the parsed JSON response.
+    """
+    headers = {'Content-Type': 'application/json'}
+    if api_key:
+        headers['x-goog-api-key'] = api_key
+    data = json.dumps(body).encode('utf-8') if body is not None else None
+    http_request = urllib.request.Request(url, data=data, headers=headers, method=method)
+    with urllib.request.urlopen(http_request, timeout=timeout) as response:
+        content = response.read()
+    return json.loads(content) if content else {}
+
+
+def error_message(error):
+    """
+    Returns the message of a Gemini REST API error response, or its HTTP status if it has none.
+    """
+    try:
+        return json.loads(error.read())['error']['message']
+    except (OSError, ValueError, KeyError, TypeError):
+        return f"HTTP {error.code}"
+
+
+def prompt_token_usage(results_paths):
+    """
+    Returns the prompt tokens of the responses in some result files, and how many of them came from cached contexts.
+    """
+    prompt_tokens, cached_tokens = 0, 0
+    for results_path in results_paths:
+        for result in read_requests(results_path):
+            usage = (result.get('response') or {}).get('usageMetadata', {})
+            prompt_tokens += usage.get('promptTokenCount', 0)
+            cached_tokens += usage.get('cachedContentTokenCount', 0)
+    return prompt_tokens, cached_tokens
+
+
+def run_shards(judge, requests_paths, output_paths, max_parallel=1):
+    """
+    Runs a judge over several request shards, up to `max_parallel` at a time (e.g. parallel batch jobs). Returns
+    whether every shard succeeded.
+    """
+    if max_parallel <= 1:
+        return all([judge.run(requests_path, output_path) for requests_path, output_path in zip(requests_paths, output_paths)])
+    with ThreadPoolExecutor(max_workers=max_parallel) as executor:
+        return all(list(executor.map(judge.run, requests_paths, output_paths)))
+
+
+class TokenBucket:
+    """
+    Token-bucket rate limiter for asyncio: `rate` tokens are added per second, up to `capacity`.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self, tokens=1.0):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self.tokens) / self.rate)
+
+
+class ContextCaches:
+    """
+    Cached contexts of the system instructions of a run, created on first use through the cachedContents endpoint and
+    shared by every shard. If the endpoint refuses to cache an instruction (e.g. below MIN_CACHED_TOKENS), a warning
+    is printed and requests with that instruction keep sending it inline; `num_inline` counts them. The contexts
+    expire after `ttl`, which has to outlast a batch job.
+    """
+
+    def __init__(self, model_id, base_url=GEMINI_API_URL, api_key=None, ttl='3600s', timeout=120.0):
+        self.model_id = model_id
+        self.base_url = base_url.rstrip('/')
+        self.api_key = api_key
+        self.ttl = ttl
+        self.timeout = timeout
+        self.names = {}
+        self.num_inline = 0
+        self.lock = threading.Lock()
+
+    def _call(self, url, body=None, method='POST'):
+        return call_json(url, body, api_key=self.api_key, method=method, timeout=self.timeout)
+
+    def _create(self, system_instruction):
+        try:
+            cached_content = self._call(f"{self.base_url}/v1beta/cachedContents", {
+                'model': f"models/{self.model_id}",
+                'systemInstruction': system_instruction,
+                'ttl': self.ttl
+            })
+        except urllib.error.HTTPError as error:
+            print(f"Warning: Could not create a cached context ({error_message(error)}); sending the system "
+                  f"instruction inline. Gemini only caches contexts of at least {MIN_CACHED_TOKENS} tokens.")
+            return None
+        num_tokens = cached_content.get('usageMetadata', {}).get('totalTokenCount')
+        print(f"Created cached context: {cached_content['name']} ({num_tokens} tokens)")
+        return cached_content['name']
+
+    def reference(self, request):
+        """
+        Returns the request with its system instruction replaced by a reference to the instruction's cached context.
+        """
+        if 'systemInstruction' not in request:
+            return request
+        instruction_key = json.dumps(request['systemInstruction'], sort_keys=True)
+        with self.lock:
+            if instruction_key not in self.names:
+                self.names[instruction_key] = self._create(request['systemInstruction'])
+            name = self.names[instruction_key]
+            if name is None:
+                self.num_inline += 1
+        if name is None:
+            return request
+        request = {field: value for field, value in request.items() if field != 'systemInstruction'}
+        request['cachedContent'] = name
+        return request
+
+    def delete(self):
+        """
+        Deletes the cached contexts once every shard is judged, instead of leaving them to expire.
+        """
+        for name in self.names.values():
+            if name is None:
+                continue
+            try:
+                self._call(f"{self.base_url}/v1beta/{name}", method='DELETE')
+            except urllib.error.URLError as error:
+                print(f"Warning: Could not delete cached context {name}: {error}")
+        self.names = {}
+
+
+class BatchJudge:
+    """
+    Judges requests with the Gemini Batch API: uploads the request file, creates a batch job and polls it every
+    `poll_interval` seconds until it finishes. With `context_caches`, the uploaded lines reference cached contexts
+    instead of carrying their system instruction.
+    """
+
+    def __init__(self, model_id, api_key, poll_interval=30, context_caches=None):
+        # google-genai is only needed for batch mode.
+        from google import genai
+
+        self.model_id = model_id
+        self.poll_interval = poll_interval
+        self.context_caches = context_caches
+        self.client = genai.Client(api_key=api_key, http_options={'api_version': 'v1alpha'})
+
+    def run(self, requests_path, output_path):
+        from google.genai import types
+
+        # The request shard keeps the full requests (the judge cache hashes them); the upload references the contexts.
+        if self.context_caches is not None:
+            upload_path = os.path.splitext(requests_path)[0] + '.upload.jsonl'
+            with open(upload_path, 'w') as f:
+                for line in read_requests(requests_path):
+                    f.write(json.dumps({'key': line['key'], 'request': self.context_caches.reference(line['request'])}) + '\n')
+            requests_path = upload_path
+
+        # --- Upload the Batch Request File ---
+        print(f"Uploading file: {requests_path}")
+        uploaded_batch_requests = self.client.files.upload(
+            file=requests_path,
+            config=types.UploadFileConfig(
+                display_name='batch-longform-eval-input',
+                mime_type="application/x-ndjson"
+            )
+        )
+        print(f"Uploaded file: {uploaded_batch_requests.name}")
+
+        # --- Create the Batch Job ---
+        print(f"Creating batch job with model: {self.model_id} and input file: {uploaded_batch_requests.name}")
+        batch_job_from_file = self.client.batches.create(
+            model=self.model_id,
+            src=uploaded_batch_requests.name,
+            config={
+                'display_name': f"longform-evaluation-job-{os.path.basename(requests_path)}",
+            }
+        )
+        print(f"Created batch job: {batch_job_from_file.name}")
+
+        # --- Monitor Job Status ---
+        job_name = batch_job_from_file.name
+        print(f"Polling status for job: {job_name}")
+        while True:
+            batch_job = self.client.batches.get(name=job_name)
+            if batch_job.state.name in ('JOB_STATE_SUCCEEDED', 'JOB_STATE_FAILED', 'JOB_STATE_CANCELLED'):
+                break
+            print(f"Job not finished. Current state: {batch_job.state.name}. Waiting {self.poll_interval} seconds...")
+            time.sleep(self.poll_interval)
+
+        print(f"Job finished with state: {batch_job.state.name}")
+        if batch_job.state.name == 'JOB_STATE_FAILED':
+            print(f"Error details: {batch_job.error}")
+        if batch_job.state.name != 'JOB_STATE_SUCCEEDED':
+            print(f"Job did not succeed. Final state: {batch_job.state.name}")
+            return False
+
+        # --- Retrieve Results ---
+        result_file_name = batch_job.dest.file_name
+        print(f"Results are in file: {result_file_name}")
+        try:
+            file_content = self.client.files.download(file=result_file_name).decode('utf-8')
+            with open(output_path, 'w') as f:
+                f.write(file_content)
+        except Exception as e:
+            print(f"Error downloading results: {e}")
+            return False
+        return True
+
+
+class OnlineJudge:
+    """
+    Judges requests one generateContent call each, sent concurrently from asyncio. At most `max_in_flight` requests
+    are open at a time and at most `requests_per_minute` are started per minute. Failed calls with a retryable status
+    are retried up to `max_retries` times with full-jitter exponential backoff (or the server's Retry-After).
+
+    With `context_caches`, requests reference the cached context of their system instruction instead of sending it.
+    """
+
+    def __init__(self, model_id, base_url=GEMINI_API_URL, api_key=None, requests_per_minute=60, max_in_flight=8,
+                 max_retries=5, backoff_base=1.0, backoff_max=60.0, timeout=120.0, context_caches=None):
+        self.model_id = model_id
+        self.base_url = base_url.rstrip('/')
+        self.url = f"{self.base_url}/v1beta/models/{model_id}:generateContent"
+        self.api_key = api_key
+        self.requests_per_minute = requests_per_minute
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.context_caches = context_caches
+        self.num_retries = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+
+    def _post(self, request):
+        return call_json(self.url, request, api_key=self.api_key, timeout=self.timeout)
+
+    async def generate(self, request, rate_limiter, executor):
+        """
+        Sends one generateContent request, retrying retryable failures, and returns the parsed response.
+        """
+        loop = asyncio.get_running_loop()
+        for attempt in range(self.max_retries + 1):
+            await rate_limiter.acquire()
+            retry_after = None
+            try:
+                return await loop.run_in_executor(executor, self._post, request)
+            except urllib.error.HTTPError as error:
+                if error.code not in RETRYABLE_STATUS or attempt == self.max_retries:
+                    raise
+                retry_after = error.headers.get('Retry-After')
+            except (urllib.error.URLError, TimeoutError, ConnectionError):
+                if attempt == self.max_retries:
+                    raise
+
+            delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+            if retry_after is not None and retry_after.isdigit():
+                delay = max(delay, float(retry_after))
+            self.num_retries += 1
+            await asyncio.sleep(delay)
+
+    async def _run(self, requests_path, output_path):
+        rate_limiter = TokenBucket(self.requests_per_minute / 60.0)
+        in_flight = asyncio.Semaphore(self.max_in_flight)
+        num_done, num_failed = 0, 0
+        self.num_retries, self.prompt_tokens, self.cached_tokens = 0, 0, 0
+        start_time = time.monotonic()
+
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as executor, open(output_path, 'w') as f:
+            async def judge_one(line):
+                nonlocal num_done, num_failed
+                try:
+                    response = await self.generate(line['request'], rate_limiter, executor)
+                    result = {'key': line['key'], 'response': response}
+                    usage = response.get('usageMetadata', {})
+                    self.prompt_tokens += usage.get('promptTokenCount', 0)
+                    self.cached_tokens += usage.get('cachedContentTokenCount', 0)
+                except Exception as error:
+                    result = {'key': line['key'], 'error': {'message': repr(error)}}
+                    num_failed += 1
+                finally:
+                    in_flight.release()
+                # Results are written as they finish; downstream code matches them to requests by key.
+                f.write(json.dumps(result) + '\n')
+                num_done += 1
+                if num_done % 20 == 0:
+                    print(f"Judged {num_done} requests ({num_failed} failed, {self.num_retries} retries)")
+
+            tasks = []
+            for line in read_requests(requests_path):
+                await in_flight.acquire()
+                if self.context_caches is not None:
+                    line['request'] = self.context_caches.reference(line['request'])
+                tasks.append(asyncio.create_task(judge_one(line)))
+            await asyncio.gather(*tasks)
+
+        elapsed = time.monotonic() - start_time
+        print(f"Finished judging {num_done} requests in {elapsed:.1f}s ({num_failed} failed, {self.num_retries} retries)")
+        if num_done:
+            print(f"Prompt tokens per request: {(self.prompt_tokens - self.cached_tokens) / num_done:.0f} sent, "
+                  f"{self.cached_tokens / num_done:.0f} from cached context")
+        return num_failed == 0
+
+    def run(self, requests_path, output_path):
+        return asyncio.run(self._run(requests_path, output_path))
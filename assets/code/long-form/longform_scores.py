@@ -0,0 +1,345 @@
+'''
+Columnar store of the long-form judge scores, and the dimension-difference heatmaps built from it.
+
+'parse' turns a judge results file (longform_evaluation_results_*.jsonl) and the responses JSON it was made from into
+a .npz store with one row per (request, dimension): key, task, dimension, dimension index, score, voice and gender.
+The judge notes go to a separate .notes.npz that is only read when asked for.
+
+'render' regenerates every heatmap PDF described by a JSON config in one pass. Every set of rows becomes
+<output_dir>/<set>/heatmap_{first,second,third}_dimensions_differences.pdf, with one row per run and one column per
+voice gender and task (the task's first, second or third dimension). Cells show the mean score with its bootstrap
+confidence interval and are coloured by the difference to the row's baseline run. The male-vs-female differences of
+every set are written next to the PDFs as gender_differences.csv.
+
+    {
+        "anti_Lora4": [
+            {"label": "qwen2\naudio", "results": "longform_evaluation_results_qwen2.jsonl", "responses": "qwen2.json"},
+            {"label": "SSS\nqwen2\naudio", "results": "...", "responses": "...", "baseline": "qwen2\naudio"},
+            ...
+        ],
+        ...
+    }
+
+    python longform_scores.py parse --results longform_evaluation_results_qwen2.jsonl --responses qwen2.json
+    python longform_scores.py render --config heatmaps.json --output_dir ../../heatmaps_batch
+
+'''
+
+import argparse
+import json
+import os
+import re
+import sys
+
+import numpy as np
+import pandas as pd
+
+from request_shards import iter_json_array, read_jsonl, request_index
+from rubrics import EVAL_DIMENSIONS, get_task_type, response_audio_path
+
+# The voice genders are shared with score_mcqa.py in ../inference.
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'inference'))
+from voices import GENDER_PATTERN, POLLY_VOICE_GENDERS
+
+SCORES = np.arange(1, 6)
+GENDERS = ['Female', 'Male']
+DIMENSION_ORDINALS = ['first', 'second', 'third']
+
+
+def response_voice(record):
+    """
+    Returns the voice of a response record: the directory of its audio file, e.g. 'polly_Amy'.
+    """
+    return os.path.basename(os.path.dirname(response_audio_path(record)))
+
+
+def voice_gender(voice):
+    """
+    Returns 'Female', 'Male' or 'Unknown' for a voice.
+    """
+    match = GENDER_PATTERN.search(voice.lower())
+    if match:
+        return match.group(1).capitalize()
+    return POLLY_VOICE_GENDERS.get(re.sub(r'^polly_', '', voice), 'Unknown')
+
+
+def store_path(results_path):
+    """
+    Returns the path of the score store of a judge results file, e.g. longform_evaluation_results_x.npz.
+    """
+    return os.path.splitext(results_path)[0] + '.npz'
+
+
+def notes_path(scores_path):
+    return os.path.splitext(scores_path)[0] + '.notes.npz'
+
+
+def parse_judge_results(results_path, responses_path=None):
+    """
+    Parses a judge results file into columns (one entry per request and dimension) and the matching judge notes.
+    Results with an error or an unparseable answer are skipped; dimensions are matched to the task's rubric by name.
+    """
+    voices = [response_voice(record) for record in iter_json_array(responses_path)] if responses_path else []
+    columns = {'key': [], 'task': [], 'dimension': [], 'dim_index': [], 'score': [], 'voice': [], 'gender': []}
+    notes = []
+    num_skipped = 0
+    for result in read_jsonl(results_path):
+        try:
+            text = result['response']['candidates'][0]['content']['parts'][0]['text']
+            ratings = json.loads(text)
+        except (KeyError, IndexError, TypeError, json.JSONDecodeError):
+            num_skipped += 1
+            continue
+
+        idx = request_index(result['key']) - 1
+        task_info = get_task_type(idx)
+        dimension_names = [dim['name'].lower() for dim in task_info['Dimensions']]
+        voice = voices[idx] if idx < len(voices) else ''
+        for rating in ratings:
+            name = str(rating.get('dimension', '')).strip().lower()
+            if name not in dimension_names or not isinstance(rating.get('score'), int):
+                num_skipped += 1
+                continue
+            dim_index = dimension_names.index(name)
+            columns['key'].append(result['key'])
+            columns['task'].append(task_info['Task'])
+            columns['dimension'].append(task_info['Dimensions'][dim_index]['name'])
+            columns['dim_index'].append(dim_index)
+            columns['score'].append(rating['score'])
+            columns['voice'].append(voice)
+            columns['gender'].append(voice_gender(voice))
+            notes.append(str(rating.get('notes', '')))
+
+    if num_skipped:
+        print(f"Warning: Skipped {num_skipped} unparseable results or ratings in {results_path}.")
+    columns = {
+        name: np.asarray(values, dtype=np.int8 if name in ('dim_index', 'score') else str)
+        for name, values in columns.items()
+    }
+    return columns, np.asarray(notes, dtype=str)
+
+
+def store_sources(results_path, responses_path=None):
+    """
+    Describes the files a score store is parsed from, by absolute path and modification time, as a JSON string.
+    """
+    sources = {'results': [os.path.abspath(results_path), os.path.getmtime(results_path)]}
+    if responses_path:
+        sources['responses'] = [os.path.abspath(responses_path), os.path.getmtime(responses_path)]
+    return json.dumps(sources, sort_keys=True)
+
+
+def save_store(scores_path, columns, notes, sources=None):
+    extra = {'sources': np.asarray(sources)} if sources is not None else {}
+    np.savez_compressed(scores_path, **columns, **extra)
+    np.savez_compressed(notes_path(scores_path), key=columns['key'], dimension=columns['dimension'], notes=notes)
+
+
+def load_store(scores_path):
+    """
+    Loads a score store as a DataFrame with categorical text columns (without the notes).
+    """
+    with np.load(scores_path) as store:
+        scores = pd.DataFrame({name: store[name] for name in store.files if name != 'sources'})
+    for column in ('key', 'task', 'dimension', 'voice', 'gender'):
+        scores[column] = scores[column].astype('category')
+    return scores
+
+
+def load_notes(scores_path):
+    """
+    Loads the judge notes of a score store, aligned row by row with load_store.
+    """
+    with np.load(notes_path(scores_path)) as store:
+        return pd.DataFrame({name: store[name] for name in store.files})
+
+
+def ensure_store(results_path, responses_path=None):
+    """
+    Returns the score store path of a judge results file, (re)building it if it is missing or was parsed from other
+    results or responses files, or from older versions of them.
+    """
+    scores_path = store_path(results_path)
+    sources = store_sources(results_path, responses_path)
+    saved_sources = None
+    if os.path.exists(scores_path):
+        with np.load(scores_path) as store:
+            if 'sources' in store.files:
+                saved_sources = str(store['sources'])
+    if saved_sources != sources:
+        columns, notes = parse_judge_results(results_path, responses_path)
+        save_store(scores_path, columns, notes, sources)
+    return scores_path
+
+
+def bootstrap_means(counts, num_resamples=1000, seed=0):
+    """
+    Returns (num_resamples, groups) bootstrap means of every group, given a (groups, 5) array of counts of scores 1-5.
+    Resampling a group's scores with replacement is a multinomial draw, so all groups are resampled at once.
+    """
+    totals = counts.sum(axis=1)
+    rng = np.random.default_rng(seed)
+    resampled = rng.multinomial(totals, counts / totals[:, None], size=(num_resamples, len(counts)))
+    return resampled @ SCORES / totals
+
+
+def summarise_scores(scores, num_resamples=1000, confidence=0.95, seed=0):
+    """
+    Returns the mean score and its bootstrap confidence bounds per run, gender, task and dimension index, and the
+    bootstrap means (one column per row of the summary).
+    """
+    counts = pd.crosstab(
+        [scores['run'], scores['gender'], scores['task'], scores['dim_index']], scores['score']
+    ).reindex(columns=SCORES, fill_value=0)
+    values = counts.to_numpy()
+    draws = bootstrap_means(values, num_resamples, seed)
+    alpha = (1 - confidence) / 2
+    summary = pd.DataFrame({
+        'n': values.sum(axis=1),
+        'mean': values @ SCORES / values.sum(axis=1),
+        'ci_low': np.percentile(draws, 100 * alpha, axis=0),
+        'ci_high': np.percentile(draws, 100 * (1 - alpha), axis=0),
+    }, index=counts.index)
+    return summary, draws
+
+
+def gender_differences(summary, draws, confidence=0.95):
+    """
+    Returns the female minus male mean score per run, task and dimension index, with bootstrap confidence bounds.
+    """
+    position = {key: idx for idx, key in enumerate(summary.index)}
+    rows, female, male = [], [], []
+    for run, gender, task, dim_index in summary.index:
+        if gender != 'Female' or (run, 'Male', task, dim_index) not in position:
+            continue
+        rows.append((run, task, dim_index))
+        female.append(position[(run, 'Female', task, dim_index)])
+        male.append(position[(run, 'Male', task, dim_index)])
+
+    difference_draws = draws[:, female] - draws[:, male]
+    alpha = (1 - confidence) / 2
+    differences = pd.DataFrame(rows, columns=['run', 'task', 'dim_index'])
+    differences['female'] = summary['mean'].to_numpy()[female]
+    differences['male'] = summary['mean'].to_numpy()[male]
+    differences['difference'] = differences['female'] - differences['male']
+    differences['ci_low'] = np.percentile(difference_draws, 100 * alpha, axis=0)
+    differences['ci_high'] = np.percentile(difference_draws, 100 * (1 - alpha), axis=0)
+    return differences
+
+
+def render_heatmap(summary, rows, dim_index, pdf_path, run_prefix=''):
+    """
+    Draws one heatmap: rows are runs (`run_prefix` + label in the summary), columns are (gender, task) for the task's
+    `dim_index`-th dimension.
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    tasks = [task_info['Task'] for task_info in EVAL_DIMENSIONS]
+    columns = [(gender, task) for gender in GENDERS for task in tasks]
+    means = np.full((len(rows), len(columns)), np.nan)
+    lower, upper = means.copy(), means.copy()
+    for row_idx, row in enumerate(rows):
+        for col_idx, (gender, task) in enumerate(columns):
+            key = (run_prefix + row['label'], gender, task, dim_index)
+            if key in summary.index:
+                means[row_idx, col_idx], lower[row_idx, col_idx], upper[row_idx, col_idx] = \
+                    summary.loc[key, ['mean', 'ci_low', 'ci_high']]
+
+    # Cells are coloured by the change in mean score against the row's baseline run (zero for baseline rows).
+    labels = [row['label'] for row in rows]
+    differences = np.zeros_like(means)
+    for row_idx, row in enumerate(rows):
+        if row.get('baseline') in labels:
+            differences[row_idx] = means[row_idx] - means[labels.index(row['baseline'])]
+    limit = np.nanmax(np.abs(differences)) if np.any(differences) else 1.0
+
+    fig, ax = plt.subplots(figsize=(14, 8))
+    ax.imshow(np.nan_to_num(differences), cmap='RdYlGn', vmin=-limit, vmax=limit, aspect='auto')
+    for row_idx in range(len(rows)):
+        for col_idx in range(len(columns)):
+            if np.isnan(means[row_idx, col_idx]):
+                continue
+            ax.text(col_idx, row_idx - 0.12, f"{means[row_idx, col_idx]:.2f}", ha='center', va='center', fontsize=16)
+            ax.text(col_idx, row_idx + 0.2, f"[{lower[row_idx, col_idx]:.2f}, {upper[row_idx, col_idx]:.2f}]",
+                    ha='center', va='center', fontsize=16)
+
+    dimension_names = [task_info['Dimensions'][dim_index]['name'] for task_info in EVAL_DIMENSIONS]
+    ax.set_xticks(range(len(columns)))
+    ax.set_xticklabels([name.replace(' ', '\n', 1) for name in dimension_names] * len(GENDERS), fontsize=14)
+    ax.set_yticks(range(len(rows)))
+    ax.set_yticklabels(labels, fontsize=14)
+    ax.set_xticks(np.arange(-0.5, len(columns)), minor=True)
+    ax.set_yticks(np.arange(-0.5, len(rows)), minor=True)
+    ax.grid(which='minor', color='white', linewidth=1)
+    ax.tick_params(which='both', length=0)
+    for spine in ax.spines.values():
+        spine.set_visible(False)
+    for gender_idx, gender in enumerate(GENDERS):
+        ax.text((gender_idx + 0.5) * len(tasks) - 0.5, -0.6, gender, ha='center', va='bottom', fontsize=18)
+
+    fig.savefig(pdf_path, bbox_inches='tight')
+    plt.close(fig)
+
+
+def render_all(config_path, output_dir, num_resamples=1000, confidence=0.95):
+    """
+    Renders the heatmaps of every set in a config in one pass; each results file is parsed (or loaded) only once.
+    """
+    with open(config_path, 'r') as f:
+        config = json.load(f)
+
+    frames = []
+    for set_name, rows in config.items():
+        for row in rows:
+            scores = load_store(ensure_store(row['results'], row.get('responses')))
+            scores['run'] = f"{set_name}/{row['label']}"
+            frames.append(scores)
+    scores = pd.concat(frames, ignore_index=True)
+    summary, draws = summarise_scores(scores, num_resamples=num_resamples, confidence=confidence)
+    differences = gender_differences(summary, draws, confidence=confidence)
+
+    for set_name, rows in config.items():
+        set_dir = os.path.join(output_dir, set_name)
+        os.makedirs(set_dir, exist_ok=True)
+        for dim_index, ordinal in enumerate(DIMENSION_ORDINALS):
+            pdf_path = os.path.join(set_dir, f"heatmap_{ordinal}_dimensions_differences.pdf")
+            render_heatmap(summary, rows, dim_index, pdf_path, run_prefix=f"{set_name}/")
+
+        set_differences = differences[differences['run'].str.startswith(f"{set_name}/")].copy()
+        set_differences['run'] = set_differences['run'].str[len(set_name) + 1:].str.replace('\n', ' ')
+        set_differences.to_csv(os.path.join(set_dir, 'gender_differences.csv'), index=False)
+        print(f"Rendered {len(DIMENSION_ORDINALS)} heatmaps for {set_name} in {set_dir}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Build long-form score stores and render the difference heatmaps.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    parse_parser = subparsers.add_parser('parse', help="Parse a judge results file into a score store.")
+    parse_parser.add_argument('--results', type=str, required=True,
+                              help="Judge results JSONL written by evaluate_long_form.py.")
+    parse_parser.add_argument('--responses', type=str, default=None,
+                              help="Responses JSON the requests were made from, for the voice of every item.")
+    parse_parser.add_argument('--output', type=str, default=None,
+                              help="Path of the .npz store. Defaults to the results path with a .npz suffix.")
+
+    render_parser = subparsers.add_parser('render', help="Render every heatmap of a config in one pass.")
+    render_parser.add_argument('--config', type=str, required=True,
+                               help="JSON config mapping each heatmap set to its rows (see the module docstring).")
+    render_parser.add_argument('--output_dir', type=str, default='../../heatmaps_batch',
+                               help="Directory the heatmap sets are written to. Default is ../../heatmaps_batch.")
+    render_parser.add_argument('--bootstrap', type=int, default=1000,
+                               help="Number of bootstrap resamples for the confidence intervals. Default is 1000.")
+    render_parser.add_argument('--confidence', type=float, default=0.95,
+                               help="Confidence level of the intervals. Default is 0.95.")
+    args = parser.parse_args()
+
+    if args.command == 'parse':
+        columns, notes = parse_judge_results(args.results, args.responses)
+        output_path = args.output or store_path(args.results)
+        save_store(output_path, columns, notes, store_sources(args.results, args.responses))
+        print(f"Saved {len(notes)} scores to {output_path}")
+    else:
+        render_all(args.config, args.output_dir, num_resamples=args.bootstrap, confidence=args.confidence)
@@ -0,0 +1,142 @@
+'''
+Streaming helpers for the long-form evaluation, so that memory use does not grow with the size of the results file.
+Responses are parsed one at a time from the input JSON list, requests are written straight into request shards that
+stay under the Batch API size limits, and the judge results of every shard are merged back into request order.
+
+'''
+
+import json
+import os
+import time
+import uuid
+
+READ_CHUNK_SIZE = 1 << 16
+
+
+def iter_json_array(json_path, chunk_size=READ_CHUNK_SIZE):
+    """
+    Yields the elements of a JSON file holding one top-level list, parsing it incrementally so that only one element
+    (plus one read chunk) is in memory at a time.
+    """
+    decoder = json.JSONDecoder()
+    with open(json_path, 'r') as f:
+        buffer = f.read(chunk_size).lstrip()
+        if not buffer.startswith('['):
+            raise ValueError(f"{json_path} does not hold a JSON list.")
+        buffer = buffer[1:]
+        end_of_file = False
+        while True:
+            buffer = buffer.lstrip().lstrip(',').lstrip()
+            if buffer.startswith(']'):
+                return
+            try:
+                element, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                # The element continues beyond the buffer; read more of the file.
+                if end_of_file:
+                    raise
+                chunk = f.read(chunk_size)
+                end_of_file = not chunk
+                buffer += chunk
+                continue
+            yield element
+            buffer = buffer[end:]
+
+
+def read_jsonl(jsonl_path):
+    """
+    Yields the records of a JSONL file one at a time; a missing file yields nothing.
+    """
+    if not os.path.exists(jsonl_path):
+        return
+    with open(jsonl_path, 'r') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def run_prefix(work_dir, name):
+    """
+    Returns a path prefix that is unique to this run, so concurrent runs never overwrite each other's files.
+    """
+    os.makedirs(work_dir, exist_ok=True)
+    return os.path.join(work_dir, f"{name}_{time.strftime('%Y%m%d-%H%M%S')}_{uuid.uuid4().hex[:8]}")
+
+
+def request_index(key):
+    """
+    Returns the position of a request from its key, e.g. 'request_12' -> 12.
+    """
+    return int(key.rsplit('_', 1)[1])
+
+
+class ShardWriter:
+    """
+    Writes requests into numbered shard files of at most `max_bytes` bytes and `max_items` items. Results that are
+    already known (judge cache hits) are written to a side file of the shard they fall into, so each shard can be
+    merged back into request order on its own.
+    """
+
+    def __init__(self, prefix, max_bytes=100 * 1024 ** 2, max_items=10000):
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.max_items = max_items
+        self.shards = []
+        self._requests_file = None
+        self._hits_file = None
+
+    def _open_shard(self):
+        self.close()
+        shard_prefix = f"{self.prefix}.part{len(self.shards):03d}"
+        self.shards.append({
+            'requests': shard_prefix + '.requests.jsonl',
+            'hits': shard_prefix + '.cached.jsonl',
+            'results': shard_prefix + '.results.jsonl',
+            'num_requests': 0,
+            'num_items': 0,
+            'num_bytes': 0
+        })
+        self._requests_file = open(self.shards[-1]['requests'], 'w')
+        self._hits_file = open(self.shards[-1]['hits'], 'w')
+
+    def _shard_for(self, num_bytes):
+        shard = self.shards[-1] if self.shards else None
+        if shard is None or shard['num_items'] >= self.max_items or (
+                shard['num_requests'] and shard['num_bytes'] + num_bytes > self.max_bytes):
+            self._open_shard()
+            shard = self.shards[-1]
+        shard['num_items'] += 1
+        return shard
+
+    def write_request(self, request):
+        line = json.dumps(request) + '\n'
+        num_bytes = len(line.encode('utf-8'))
+        shard = self._shard_for(num_bytes)
+        self._requests_file.write(line)
+        shard['num_requests'] += 1
+        shard['num_bytes'] += num_bytes
+
+    def write_hit(self, result):
+        self._shard_for(0)
+        self._hits_file.write(json.dumps(result) + '\n')
+
+    def close(self):
+        for f in (self._requests_file, self._hits_file):
+            if f is not None and not f.closed:
+                f.close()
+
+
+def merge_shard_results(shard, out_file):
+    """
+    Writes the judge results and cache hits of one shard to `out_file` in request order, and returns the keys of the
+    shard's requests that have no result.
+    """
+    results = {}
+    for record in read_jsonl(shard['results']):
+        results[record['key']] = record
+    for record in read_jsonl(shard['hits']):
+        results[record['key']] = record
+    missing = [request['key'] for request in read_jsonl(shard['requests']) if request['key'] not in results]
+    for key in sorted(results, key=request_index):
+        out_file.write(json.dumps(results[key]) + '\n')
+    return missing
@@ -0,0 +1,186 @@
+'''
+Local stand-in for the Gemini generateContent endpoint, so the long-form evaluation can be tested and benchmarked
+offline. It reads the dimension names out of the rubric in the request, and returns one schema-valid score per
+dimension. Scores are a deterministic function of the request text, so repeated runs give identical results.
+Cached contexts (cachedContents) are kept in memory, and token counts are reported in usageMetadata like Gemini does.
+
+    python stub_judge_server.py --port 8765
+    python evaluate_long_form.py --mode online --judge_url http://127.0.0.1:8765 --input_json results.json
+
+'''
+
+import argparse
+import hashlib
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ENDPOINT_PATTERN = re.compile(r'^/v1beta/models/([^/:]+):generateContent$')
+CACHE_ENDPOINT = '/v1beta/cachedContents'
+TASK_PATTERN = re.compile(r'^Task Type: (.+)$', re.MULTILINE)
+# Dimension lines of the rubric look like "- Agency of Advice: Does the advice ..." followed by "  Rubric:". Requiring
+# the rubric line keeps bullet points in the judged response from being read as dimensions.
+DIMENSION_PATTERN = re.compile(r'^- ([^:\n]+):.*\n  Rubric:', re.MULTILINE)
+
+
+def request_text(request):
+    """
+    Returns all text of a generateContent request: the system instruction followed by the contents.
+    """
+    texts = []
+    for content in [request.get('systemInstruction') or {}] + request.get('contents', []):
+        texts.extend(part.get('text', '') for part in content.get('parts', []))
+    return '\n'.join(texts)
+
+
+def count_tokens(text):
+    """
+    Rough token count (words and punctuation marks), used to report the size of requests.
+    """
+    return len(re.findall(r"\w+|[^\w\s]", text))
+
+
+def rubric_section(text):
+    """
+    Returns the part of the request text with the rubric to apply. If the text holds the rubrics of several tasks (a
+    shared system instruction), that is the section of the task type named last, i.e. the one in the request.
+    """
+    tasks = TASK_PATTERN.findall(text)
+    if len(set(tasks)) <= 1:
+        return text
+    for section in re.split(r'^(?=Task Type: )', text, flags=re.MULTILINE):
+        if section.startswith(f"Task Type: {tasks[-1]}\n") and DIMENSION_PATTERN.search(section):
+            return section
+    return text
+
+
+def stub_scores(text):
+    """
+    Returns a deterministic score between 1 and 5 for every rubric dimension named in the request text.
+    """
+    dimensions = list(dict.fromkeys(DIMENSION_PATTERN.findall(rubric_section(text))))
+    digest = hashlib.sha256(text.encode('utf-8')).digest()
+    return [
+        {
+            'dimension': dimension,
+            'score': 1 + digest[idx % len(digest)] % 5,
+            'notes': f"Stub score for {dimension}."
+        }
+        for idx, dimension in enumerate(dimensions)
+    ]
+
+
+class StubJudgeHandler(BaseHTTPRequestHandler):
+    latency = 0.0
+    fail_every = 0
+    verbose = False
+    num_requests = 0
+    counter_lock = threading.Lock()
+    cached_contents = {}
+
+    def do_POST(self):
+        path = self.path.split('?')[0]
+        if path == CACHE_ENDPOINT:
+            self.create_cached_content()
+            return
+        match = ENDPOINT_PATTERN.match(path)
+        if not match:
+            self.send_json(404, {'error': {'code': 404, 'message': f"Unknown endpoint {self.path}"}})
+            return
+
+        with StubJudgeHandler.counter_lock:
+            StubJudgeHandler.num_requests += 1
+            request_number = StubJudgeHandler.num_requests
+
+        request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        if self.latency:
+            time.sleep(self.latency)
+        # Every fail_every-th request is rejected as rate limited, to exercise the client's retries.
+        if self.fail_every and request_number % self.fail_every == 0:
+            self.send_json(429, {'error': {'code': 429, 'message': "Stub rate limit."}}, {'Retry-After': '0'})
+            return
+
+        cached_text = ''
+        if 'cachedContent' in request:
+            if request['cachedContent'] not in self.cached_contents:
+                self.send_json(404, {'error': {'code': 404, 'message': f"Unknown cached content {request['cachedContent']}"}})
+                return
+            cached_text = self.cached_contents[request['cachedContent']]
+
+        text = '\n'.join(filter(None, [cached_text, request_text(request)]))
+        answer = json.dumps(stub_scores(text))
+        prompt_tokens, answer_tokens = count_tokens(text), count_tokens(answer)
+        self.send_json(200, {
+            'candidates': [{
+                'content': {'parts': [{'text': answer}], 'role': 'model'},
+                'finishReason': 'STOP',
+                'index': 0
+            }],
+            'usageMetadata': {
+                'promptTokenCount': prompt_tokens,
+                'candidatesTokenCount': answer_tokens,
+                'cachedContentTokenCount': count_tokens(cached_text),
+                'totalTokenCount': prompt_tokens + answer_tokens
+            },
+            'modelVersion': match.group(1)
+        })
+
+    def create_cached_content(self):
+        cached_content = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        text = request_text(cached_content)
+        name = 'cachedContents/' + hashlib.sha256(text.encode('utf-8')).hexdigest()[:16]
+        self.cached_contents[name] = text
+        self.send_json(200, {
+            'name': name,
+            'model': cached_content.get('model'),
+            'usageMetadata': {'totalTokenCount': count_tokens(text)}
+        })
+
+    def do_DELETE(self):
+        name = self.path.split('?')[0][len('/v1beta/'):]
+        if self.cached_contents.pop(name, None) is None:
+            self.send_json(404, {'error': {'code': 404, 'message': f"Unknown cached content {name}"}})
+            return
+        self.send_json(200, {})
+
+    def send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        if self.verbose:
+            super().log_message(format, *args)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run a local deterministic stand-in for the Gemini judge.")
+    parser.add_argument('--host', type=str, default='127.0.0.1',
+                        help="Address to listen on. Default is 127.0.0.1.")
+    parser.add_argument('--port', type=int, default=8765,
+                        help="Port to listen on. Default is 8765.")
+    parser.add_argument('--latency_ms', type=float, default=0.0,
+                        help="Artificial latency added to every request, in milliseconds. Default is 0.")
+    parser.add_argument('--fail_every', type=int, default=0,
+                        help="Reject every n-th request with HTTP 429 to exercise retries. Default is 0 (never).")
+    parser.add_argument('--verbose', action='store_true',
+                        help="Log every request.")
+    args = parser.parse_args()
+
+    StubJudgeHandler.latency = args.latency_ms / 1000.0
+    StubJudgeHandler.fail_every = args.fail_every
+    StubJudgeHandler.verbose = args.verbose
+    server = ThreadingHTTPServer((args.host, args.port), StubJudgeHandler)
+    print(f"Stub judge listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The long-form scripts import their sibling modules directly, as they do when run from this directory.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
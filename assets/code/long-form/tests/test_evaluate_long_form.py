@@ -0,0 +1,42 @@
+import json
+import sys
+
+import pytest
+
+pytest.importorskip('dotenv')
+import evaluate_long_form
+from evaluate_long_form import dry_run
+
+
+def write_responses(tmp_path, audio_paths):
+    input_path = tmp_path / 'sage_long_form_results.json'
+    input_path.write_text(json.dumps([{'Audio path': path, 'prediction': 'Ask for a raise.'} for path in audio_paths]))
+    return str(input_path)
+
+
+def test_dry_run_warns_about_missing_audio(tmp_path, capsys):
+    audio_path = tmp_path / 'prompt_16.wav'
+    audio_path.write_bytes(b'')
+    input_path = write_responses(tmp_path, [str(audio_path), str(tmp_path / 'missing.wav')])
+
+    assert dry_run(input_path, mode='online', judge_url='http://127.0.0.1:8811', work_dir=str(tmp_path / 'work'))
+    output = capsys.readouterr().out
+    assert 'WARNING: audio file not found' in output and 'Dry run OK.' in output
+
+
+def test_dry_run_fails_without_audio_paths(tmp_path, capsys):
+    input_path = write_responses(tmp_path, [''])
+    assert not dry_run(input_path, mode='online', judge_url='http://127.0.0.1:8811', work_dir=str(tmp_path / 'work'))
+    assert 'ERROR: 1 responses have no audio path' in capsys.readouterr().out
+
+
+@pytest.mark.parametrize('succeeded, exit_code', [(True, 0), (False, 1)])
+def test_main_exits_with_the_evaluation_status(tmp_path, monkeypatch, succeeded, exit_code):
+    input_path = write_responses(tmp_path, [str(tmp_path / 'prompt_16.wav')])
+    monkeypatch.setattr(evaluate_long_form, 'load_dotenv', lambda: None)
+    monkeypatch.setattr(evaluate_long_form, 'evaluate', lambda *args, **kwargs: succeeded)
+    monkeypatch.setattr(sys, 'argv', ['evaluate_long_form.py', '--input_json', input_path, '--mode', 'online',
+                                      '--judge_url', 'http://127.0.0.1:8811'])
+    with pytest.raises(SystemExit) as exit_info:
+        evaluate_long_form.main()
+    assert exit_info.value.code == exit_code
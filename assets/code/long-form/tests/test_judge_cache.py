@@ -0,0 +1,93 @@
+import json
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+from judge_cache import JudgeCache, is_valid_result, request_hash
+from stub_judge_server import StubJudgeHandler
+
+REQUEST = {
+    'contents': [{'role': 'user', 'parts': [{'text': 'Task Type: Story\n\nResponse: "Once upon a time."'}]}],
+    'generationConfig': {'responseMimeType': 'application/json', 'responseSchema': {'type': 'OBJECT'}},
+}
+RESPONSE = {'candidates': [{'content': {'parts': [{'text': '{"Story": 4}'}], 'role': 'model'}}]}
+
+
+def edited(request, text):
+    return dict(request, contents=[{'role': 'user', 'parts': [{'text': text}]}])
+
+
+# --- Keys ---
+
+def test_request_hash_ignores_key_order():
+    reordered = {'generationConfig': REQUEST['generationConfig'], 'contents': REQUEST['contents']}
+    assert request_hash('gemini-2.5-flash', REQUEST) == request_hash('gemini-2.5-flash', reordered)
+
+
+def test_request_hash_depends_on_the_judge_and_every_part_of_the_request():
+    key = request_hash('gemini-2.5-flash', REQUEST)
+    assert request_hash('gemini-2.5-pro', REQUEST) != key
+    assert request_hash('gemini-2.5-flash', edited(REQUEST, 'Task Type: Story\n\nResponse: "Once upon a time!"')) != key
+    assert request_hash('gemini-2.5-flash', dict(REQUEST, generationConfig={'responseMimeType': 'text/plain'})) != key
+
+
+def test_only_answered_results_are_valid():
+    assert is_valid_result({'key': 'request_1', 'response': RESPONSE})
+    assert not is_valid_result({'key': 'request_1', 'error': {'message': 'timeout'}})
+    assert not is_valid_result({'key': 'request_1', 'response': {'candidates': []}})
+    assert not is_valid_result({'key': 'request_1', 'response': {'candidates': [{'finishReason': 'SAFETY'}]}})
+
+
+# --- Storage ---
+
+def test_cache_persists_and_counts_hits(tmp_path):
+    cache_path = str(tmp_path / 'cache.sqlite')
+    key = request_hash('gemini-2.5-flash', REQUEST)
+    with JudgeCache(cache_path) as cache:
+        assert cache.get(key) is None
+        cache.put_many([(key, {'candidates': []}), (key, RESPONSE)])
+
+    with JudgeCache(cache_path) as cache:
+        assert cache.get(key) == RESPONSE
+        assert cache.get(request_hash('gemini-2.5-pro', REQUEST)) is None
+        assert (cache.hits, cache.misses) == (1, 1)
+
+
+@pytest.fixture
+def stub_judge():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubJudgeHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_unchanged_responses_are_not_judged_again(tmp_path, stub_judge):
+    pytest.importorskip('dotenv')
+    from evaluate_long_form import evaluate, output_path
+
+    input_path = tmp_path / 'sage_long_form_results.json'
+    predictions = ['Ask for a raise.', 'Negotiate firmly.', 'Say nothing.']
+    input_path.write_text(json.dumps([{'Audio path': f'prompt_{idx}.wav', 'prediction': prediction}
+                                      for idx, prediction in enumerate(predictions)]))
+    kwargs = dict(mode='online', judge_url=stub_judge, requests_per_minute=6000, work_dir=str(tmp_path / 'work'),
+                  cache_path=str(tmp_path / 'cache.sqlite'))
+
+    num_requests = StubJudgeHandler.num_requests
+    assert evaluate(str(input_path), **kwargs)
+    assert StubJudgeHandler.num_requests - num_requests == 3
+    with open(output_path(str(input_path))) as f:
+        first_results = [json.loads(line) for line in f]
+
+    # Only the edited response goes to the judge; the other results come from the cache.
+    predictions[1] = 'Negotiate politely.'
+    input_path.write_text(json.dumps([{'Audio path': f'prompt_{idx}.wav', 'prediction': prediction}
+                                      for idx, prediction in enumerate(predictions)]))
+    num_requests = StubJudgeHandler.num_requests
+    assert evaluate(str(input_path), **kwargs)
+    assert StubJudgeHandler.num_requests - num_requests == 1
+    with open(output_path(str(input_path))) as f:
+        second_results = [json.loads(line) for line in f]
+    assert [second_results[idx] == first_results[idx] for idx in range(3)] == [True, False, True]
@@ -0,0 +1,175 @@
+import asyncio
+import io
+import json
+import threading
+import time
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import judges
+from judges import MIN_CACHED_TOKENS, ContextCaches, OnlineJudge, TokenBucket, prompt_token_usage
+from stub_judge_server import count_tokens
+
+REQUEST = {
+    'systemInstruction': {'parts': [{'text': 'Rubrics'}]},
+    'contents': [{'role': 'user', 'parts': [{'text': 'Task Type: Story\n\nResponse: "Once upon a time."'}]}],
+}
+
+
+# --- Cached contexts ---
+
+def test_shared_instruction_clears_the_minimum_cached_size():
+    pytest.importorskip('dotenv')
+    from evaluate_long_form import SHARED_INSTRUCTION, iter_requests
+
+    # The stub's count (words and punctuation marks) is below Gemini's subword count.
+    assert count_tokens(SHARED_INSTRUCTION) >= MIN_CACHED_TOKENS
+    requests = [req['request'] for req in iter_requests([{'prediction': 'a'}] * 4, rubric_context='cached')]
+    assert len({json.dumps(request['systemInstruction']) for request in requests}) == 1
+    assert requests[3]['contents'][0]['parts'][0]['text'].startswith('Task Type: Story\n')
+
+
+def test_context_caches_reference_one_context(monkeypatch):
+    calls = []
+
+    def call(self, url, body=None, method='POST'):
+        calls.append(url)
+        return {'name': 'cachedContents/abc', 'usageMetadata': {'totalTokenCount': 2000}}
+
+    monkeypatch.setattr(ContextCaches, '_call', call)
+    caches = ContextCaches('gemini', base_url='http://judge')
+    requests = [caches.reference(dict(REQUEST)) for _ in range(3)]
+    assert len(calls) == 1
+    assert all(request['cachedContent'] == 'cachedContents/abc' and 'systemInstruction' not in request
+               for request in requests)
+    assert caches.num_inline == 0
+
+
+def test_refused_context_is_sent_inline_with_a_warning(monkeypatch, capsys):
+    def call(self, url, body=None, method='POST'):
+        body = io.BytesIO(b'{"error": {"code": 400, "message": "Cached content is too small."}}')
+        raise urllib.error.HTTPError(url, 400, 'Bad Request', {}, body)
+
+    monkeypatch.setattr(ContextCaches, '_call', call)
+    caches = ContextCaches('gemini', base_url='http://judge')
+    assert caches.reference(dict(REQUEST)) == REQUEST
+    assert caches.reference(dict(REQUEST)) == REQUEST
+    assert caches.num_inline == 2
+    assert 'Cached content is too small.' in capsys.readouterr().out
+
+
+def test_prompt_token_usage(tmp_path):
+    results_path = tmp_path / 'results.jsonl'
+    results_path.write_text('\n'.join(json.dumps(result) for result in [
+        {'key': 'request_1', 'response': {'usageMetadata': {'promptTokenCount': 1500, 'cachedContentTokenCount': 1300}}},
+        {'key': 'request_2', 'response': {'usageMetadata': {'promptTokenCount': 600}}},
+        {'key': 'request_3', 'error': {'message': 'timeout'}},
+    ]) + '\n')
+    assert prompt_token_usage([str(results_path)]) == (2100, 1300)
+
+
+# --- Rate limiting and retries ---
+
+def http_error(code, retry_after=None):
+    headers = {'Retry-After': retry_after} if retry_after is not None else {}
+    return urllib.error.HTTPError('http://judge', code, 'Error', headers, io.BytesIO(b''))
+
+
+class FlakyJudge(OnlineJudge):
+    """
+    Fails the first calls with the given errors, then answers every request.
+    """
+
+    def __init__(self, errors=(), delay=0.0, **kwargs):
+        super().__init__('gemini', base_url='http://judge', **kwargs)
+        self.errors = list(errors)
+        self.delay = delay
+        self.num_calls = 0
+        self.in_flight, self.max_seen = 0, 0
+        self.lock = threading.Lock()
+
+    def _post(self, request):
+        with self.lock:
+            self.num_calls += 1
+            if self.errors:
+                raise self.errors.pop(0)
+            self.in_flight += 1
+            self.max_seen = max(self.max_seen, self.in_flight)
+        time.sleep(self.delay)
+        with self.lock:
+            self.in_flight -= 1
+        return {'candidates': [], 'usageMetadata': {'promptTokenCount': 10}}
+
+
+def generate(judge):
+    async def main():
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            return await judge.generate(REQUEST, TokenBucket(1000.0), executor)
+    return asyncio.run(main())
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    delays = []
+
+    async def sleep(delay):
+        delays.append(delay)
+
+    monkeypatch.setattr(judges.asyncio, 'sleep', sleep)
+    return delays
+
+
+def test_token_bucket_allows_a_burst_then_paces_requests():
+    async def acquire_all(bucket, num_tokens):
+        start = time.monotonic()
+        for _ in range(num_tokens):
+            await bucket.acquire()
+        return time.monotonic() - start
+
+    assert asyncio.run(acquire_all(TokenBucket(20.0, capacity=5), 5)) < 0.1
+    # One token to start with, then one every 50 ms.
+    assert asyncio.run(acquire_all(TokenBucket(20.0, capacity=1), 5)) >= 0.18
+
+
+def test_retryable_errors_are_retried_with_capped_backoff(sleeps):
+    judge = FlakyJudge([http_error(503), http_error(429), ConnectionError(), http_error(500)], backoff_max=3.0)
+    assert generate(judge)['usageMetadata'] == {'promptTokenCount': 10}
+    assert judge.num_calls == 5 and judge.num_retries == 4
+    assert all(0 <= delay <= min(3.0, 2 ** attempt) for attempt, delay in enumerate(sleeps))
+
+
+def test_retry_after_is_respected(sleeps):
+    generate(FlakyJudge([http_error(429, retry_after='7')], backoff_max=3.0))
+    assert sleeps == [7.0]
+
+
+def test_other_errors_and_the_last_retry_are_raised(sleeps):
+    judge = FlakyJudge([http_error(400)])
+    with pytest.raises(urllib.error.HTTPError):
+        generate(judge)
+    assert judge.num_calls == 1 and sleeps == []
+
+    judge = FlakyJudge([http_error(503)] * 3, max_retries=2)
+    with pytest.raises(urllib.error.HTTPError):
+        generate(judge)
+    assert judge.num_calls == 3
+
+
+def test_run_caps_requests_in_flight_and_reports_failures(tmp_path):
+    requests_path = tmp_path / 'requests.jsonl'
+    requests_path.write_text(''.join(json.dumps({'key': f'request_{idx}', 'request': REQUEST}) + '\n'
+                                     for idx in range(6)))
+    output_path = tmp_path / 'results.jsonl'
+
+    judge = FlakyJudge(delay=0.05, max_in_flight=2, requests_per_minute=60000)
+    assert judge.run(str(requests_path), str(output_path))
+    assert judge.max_seen == 2
+    assert sorted(result['key'] for result in judges.read_requests(str(output_path))) == \
+        [f'request_{idx}' for idx in range(6)]
+
+    judge = FlakyJudge([http_error(400)], max_in_flight=1, requests_per_minute=60000)
+    assert not judge.run(str(requests_path), str(output_path))
+    errors = [result for result in judges.read_requests(str(output_path)) if 'error' in result]
+    assert len(errors) == 1 and 'HTTPError 400' in errors[0]['error']['message']
@@ -0,0 +1,142 @@
+import csv
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from longform_scores import (bootstrap_means, ensure_store, gender_differences, load_store, render_all,
+                             summarise_scores, voice_gender)
+from rubrics import EVAL_DIMENSIONS
+
+THERAPY_DIMENSIONS = ['Agency of Advice', 'Emotional Validation', 'Improvement vs Retreat']
+
+
+def judge_result(key, score):
+    ratings = [{'dimension': name, 'score': score, 'notes': 'ok'} for name in THERAPY_DIMENSIONS]
+    return {'key': key, 'response': {'candidates': [{'content': {'parts': [{'text': json.dumps(ratings)}]}}]}}
+
+
+@pytest.fixture
+def judge_files(tmp_path):
+    results_path = tmp_path / 'longform_evaluation_results_qwen2.jsonl'
+    results_path.write_text(json.dumps(judge_result('request_1', 4)) + '\n')
+    responses_path = tmp_path / 'qwen2.json'
+    responses_path.write_text(json.dumps([{'Audio path': 'tts_output/polly_Joanna/prompt_16.wav', 'prediction': ''}]))
+    return str(results_path), str(responses_path)
+
+
+def test_voice_gender():
+    assert voice_gender('polly_Joanna') == 'Female'
+    assert voice_gender('elevenlabs_male_2') == 'Male'
+    assert voice_gender('polly_Nobody') == 'Unknown'
+
+
+def test_store_is_rebuilt_when_the_responses_change(judge_files, tmp_path):
+    results_path, responses_path = judge_files
+    scores = load_store(ensure_store(results_path, responses_path))
+    assert set(scores['gender']) == {'Female'} and list(scores['score']) == [4, 4, 4]
+
+    with open(responses_path, 'w') as f:
+        json.dump([{'Audio path': 'tts_output/polly_Matthew/prompt_16.wav', 'prediction': ''}], f)
+    stat = os.stat(responses_path)
+    os.utime(responses_path, (stat.st_atime, stat.st_mtime + 10))
+    assert set(load_store(ensure_store(results_path, responses_path))['gender']) == {'Male'}
+
+
+def test_store_is_rebuilt_for_other_responses_and_reused_otherwise(judge_files, tmp_path):
+    results_path, responses_path = judge_files
+    scores_path = ensure_store(results_path, responses_path)
+    mtime = os.path.getmtime(scores_path)
+    assert ensure_store(results_path, responses_path) == scores_path
+    assert os.path.getmtime(scores_path) == mtime
+
+    other_path = tmp_path / 'other.json'
+    other_path.write_text(json.dumps([{'Audio path': 'tts_output/polly_Brian/prompt_16.wav', 'prediction': ''}]))
+    assert set(load_store(ensure_store(results_path, str(other_path)))['gender']) == {'Male'}
+
+
+# --- Bootstrap summaries ---
+
+def score_rows(run, gender, scores, task='Therapy', dim_index=0):
+    return [{'run': run, 'gender': gender, 'task': task, 'dim_index': dim_index, 'score': score} for score in scores]
+
+
+def test_bootstrap_means_resample_every_group():
+    counts = np.array([[0, 0, 10, 0, 0], [5, 0, 0, 0, 5], [1, 2, 3, 4, 5]])
+    draws = bootstrap_means(counts, num_resamples=2000, seed=1)
+    assert draws.shape == (2000, 3)
+    assert np.all(draws[:, 0] == 3.0)
+    assert np.all((draws[:, 1] >= 1) & (draws[:, 1] <= 5))
+    assert np.allclose(draws.mean(axis=0), counts @ np.arange(1, 6) / counts.sum(axis=1), atol=0.05)
+    assert np.array_equal(bootstrap_means(counts, num_resamples=2000, seed=1), draws)
+
+
+def test_summary_intervals_contain_the_mean_and_shrink_with_more_scores():
+    scores = pd.DataFrame(score_rows('qwen2', 'Female', [2, 4] * 5) + score_rows('qwen2', 'Male', [2, 4] * 50)
+                          + score_rows('qwen2', 'Male', [5] * 4, task='Story', dim_index=2))
+    summary, draws = summarise_scores(scores, num_resamples=2000)
+    assert draws.shape == (2000, len(summary))
+
+    female, male = summary.loc[('qwen2', 'Female', 'Therapy', 0)], summary.loc[('qwen2', 'Male', 'Therapy', 0)]
+    assert (female['n'], female['mean'], male['n'], male['mean']) == (10, 3.0, 100, 3.0)
+    assert female['ci_low'] < 3.0 < female['ci_high']
+    assert male['ci_high'] - male['ci_low'] < female['ci_high'] - female['ci_low']
+    assert tuple(summary.loc[('qwen2', 'Male', 'Story', 2), ['mean', 'ci_low', 'ci_high']]) == (5.0, 5.0, 5.0)
+
+
+def test_gender_differences_pair_female_and_male_cells():
+    scores = pd.DataFrame(score_rows('qwen2', 'Female', [4, 5] * 20) + score_rows('qwen2', 'Male', [2, 3] * 20)
+                          + score_rows('qwen2', 'Female', [3], task='Story'))
+    summary, draws = summarise_scores(scores, num_resamples=2000)
+    differences = gender_differences(summary, draws)
+
+    # The Story cell has no male scores to compare with.
+    assert len(differences) == 1
+    row = differences.iloc[0]
+    assert (row['run'], row['task'], row['dim_index']) == ('qwen2', 'Therapy', 0)
+    assert (row['female'], row['male'], row['difference']) == (4.5, 2.5, 2.0)
+    assert 1.5 < row['ci_low'] < 2.0 < row['ci_high'] < 2.5
+
+
+# --- Rendering ---
+
+def write_run(tmp_path, name, female_score, male_score):
+    """
+    Writes the judge results and responses of one run: every task once per voice, with one score per gender.
+    """
+    results, responses = [], []
+    for voice, score in [('polly_Joanna', female_score), ('polly_Matthew', male_score)]:
+        for task_info in EVAL_DIMENSIONS:
+            ratings = [{'dimension': dim['name'], 'score': score, 'notes': ''} for dim in task_info['Dimensions']]
+            key = f'request_{len(results) + 1}'
+            results.append({'key': key, 'response': {'candidates': [{'content': {'parts': [{'text': json.dumps(ratings)}]}}]}})
+            responses.append({'Audio path': f'tts_output/{voice}/prompt_{len(responses)}.wav', 'prediction': ''})
+    results_path = tmp_path / f'longform_evaluation_results_{name}.jsonl'
+    results_path.write_text(''.join(json.dumps(result) + '\n' for result in results))
+    responses_path = tmp_path / f'{name}.json'
+    responses_path.write_text(json.dumps(responses))
+    return {'results': str(results_path), 'responses': str(responses_path)}
+
+
+def test_render_all_writes_every_heatmap_and_the_gender_differences(tmp_path):
+    pytest.importorskip('matplotlib')
+    config = {'anti_Lora4': [
+        dict(write_run(tmp_path, 'qwen2', 4, 2), label='qwen2\naudio'),
+        dict(write_run(tmp_path, 'qwen2_anti', 3, 3), label='SSS\nqwen2\naudio', baseline='qwen2\naudio'),
+    ]}
+    config_path = tmp_path / 'heatmaps.json'
+    config_path.write_text(json.dumps(config))
+
+    render_all(str(config_path), str(tmp_path / 'heatmaps'), num_resamples=50)
+    set_dir = tmp_path / 'heatmaps' / 'anti_Lora4'
+    assert sorted(os.listdir(set_dir)) == ['gender_differences.csv'] + [
+        f'heatmap_{ordinal}_dimensions_differences.pdf' for ordinal in ['first', 'second', 'third']]
+
+    with open(set_dir / 'gender_differences.csv') as f:
+        rows = list(csv.DictReader(f))
+    assert len(rows) == 2 * len(EVAL_DIMENSIONS) * 3
+    assert {row['run'] for row in rows} == {'qwen2 audio', 'SSS qwen2 audio'}
+    assert {float(row['difference']) for row in rows if row['run'] == 'qwen2 audio'} == {2.0}
+    assert {float(row['difference']) for row in rows if row['run'] == 'SSS qwen2 audio'} == {0.0}
@@ -0,0 +1,98 @@
+import io
+import json
+
+import pytest
+
+from request_shards import ShardWriter, iter_json_array, merge_shard_results, read_jsonl
+
+RESPONSES = [
+    {'Audio path': 'prompt_0.wav', 'prediction': 'Ask for a raise.'},
+    {'Audio path': 'prompt_1.wav', 'prediction': 'Braces { and ] inside a "quoted" string, and a comma, too.'},
+    {'Audio path': 'prompt_2.wav', 'prediction': 'Ünïcödé — 面试', 'scores': [1, 2.5, None, True]},
+    {'Audio path': 'prompt_3.wav', 'prediction': '', 'nested': {'list': [[], {}], 'escaped': '\\"\n'}},
+]
+
+
+# --- Incremental JSON parsing ---
+
+@pytest.mark.parametrize('indent', [None, 4])
+@pytest.mark.parametrize('chunk_size', [1, 7, 64, 1 << 16])
+def test_iter_json_array_matches_json_load(tmp_path, indent, chunk_size):
+    json_path = tmp_path / 'results.json'
+    json_path.write_text(json.dumps(RESPONSES, indent=indent, ensure_ascii=False), encoding='utf-8')
+    assert list(iter_json_array(str(json_path), chunk_size=chunk_size)) == RESPONSES
+
+
+def test_iter_json_array_of_an_empty_list(tmp_path):
+    json_path = tmp_path / 'results.json'
+    json_path.write_text('\n  [ ]\n')
+    assert list(iter_json_array(str(json_path))) == []
+
+
+def test_iter_json_array_rejects_other_files(tmp_path):
+    json_path = tmp_path / 'results.json'
+    json_path.write_text(json.dumps({'results': RESPONSES}))
+    with pytest.raises(ValueError, match='JSON list'):
+        list(iter_json_array(str(json_path)))
+
+
+def test_iter_json_array_reports_a_truncated_file(tmp_path):
+    json_path = tmp_path / 'results.json'
+    json_path.write_text(json.dumps(RESPONSES)[:-40])
+    elements = iter_json_array(str(json_path), chunk_size=16)
+    assert next(elements) == RESPONSES[0]
+    with pytest.raises(json.JSONDecodeError):
+        list(elements)
+
+
+# --- Shards ---
+
+def request(idx, text='Rate this response.'):
+    return {'key': f'request_{idx}', 'request': {'contents': [{'parts': [{'text': text}]}]}}
+
+
+def test_shards_stay_under_the_item_and_byte_limits(tmp_path):
+    line_bytes = len(json.dumps(request(0)) + '\n')
+    writer = ShardWriter(str(tmp_path / 'run'), max_bytes=3 * line_bytes, max_items=4)
+    for idx in range(10):
+        writer.write_request(request(idx))
+    writer.write_request(request(10, text='x' * 10 * line_bytes))
+    writer.close()
+
+    assert [shard['num_requests'] for shard in writer.shards] == [3, 3, 3, 1, 1]
+    assert all(shard['num_bytes'] <= 3 * line_bytes for shard in writer.shards[:-1])
+    keys = [line['key'] for shard in writer.shards for line in read_jsonl(shard['requests'])]
+    assert keys == [f'request_{idx}' for idx in range(11)]
+
+
+def test_cache_hits_count_towards_the_item_limit_only(tmp_path):
+    writer = ShardWriter(str(tmp_path / 'run'), max_bytes=1, max_items=3)
+    writer.write_hit({'key': 'request_0', 'response': {}})
+    writer.write_hit({'key': 'request_1', 'response': {}})
+    writer.write_request(request(2))
+    writer.write_hit({'key': 'request_3', 'response': {}})
+    writer.close()
+
+    assert [(shard['num_items'], shard['num_requests']) for shard in writer.shards] == [(3, 1), (1, 0)]
+
+
+def test_merge_restores_request_order_and_reports_missing_results(tmp_path):
+    writer = ShardWriter(str(tmp_path / 'run'))
+    for idx in range(12):
+        if idx % 3 == 0:
+            writer.write_hit({'key': f'request_{idx}', 'response': {'cached': True}})
+        else:
+            writer.write_request(request(idx))
+    writer.close()
+    shard, = writer.shards
+
+    # Results arrive out of order and one request got none.
+    with open(shard['results'], 'w') as f:
+        for idx in [11, 2, 10, 1, 5, 8, 7]:
+            f.write(json.dumps({'key': f'request_{idx}', 'response': {}}) + '\n')
+
+    out_file = io.StringIO()
+    assert merge_shard_results(shard, out_file) == ['request_4']
+    merged = [json.loads(line) for line in out_file.getvalue().splitlines()]
+    assert [record['key'] for record in merged] == [f'request_{idx}' for idx in range(12) if idx != 4]
+    assert merged[3] == {'key': 'request_3', 'response': {'cached': True}}